@@ -117,6 +117,35 @@ const MarkdownRenderer = ({ content }) => {
 };
 
 
+// Reads a text/event-stream response, calling onEvent({ id, event, data }) for each event.
+// Resolves when the stream ends or the connection drops; the caller decides whether to resume.
+const readEventStream = async (res, onEvent) => {
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  try {
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      let boundary;
+      while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+        const raw = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+        const event = { id: null, event: "message", data: null };
+        raw.split("\n").forEach(line => {
+          if (line.startsWith("id: ")) event.id = line.slice(4);
+          else if (line.startsWith("event: ")) event.event = line.slice(7);
+          else if (line.startsWith("data: ")) event.data = JSON.parse(line.slice(6));
+        });
+        if (event.data !== null) onEvent(event);
+      }
+    }
+  } catch (err) {
+    console.warn("Stream interrupted:", err);
+  }
+};
+
 export default function App() {
   const backendUrl = process.env.REACT_APP_BACKEND_URL;
 
@@ -125,6 +154,10 @@ export default function App() {
   const [loading, setLoading] = useState(false);
   const [imageLoading, setImageLoading] = useState(false);
   const [history, setHistory] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [searchQuery, setSearchQuery] = useState("");
+  const [searchResults, setSearchResults] = useState(null); // null: not searching, show history
+  const [searchNextOffset, setSearchNextOffset] = useState(null);
   const [userPlan, setUserPlan] = useState("free");
   const [credits, setCredits] = useState(0);
   const [activeChat, setActiveChat] = useState(null);
@@ -152,21 +185,24 @@ export default function App() {
     }
   }, [backendUrl]);
 
-  const fetchPosts = useCallback(async () => {
+  // The sidebar only needs titles and previews; full messages are loaded when a chat is opened
+  const fetchPosts = useCallback(async (cursor = null) => {
     try {
       const token = localStorage.getItem("token");
-      const res = await fetch(`${backendUrl}/api/posts`, {
+      const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : "";
+      const res = await fetch(`${backendUrl}/api/posts${query}`, {
         headers: { Authorization: `Bearer ${token}` },
       });
       if (res.ok) {
         const data = await res.json();
-        const formattedHistory = data.map(post => ({
+        const formattedHistory = data.items.map(post => ({
           id: post.id,
           title: post.title,
-          messages: JSON.parse(post.messages),
+          preview: post.preview,
           createdAt: new Date(post.created_at),
         }));
-        setHistory(formattedHistory);
+        setHistory(prev => (cursor ? [...prev, ...formattedHistory] : formattedHistory));
+        setNextCursor(data.next_cursor);
       }
     } catch (err) {
       console.error("Failed to fetch posts:", err);
@@ -183,17 +219,59 @@ export default function App() {
     fetchPosts();
   }, [backendUrl, fetchUserInfo, fetchPosts]);
 
+  // Server-side full-text search over titles and messages; results carry <mark>-highlighted, escaped HTML
+  const fetchSearch = useCallback(async (query, offset = 0) => {
+    try {
+      const token = localStorage.getItem("token");
+      const res = await fetch(`${backendUrl}/api/search?q=${encodeURIComponent(query)}&offset=${offset}`, {
+        headers: { Authorization: `Bearer ${token}` },
+      });
+      if (res.ok) {
+        const data = await res.json();
+        setSearchResults(prev => (offset ? [...(prev || []), ...data.items] : data.items));
+        setSearchNextOffset(data.next_offset);
+      } else {
+        setSearchResults([]);
+        setSearchNextOffset(null);
+      }
+    } catch (err) {
+      console.error("Search failed:", err);
+    }
+  }, [backendUrl]);
+
+  useEffect(() => {
+    const query = searchQuery.trim();
+    if (!query) {
+      setSearchResults(null);
+      return;
+    }
+    const timer = setTimeout(() => fetchSearch(query), 300);
+    return () => clearTimeout(timer);
+  }, [searchQuery, fetchSearch]);
+
   useEffect(() => {
     if (chatContainerRef.current) {
       chatContainerRef.current.scrollTop = chatContainerRef.current.scrollHeight;
     }
   }, [activeChat]);
 
-  const handleSelectChat = (chatId) => {
+  const handleSelectChat = async (chatId) => {
     const chat = history.find(c => c.id === chatId);
-    setActiveChat(chat);
     setPrompt("");
     setShowSidebar(false);
+    try {
+      const token = localStorage.getItem("token");
+      const res = await fetch(`${backendUrl}/api/posts/${chatId}`, {
+        headers: { Authorization: `Bearer ${token}` },
+      });
+      if (res.ok) {
+        const data = await res.json();
+        // Search hits may not be in the loaded history page
+        setActiveChat({ ...chat, id: chatId, title: data.title, messages: typeof data.messages === "string" ? JSON.parse(data.messages) : data.messages });
+      }
+    } catch (err) {
+      console.error("Failed to load chat:", err);
+    }
   };
 
   const handleNewChat = () => {
@@ -229,6 +307,7 @@ export default function App() {
         method: "POST",
         headers: {
           "Content-Type": "application/json",
+          Accept: "text/event-stream",
           Authorization: `Bearer ${token}`,
         },
         body: JSON.stringify({
@@ -243,16 +322,25 @@ export default function App() {
         window.location.href = "/pricing";
         return;
       }
+      if (res.status === 429) {
+        // Over the plan's rate or stream limit: nothing was generated or charged, so put the prompt back
+        const data = await res.json();
+        const retryAfter = res.headers.get("Retry-After") || data.retry_after;
+        setActiveChat(activeChat);
+        setPrompt(prompt);
+        alert(`${data.error || "Too many requests."} Try again in ${retryAfter} seconds.`);
+        return;
+      }
       if (!res.ok || !res.body) {
         throw new Error("Failed to get a response from the server.");
       }
 
-      const reader = res.body.getReader();
-      const decoder = new TextDecoder();
       let fullResponse = "";
+      let streamId = null;
+      let lastEventId = null;
+      let final = null;
 
-      const updateContent = (newChunk) => {
-        fullResponse += newChunk;
+      const showContent = () => {
         setActiveChat(prev => {
           if (!prev) return null;
           const updatedMessages = prev.messages.slice(0, -1).concat([{ role: "assistant", content: fullResponse }]);
@@ -260,21 +348,55 @@ export default function App() {
         });
       };
 
-      while (true) {
-        const { value, done } = await reader.read();
-        if (done) break;
-        const chunk = decoder.decode(value, { stream: true });
-        updateContent(chunk);
-      }
+      const onEvent = ({ id, event, data }) => {
+        if (id) lastEventId = id;
+        if (event === "start") {
+          streamId = data.stream_id;
+          setActiveChat(prev => (prev ? { ...prev, id: data.post_id } : prev));
+        } else if (event === "token") {
+          fullResponse += data.content;
+          showContent();
+        } else if (event === "snapshot") {
+          fullResponse = data.content;
+          showContent();
+        } else if (event === "done" || event === "error") {
+          final = { event, ...data };
+        }
+      };
 
-      const finalChat = activeChat ? { ...activeChat, messages: activeChat.messages.slice(0, -1).concat([{ role: "assistant", content: fullResponse }]) } : tempChat;
-      const lastMessage = finalChat.messages[finalChat.messages.length - 1];
-      if (lastMessage && lastMessage.content.includes("Do you want to create an image")) {
+      await readEventStream(res, onEvent);
+      // The connection dropped before the final event: pick the stream up where we left off
+      for (let attempt = 1; !final && streamId && attempt <= 3; attempt++) {
+        await new Promise(resolve => setTimeout(resolve, 1000 * attempt));
+        const resumed = await fetch(`${backendUrl}/api/generate_stream/${streamId}`, {
+          headers: {
+            Accept: "text/event-stream",
+            Authorization: `Bearer ${token}`,
+            ...(lastEventId ? { "Last-Event-ID": lastEventId } : {}),
+          },
+        }).catch(() => null);
+        if (!resumed || !resumed.ok) break;
+        await readEventStream(resumed, onEvent);
+      }
+      if (!final) {
+        throw new Error("The response stream ended early.");
+      }
+      if (final.event === "error") {
+        fullResponse = "❌ Error: Something went wrong with the AI generation.";
+        showContent();
+      } else if (fullResponse.includes("Do you want to create an image")) {
         setShowImagePrompt(true);
       }
 
-      fetchUserInfo();
-      fetchPosts();
+      // The final event carries what the /api/me and /api/posts refetches used to provide
+      setUserPlan(final.plan);
+      setCredits(final.credit_remaining ?? "∞");
+      if (!activeChat) {
+        setHistory(prev => [
+          { id: final.post_id, title: final.title, preview: prompt.substring(0, 120), createdAt: new Date() },
+          ...prev.filter(c => c.id !== final.post_id),
+        ]);
+      }
 
     } catch (err) {
       console.error(err);
@@ -320,18 +442,16 @@ export default function App() {
           return { ...prev, messages: updatedMessages };
         });
         
+        // Only the edited message goes over the wire, not the whole history
         await fetch(`${backendUrl}/api/posts/${activeChat.id}`, {
-          method: "PUT",
+          method: "PATCH",
           headers: {
             "Content-Type": "application/json",
             Authorization: `Bearer ${token}`,
           },
-          body: JSON.stringify({ messages: JSON.stringify(activeChat.messages.map((msg, index) => {
-            if (index === activeChat.messages.length - 1) {
-              return { ...msg, imageUrl: imageUrl };
-            }
-            return msg;
-          })) }),
+          body: JSON.stringify({
+            ops: [{ op: "edit", index: activeChat.messages.length - 1, message: { ...lastAssistantMessage, imageUrl } }],
+          }),
         });
         
       } else {
@@ -360,7 +480,21 @@ export default function App() {
         throw new Error(`Server responded with status: ${res.status}`);
       }
 
-      const data = await res.json();
+      let data = await res.json();
+      // 202: the image is being generated; poll the job until it is done (cache hits come back as 200)
+      while (data.status === "queued" || data.status === "running") {
+        await new Promise((resolve) => setTimeout(resolve, 1000));
+        const poll = await fetch(data.status_url || `${backendUrl}/api/generate_image/${data.job_id}`, {
+          headers: { Authorization: `Bearer ${token}` },
+        });
+        if (!poll.ok) {
+          throw new Error(`Server responded with status: ${poll.status}`);
+        }
+        data = await poll.json();
+      }
+      if (data.status === "failed") {
+        throw new Error(data.error || "Image generation failed");
+      }
       return data.imageUrl;
     } catch (error) {
       console.error("Image generation API call failed:", error);
@@ -380,12 +514,12 @@ export default function App() {
     try {
       const token = localStorage.getItem("token");
       const res = await fetch(`${backendUrl}/api/posts/${chatId}`, {
-        method: "PUT",
+        method: "PATCH",
         headers: {
           "Content-Type": "application/json",
           Authorization: `Bearer ${token}`,
         },
-        body: JSON.stringify({ title: newTitle }),
+        body: JSON.stringify({ ops: [{ op: "rename", title: newTitle }] }),
       });
 
       if (res.ok) {
@@ -517,8 +651,39 @@ export default function App() {
             </button>
           </div>
         </div>
+        <div className="px-4 mb-3">
+          <input
+            type="search"
+            value={searchQuery}
+            onChange={(e) => setSearchQuery(e.target.value)}
+            placeholder="Search chats..."
+            className="w-full p-2 text-sm rounded-lg bg-[#1D2036] border border-white/10 focus:outline-none focus:border-white/30"
+          />
+        </div>
         <div className="flex-grow overflow-y-auto px-4 space-y-2">
-          {history.length === 0 ? (
+          {searchResults !== null ? (
+            <>
+              {searchResults.length === 0 && <p className="text-white/50 text-sm">No matching chats.</p>}
+              {searchResults.map(result => (
+                <div
+                  key={result.id}
+                  className={`p-3 rounded-lg cursor-pointer transition ${activeChat?.id === result.id ? 'bg-[#2D335A]' : 'bg-[#1D2036] hover:bg-[#2D335A]'}`}
+                  onClick={() => handleSelectChat(result.id)}
+                >
+                  <h4 className="text-sm font-semibold truncate" dangerouslySetInnerHTML={{ __html: result.title_html || "Untitled Chat" }} />
+                  {result.snippet_html && <p className="text-xs text-white/50" dangerouslySetInnerHTML={{ __html: result.snippet_html }} />}
+                </div>
+              ))}
+              {searchNextOffset !== null && (
+                <button
+                  onClick={() => fetchSearch(searchQuery.trim(), searchNextOffset)}
+                  className="w-full p-2 text-sm text-white/70 rounded-lg bg-white/5 hover:bg-white/10 transition"
+                >
+                  More results
+                </button>
+              )}
+            </>
+          ) : history.length === 0 ? (
             <p className="text-white/50 text-sm">No chat history. Start a new chat!</p>
           ) : (
             history.map(chat => (
@@ -529,6 +694,7 @@ export default function App() {
               >
                 <div className="flex-grow overflow-hidden">
                   <h4 className="text-sm font-semibold truncate">{chat.title || "Untitled Chat"}</h4>
+                  {chat.preview && <p className="text-xs text-white/50 truncate">{chat.preview}</p>}
                 </div>
                 <div className="flex space-x-2 opacity-0 group-hover:opacity-100 transition-opacity">
                   <button onClick={(e) => handleRenameChat(e, chat.id)} className="p-1 rounded-md hover:bg-white/10">
@@ -541,6 +707,14 @@ export default function App() {
               </div>
             ))
           )}
+          {searchResults === null && nextCursor && (
+            <button
+              onClick={() => fetchPosts(nextCursor)}
+              className="w-full p-2 text-sm text-white/70 rounded-lg bg-white/5 hover:bg-white/10 transition"
+            >
+              Load more
+            </button>
+          )}
         </div>
         <div className="mt-auto p-4 border-t border-white/10">
           <p className="text-sm">Plan: <strong>{userPlan}</strong></p>
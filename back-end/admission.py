@@ -0,0 +1,309 @@
+import asyncio
+import math
+import os
+import secrets
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+
+try:
+    import redis
+except ImportError:  # optional: only needed for the shared backend
+    redis = None
+
+# ------------------- CONFIG -------------------
+# Generations streaming upstream at once in this process; the rest wait in a per-user fair queue
+ADMISSION_MAX_UPSTREAM = int(os.getenv("ADMISSION_MAX_UPSTREAM", "200"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "500"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10"))  # seconds
+# Retry-After sent when a user is at their concurrent-stream cap
+ADMISSION_BUSY_RETRY_AFTER = int(os.getenv("ADMISSION_BUSY_RETRY_AFTER", "5"))
+# Share buckets and stream counts across workers through Redis
+ADMISSION_REDIS_URL = os.getenv("ADMISSION_REDIS_URL")
+# A lease outlives a crashed worker by at most this long (seconds)
+STREAM_LEASE_TTL = float(os.getenv("ADMISSION_STREAM_LEASE_TTL", "600"))
+REDIS_KEY_PREFIX = "admission:"
+
+
+@dataclass(frozen=True)
+class PlanLimits:
+    rate_per_minute: float  # sustained generations per minute
+    burst: int  # generations allowed back to back
+    max_streams: int  # concurrent generations
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is over its limits; answered with 429 and Retry-After."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, retry_after)
+
+
+# ------------------- BACKENDS -------------------
+class MemoryBackend:
+    """Per-worker token buckets and stream leases."""
+
+    def __init__(self):
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._leases: Dict[str, Dict[str, float]] = {}
+
+    def take(self, key: str, rate: float, burst: int) -> float:
+        """Take one token; returns 0 when allowed, else seconds until one is available."""
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (float(burst), now))
+        tokens = min(float(burst), tokens + (now - updated) * rate)
+        if tokens < 1:
+            self._buckets[key] = (tokens, now)
+            return (1 - tokens) / rate
+        self._buckets[key] = (tokens - 1, now)
+        return 0.0
+
+    def acquire_lease(self, key: str, lease_id: str, limit: int) -> bool:
+        now = time.monotonic()
+        leases = {k: exp for k, exp in self._leases.get(key, {}).items() if exp > now}
+        if len(leases) >= limit:
+            self._leases[key] = leases
+            return False
+        leases[lease_id] = now + STREAM_LEASE_TTL
+        self._leases[key] = leases
+        return True
+
+    def release_lease(self, key: str, lease_id: str):
+        leases = self._leases.get(key)
+        if leases is not None:
+            leases.pop(lease_id, None)
+            if not leases:
+                del self._leases[key]
+
+
+_TAKE_SCRIPT = """
+local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + (now - updated) * rate)
+local wait = 0
+if tokens < 1 then wait = (1 - tokens) / rate else tokens = tokens - 1 end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+_LEASE_SCRIPT = """
+local now, limit = tonumber(ARGV[1]), tonumber(ARGV[2])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZCARD', KEYS[1]) >= limit then return 0 end
+redis.call('ZADD', KEYS[1], now + tonumber(ARGV[4]), ARGV[3])
+redis.call('PEXPIRE', KEYS[1], math.ceil(tonumber(ARGV[4]) * 1000))
+return 1
+"""
+
+
+class RedisBackend:
+    """Shared across workers, so a user's limits hold however requests are balanced.
+
+    Leases are sorted-set members scored by expiry, so streams of a worker
+    that died without releasing them stop counting after STREAM_LEASE_TTL.
+    """
+
+    def __init__(self, url: str):
+        if redis is None:
+            raise RuntimeError("ADMISSION_REDIS_URL is set but the redis package is not installed")
+        self.client = redis.Redis.from_url(url, socket_timeout=0.2)
+        self._take = self.client.register_script(_TAKE_SCRIPT)
+        self._lease = self.client.register_script(_LEASE_SCRIPT)
+
+    def take(self, key: str, rate: float, burst: int) -> float:
+        return float(self._take(keys=[REDIS_KEY_PREFIX + "bucket:" + key], args=[rate, burst, time.time()]))
+
+    def acquire_lease(self, key: str, lease_id: str, limit: int) -> bool:
+        return bool(self._lease(keys=[REDIS_KEY_PREFIX + "streams:" + key], args=[time.time(), limit, lease_id, STREAM_LEASE_TTL]))
+
+    def release_lease(self, key: str, lease_id: str):
+        self.client.zrem(REDIS_KEY_PREFIX + "streams:" + key, lease_id)
+
+
+# ------------------- FAIR QUEUE -------------------
+class FairSemaphore:
+    """Semaphore whose waiters are served round-robin by user, not first-come.
+
+    A user with fifty queued requests gets one slot, then everyone else
+    waiting gets one, and so on.
+    """
+
+    def __init__(self, slots: int, max_waiting: int):
+        self.slots = slots
+        self.max_waiting = max_waiting
+        self.in_use = 0
+        self._queues: "OrderedDict[int, deque]" = OrderedDict()  # user_id -> waiters, in service order
+        self.waiting = 0
+
+    async def acquire(self, user_id: int, timeout: float):
+        if self.in_use < self.slots and not self.waiting:
+            self.in_use += 1
+            return
+        if self.waiting >= self.max_waiting:
+            raise AdmissionRejected("Server is at capacity", 2)
+        waiter = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(user_id, deque()).append(waiter)
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                self.release()  # granted just as we gave up: pass it on
+            else:
+                waiter.cancel()
+                self._discard(user_id, waiter)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            raise AdmissionRejected("Server is at capacity", math.ceil(timeout / 2))
+
+    def _discard(self, user_id: int, waiter: asyncio.Future):
+        queue = self._queues.get(user_id)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            self.waiting -= 1
+            if not queue:
+                del self._queues[user_id]
+
+    def release(self):
+        while self._queues:
+            user_id, queue = next(iter(self._queues.items()))
+            waiter = queue.popleft()
+            self.waiting -= 1
+            if queue:
+                self._queues.move_to_end(user_id)  # this user goes to the back of the rotation
+            else:
+                del self._queues[user_id]
+            if not waiter.done():
+                waiter.set_result(None)  # the slot passes straight to the waiter
+                return
+        self.in_use -= 1
+
+
+# ------------------- CONTROLLER -------------------
+class Ticket:
+    """An admitted generation; release() exactly once when it ends (extra calls are ignored)."""
+
+    def __init__(self, controller: "AdmissionController", user_key: str, lease_id: str):
+        self._controller = controller
+        self._user_key = user_key
+        self._lease_id = lease_id
+        self._released = False
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        self._controller._release(self._user_key, self._lease_id)
+
+
+class AdmissionController:
+    def __init__(self, plan_limits: Dict[str, PlanLimits], backend, max_upstream: int = ADMISSION_MAX_UPSTREAM):
+        self.plan_limits = plan_limits
+        self.backend = backend
+        self.upstream = FairSemaphore(max_upstream, ADMISSION_MAX_QUEUE)
+        self.admitted = 0
+        self.rejected = {"rate": 0, "streams": 0, "capacity": 0}
+        self.queued_seconds = 0.0
+        self.leased = 0  # stream leases this worker holds
+
+    async def _call(self, fn, *args):
+        # Only the in-process backend is cheap enough to touch on the event loop
+        if isinstance(self.backend, MemoryBackend):
+            return fn(*args)
+        return await run_in_threadpool(fn, *args)
+
+    def limits_for(self, plan: Optional[str]) -> PlanLimits:
+        return self.plan_limits.get(plan or "free", self.plan_limits["free"])
+
+    async def admit(self, user_id: int, plan: Optional[str]) -> Ticket:
+        """Check the user's stream cap and rate, then wait (fairly) for an upstream slot.
+
+        The stream lease is taken first and handed back if the rate check
+        fails, so a request turned away at the cap doesn't spend rate budget.
+        """
+        limits = self.limits_for(plan)
+        user_key = str(user_id)
+        lease_id = secrets.token_hex(8)
+        try:
+            leased = await self._call(self.backend.acquire_lease, user_key, lease_id, limits.max_streams)
+        except Exception as e:
+            print(f"Admission backend error: {e}")  # fail open rather than take generation down
+            leased = True
+        if not leased:
+            self.rejected["streams"] += 1
+            raise AdmissionRejected(
+                f"The {plan or 'free'} plan allows {limits.max_streams} generation(s) at a time",
+                ADMISSION_BUSY_RETRY_AFTER,
+            )
+        self.leased += 1
+
+        try:
+            wait = await self._call(self.backend.take, user_key, limits.rate_per_minute / 60.0, limits.burst)
+        except Exception as e:
+            print(f"Admission backend error: {e}")
+            wait = 0.0
+        except BaseException:
+            self._release_lease(user_key, lease_id)
+            raise
+        if wait > 0:
+            self._release_lease(user_key, lease_id)
+            self.rejected["rate"] += 1
+            raise AdmissionRejected(f"Rate limit for the {plan or 'free'} plan reached", math.ceil(wait))
+
+        started = time.monotonic()
+        try:
+            await self.upstream.acquire(user_id, ADMISSION_QUEUE_TIMEOUT)
+        except BaseException as e:
+            self._release_lease(user_key, lease_id)
+            if isinstance(e, AdmissionRejected):
+                self.rejected["capacity"] += 1
+            raise
+        self.queued_seconds += time.monotonic() - started
+        self.admitted += 1
+        return Ticket(self, user_key, lease_id)
+
+    def _release_lease(self, user_key: str, lease_id: str):
+        """Give a lease back; a shared backend's call runs in the background, off the event loop."""
+        self.leased -= 1
+        if not isinstance(self.backend, MemoryBackend):
+            try:
+                asyncio.get_running_loop().run_in_executor(None, self._drop_lease, user_key, lease_id)
+                return
+            except RuntimeError:  # no loop running: release inline
+                pass
+        self._drop_lease(user_key, lease_id)
+
+    def _drop_lease(self, user_key: str, lease_id: str):
+        try:
+            self.backend.release_lease(user_key, lease_id)
+        except Exception as e:
+            print(f"Admission backend error: {e}")
+
+    def _release(self, user_key: str, lease_id: str):
+        self.upstream.release()
+        self._release_lease(user_key, lease_id)
+
+    def stats(self) -> dict:
+        return {
+            "backend": type(self.backend).__name__,
+            "upstream_in_use": self.upstream.in_use,
+            "upstream_slots": self.upstream.slots,
+            "queued": self.upstream.waiting,
+            "streams_leased": self.leased,
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "avg_queue_seconds": self.queued_seconds / self.admitted if self.admitted else 0.0,
+        }
+
+
+def make_controller(plan_limits: Dict[str, PlanLimits]) -> AdmissionController:
+    backend = RedisBackend(ADMISSION_REDIS_URL) if ADMISSION_REDIS_URL else MemoryBackend()
+    return AdmissionController(plan_limits, backend)
@@ -1,3 +1,5 @@
+import os
+import re
 from logging.config import fileConfig
 
 from sqlalchemy import engine_from_config
@@ -14,11 +16,27 @@ config = context.config
 if config.config_file_name is not None:
     fileConfig(config.config_file_name)
 
-# add your model's MetaData object here
-# for 'autogenerate' support
-# from myapp import mymodel
-# target_metadata = mymodel.Base.metadata
-target_metadata = None
+# The app reads DATABASE_URL from the environment/.env; migrations use the same database
+from dotenv import load_dotenv
+
+load_dotenv()
+if os.getenv("DATABASE_URL"):
+    config.set_main_option("sqlalchemy.url", os.environ["DATABASE_URL"].replace("%", "%%"))
+
+# The models are the source of truth for autogenerate and `alembic check`;
+# importing them builds the app's engine, which needs a DATABASE_URL
+os.environ.setdefault("DATABASE_URL", config.get_main_option("sqlalchemy.url"))
+import models  # noqa: E402
+
+target_metadata = models.Base.metadata
+
+# search.py's full-text index lives outside the models: FTS5 tables (and their
+# shadow tables) on SQLite, expression GIN indexes on PostgreSQL
+FTS_NAME = re.compile(r"^(messages|posts|archives)_fts(_\w+)?$|_fts$")
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    return not (type_ in ("table", "index") and name and FTS_NAME.search(name))
 
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
@@ -42,6 +60,7 @@ def run_migrations_offline() -> None:
     context.configure(
         url=url,
         target_metadata=target_metadata,
+        include_object=include_object,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
     )
@@ -65,7 +84,7 @@ def run_migrations_online() -> None:
 
     with connectable.connect() as connection:
         context.configure(
-            connection=connection, target_metadata=target_metadata
+            connection=connection, target_metadata=target_metadata, include_object=include_object
         )
 
         with context.begin_transaction():
@@ -0,0 +1,42 @@
+"""add post archives
+
+Revision ID: 1f6a3d8c2b57
+Revises: 7c5e2b9f4a61
+Create Date: 2026-10-17 18:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '1f6a3d8c2b57'
+down_revision: Union[str, Sequence[str], None] = '7c5e2b9f4a61'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Plain ADD/DROP COLUMN: a batch table rebuild would drop the search triggers on posts
+    op.add_column('posts', sa.Column('archived_at', sa.DateTime(), nullable=True))
+    op.create_table(
+        'post_archives',
+        sa.Column('post_id', sa.Integer(), nullable=False),
+        sa.Column('codec', sa.String(length=10), nullable=False),
+        sa.Column('data', sa.LargeBinary(), nullable=False),
+        sa.Column('message_count', sa.Integer(), nullable=False),
+        sa.Column('raw_bytes', sa.Integer(), nullable=False),
+        sa.Column('stored_bytes', sa.Integer(), nullable=False),
+        sa.Column('archived_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['post_id'], ['posts.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('post_id'),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('post_archives')
+    op.drop_column('posts', 'archived_at')
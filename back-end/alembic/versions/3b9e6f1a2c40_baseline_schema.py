@@ -0,0 +1,98 @@
+"""baseline schema
+
+The tables as Base.metadata.create_all() used to create them. Databases that
+were bootstrapped that way should be stamped rather than upgraded:
+
+    alembic stamp 3b9e6f1a2c40
+
+Revision ID: 3b9e6f1a2c40
+Revises:
+Create Date: 2026-10-17 09:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3b9e6f1a2c40'
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'users',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('email', sa.String(), nullable=False),
+        sa.Column('hashed_password', sa.String(), nullable=False),
+        sa.Column('plan', sa.String(), nullable=True),
+        sa.Column('credit_remaining', sa.Float(), nullable=True),
+        sa.Column('stripe_customer_id', sa.String(), nullable=True),
+        sa.Column('subscription_id', sa.String(), nullable=True),
+        sa.Column('subscription_status', sa.String(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_users_id', 'users', ['id'])
+    op.create_index('ix_users_email', 'users', ['email'], unique=True)
+
+    op.create_table(
+        'usage_records',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('prompt', sa.Text(), nullable=False),
+        sa.Column('tokens_used', sa.Integer(), nullable=True),
+        sa.Column('cost', sa.Float(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('billed', sa.Boolean(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_usage_records_id', 'usage_records', ['id'])
+
+    op.create_table(
+        'transactions',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('stripe_payment_intent_id', sa.String(), nullable=True),
+        sa.Column('amount', sa.Float(), nullable=False),
+        sa.Column('currency', sa.String(), nullable=True),
+        sa.Column('status', sa.String(), nullable=False),
+        sa.Column('plan_name', sa.String(), nullable=True),
+        sa.Column('description', sa.String(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_transactions_id', 'transactions', ['id'])
+
+    op.create_table(
+        'posts',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('title', sa.String(length=200), nullable=True),
+        sa.Column('messages', sa.Text(), nullable=False),
+        sa.Column('shared_linkedin', sa.Boolean(), nullable=True),
+        sa.Column('shared_twitter', sa.Boolean(), nullable=True),
+        sa.Column('shared_facebook', sa.Boolean(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_posts_id', 'posts', ['id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_posts_id', table_name='posts')
+    op.drop_table('posts')
+    op.drop_index('ix_transactions_id', table_name='transactions')
+    op.drop_table('transactions')
+    op.drop_index('ix_usage_records_id', table_name='usage_records')
+    op.drop_table('usage_records')
+    op.drop_index('ix_users_email', table_name='users')
+    op.drop_index('ix_users_id', table_name='users')
+    op.drop_table('users')
@@ -0,0 +1,84 @@
+"""index archived posts for search
+
+Revision ID: 4c8e1b7d9a35
+Revises: 1f6a3d8c2b57
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+import json
+import zlib
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+try:
+    import zstandard
+except ImportError:  # only needed if some archives are zstd-compressed
+    zstandard = None
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4c8e1b7d9a35'
+down_revision: Union[str, Sequence[str], None] = '1f6a3d8c2b57'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Frozen copy of the archive parts of search.SQLITE_DDL / POSTGRES_DDL as of this revision
+SQLITE_UPGRADE = [
+    "CREATE VIRTUAL TABLE archives_fts USING fts5(content, owner, content='', tokenize='porter unicode61')",
+    "INSERT INTO archives_fts(archives_fts, rank) VALUES ('rank', 'bm25(1.0, 0.0)')",
+]
+
+POSTGRES_UPGRADE = [
+    "CREATE INDEX ix_post_archives_search_fts ON post_archives USING GIN (search_vector)",
+]
+
+# Position of the message content in archive.FIELDS rows
+CONTENT = 3
+
+
+def archived_documents(bind):
+    """(post_id, user_id, text) of every post archived before archives were indexed."""
+    rows = bind.execute(sa.text(
+        "SELECT a.post_id, p.user_id, a.codec, a.data FROM post_archives a JOIN posts p ON p.id = a.post_id"
+    )).all()
+    for post_id, user_id, codec, data in rows:
+        if codec == "zstd":
+            if zstandard is None:
+                raise RuntimeError("Some archives are zstd-compressed; install zstandard to index them")
+            raw = zstandard.ZstdDecompressor().decompress(data)
+        else:
+            raw = zlib.decompress(data)
+        yield post_id, user_id, "\n".join(row[CONTENT] or "" for row in json.loads(raw))
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+    dialect = bind.dialect.name
+    op.add_column('post_archives', sa.Column('search_vector', sa.Text().with_variant(postgresql.TSVECTOR(), 'postgresql'), nullable=True))
+    for statement in {"sqlite": SQLITE_UPGRADE, "postgresql": POSTGRES_UPGRADE}.get(dialect, []):
+        op.execute(statement)
+    for post_id, user_id, content in archived_documents(bind):
+        if dialect == "sqlite":
+            bind.execute(
+                sa.text("INSERT INTO archives_fts(rowid, content, owner) VALUES (:post_id, :content, :owner)"),
+                {"post_id": post_id, "content": content, "owner": f"u{user_id}"},
+            )
+        elif dialect == "postgresql":
+            bind.execute(
+                sa.text("UPDATE post_archives SET search_vector = to_tsvector('english', :content) WHERE post_id = :post_id"),
+                {"post_id": post_id, "content": content},
+            )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    dialect = op.get_bind().dialect.name
+    if dialect == "sqlite":
+        op.execute("DROP TABLE archives_fts")
+    elif dialect == "postgresql":
+        op.execute("DROP INDEX ix_post_archives_search_fts")
+    op.drop_column('post_archives', 'search_vector')
@@ -0,0 +1,32 @@
+"""add post rolling summary
+
+Revision ID: 5e0b9d2f6c18
+Revises: c41a7e93d5b2
+Create Date: 2026-10-17 10:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5e0b9d2f6c18'
+down_revision: Union[str, Sequence[str], None] = 'c41a7e93d5b2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('posts') as batch_op:
+        batch_op.add_column(sa.Column('summary', sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column('summary_seq', sa.Integer(), nullable=True, server_default='0'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('posts') as batch_op:
+        batch_op.drop_column('summary_seq')
+        batch_op.drop_column('summary')
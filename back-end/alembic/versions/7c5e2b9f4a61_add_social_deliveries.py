@@ -0,0 +1,51 @@
+"""add social deliveries
+
+Revision ID: 7c5e2b9f4a61
+Revises: d3f8a1c6e904
+Create Date: 2026-10-17 17:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c5e2b9f4a61'
+down_revision: Union[str, Sequence[str], None] = 'd3f8a1c6e904'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'social_deliveries',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('post_id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('platform', sa.String(length=20), nullable=False),
+        sa.Column('content', sa.Text(), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('run_at', sa.DateTime(), nullable=False),
+        sa.Column('external_id', sa.String(), nullable=True),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('sent_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['post_id'], ['posts.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_social_deliveries_id', 'social_deliveries', ['id'])
+    op.create_index('ix_social_deliveries_status_run_at', 'social_deliveries', ['status', 'run_at'])
+    op.create_index('ix_social_deliveries_post_id', 'social_deliveries', ['post_id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_social_deliveries_post_id', table_name='social_deliveries')
+    op.drop_index('ix_social_deliveries_status_run_at', table_name='social_deliveries')
+    op.drop_index('ix_social_deliveries_id', table_name='social_deliveries')
+    op.drop_table('social_deliveries')
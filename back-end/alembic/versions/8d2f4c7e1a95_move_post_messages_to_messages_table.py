@@ -0,0 +1,122 @@
+"""move post messages to messages table
+
+Splits the posts.messages JSON blob into one row per message so appending a
+turn is a single INSERT instead of a rewrite of the whole history.
+
+Revision ID: 8d2f4c7e1a95
+Revises: 3b9e6f1a2c40
+Create Date: 2026-10-17 09:30:00.000000
+
+"""
+import json
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d2f4c7e1a95'
+down_revision: Union[str, Sequence[str], None] = '3b9e6f1a2c40'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 500
+
+posts = sa.table(
+    'posts',
+    sa.column('id', sa.Integer),
+    sa.column('messages', sa.Text),
+)
+messages = sa.table(
+    'messages',
+    sa.column('post_id', sa.Integer),
+    sa.column('seq', sa.Integer),
+    sa.column('role', sa.String),
+    sa.column('content', sa.Text),
+    sa.column('extra', sa.Text),
+)
+
+
+def _rows_for(post_id, blob):
+    try:
+        history = json.loads(blob or "[]")
+    except ValueError:
+        history = []
+    if not isinstance(history, list):
+        history = []
+    for seq, message in enumerate(m for m in history if isinstance(m, dict)):
+        extra = {k: v for k, v in message.items() if k not in ("role", "content")}
+        yield {
+            'post_id': post_id,
+            'seq': seq,
+            'role': message.get('role', 'user'),
+            'content': message.get('content') or '',
+            'extra': json.dumps(extra) if extra else None,
+        }
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+    # create_all() at app startup may already have created an empty table
+    if not sa.inspect(bind).has_table('messages'):
+        op.create_table(
+            'messages',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('post_id', sa.Integer(), sa.ForeignKey('posts.id', ondelete='CASCADE'), nullable=False),
+            sa.Column('seq', sa.Integer(), nullable=False),
+            sa.Column('role', sa.String(length=20), nullable=False),
+            sa.Column('content', sa.Text(), nullable=False),
+            sa.Column('token_count', sa.Integer(), nullable=True),
+            sa.Column('extra', sa.Text(), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('post_id', 'seq', name='uq_messages_post_id_seq'),
+        )
+        op.create_index('ix_messages_id', 'messages', ['id'])
+
+    last_id = 0
+    while True:
+        batch = bind.execute(
+            sa.select(posts.c.id, posts.c.messages)
+            .where(posts.c.id > last_id)
+            .order_by(posts.c.id)
+            .limit(BATCH_SIZE)
+        ).fetchall()
+        if not batch:
+            break
+        rows = [row for post_id, blob in batch for row in _rows_for(post_id, blob)]
+        if rows:
+            bind.execute(messages.insert(), rows)
+        last_id = batch[-1][0]
+
+    with op.batch_alter_table('posts') as batch_op:
+        batch_op.drop_column('messages')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    bind = op.get_bind()
+    with op.batch_alter_table('posts') as batch_op:
+        batch_op.add_column(sa.Column('messages', sa.Text(), nullable=True))
+
+    history = {}
+    for post_id, role, content, extra in bind.execute(
+        sa.select(messages.c.post_id, messages.c.role, messages.c.content, messages.c.extra)
+        .order_by(messages.c.post_id, messages.c.seq)
+    ):
+        message = {'role': role, 'content': content}
+        if extra:
+            message.update(json.loads(extra))
+        history.setdefault(post_id, []).append(message)
+
+    for post_id, post_messages in history.items():
+        bind.execute(posts.update().where(posts.c.id == post_id).values(messages=json.dumps(post_messages)))
+    bind.execute(posts.update().where(posts.c.messages.is_(None)).values(messages='[]'))
+
+    with op.batch_alter_table('posts') as batch_op:
+        batch_op.alter_column('messages', existing_type=sa.Text(), nullable=False)
+
+    op.drop_index('ix_messages_id', table_name='messages')
+    op.drop_table('messages')
@@ -0,0 +1,58 @@
+"""add webhook inbox
+
+Revision ID: b6e2a9d4f713
+Revises: f9d1c3b7e526
+Create Date: 2026-10-17 15:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b6e2a9d4f713'
+down_revision: Union[str, Sequence[str], None] = 'f9d1c3b7e526'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'webhook_events',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('source', sa.String(length=20), nullable=False),
+        sa.Column('event_key', sa.String(length=100), nullable=False),
+        sa.Column('email', sa.String(), nullable=True),
+        sa.Column('sale_at', sa.DateTime(), nullable=True),
+        sa.Column('payload', sa.Text(), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('received_at', sa.DateTime(), nullable=True),
+        sa.Column('applied_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('source', 'event_key', name='uq_webhook_events_source_event_key'),
+    )
+    op.create_index('ix_webhook_events_id', 'webhook_events', ['id'])
+    op.create_index('ix_webhook_events_status_id', 'webhook_events', ['status', 'id'])
+    op.create_index('ix_webhook_events_email_sale_at', 'webhook_events', ['email', 'sale_at'])
+    # Batch mode: SQLite can't add a foreign key to an existing table in place
+    with op.batch_alter_table('transactions') as batch_op:
+        batch_op.add_column(sa.Column('event_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_transactions_event_id', 'webhook_events', ['event_id'], ['id'])
+        batch_op.create_index('ix_transactions_event_id', ['event_id'], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('transactions') as batch_op:
+        batch_op.drop_index('ix_transactions_event_id')
+        batch_op.drop_constraint('fk_transactions_event_id', type_='foreignkey')
+        batch_op.drop_column('event_id')
+    op.drop_index('ix_webhook_events_email_sale_at', table_name='webhook_events')
+    op.drop_index('ix_webhook_events_status_id', table_name='webhook_events')
+    op.drop_index('ix_webhook_events_id', table_name='webhook_events')
+    op.drop_table('webhook_events')
@@ -0,0 +1,30 @@
+"""add posts user_id created_at index
+
+Backs the keyset-paginated GET /api/posts listing.
+
+Revision ID: c41a7e93d5b2
+Revises: 8d2f4c7e1a95
+Create Date: 2026-10-17 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c41a7e93d5b2'
+down_revision: Union[str, Sequence[str], None] = '8d2f4c7e1a95'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_posts_user_id_created_at', 'posts', ['user_id', 'created_at'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_posts_user_id_created_at', table_name='posts')
@@ -0,0 +1,67 @@
+"""add batch jobs
+
+Revision ID: e2b8d4a61f07
+Revises: a7c3e5f9b210
+Create Date: 2026-10-17 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e2b8d4a61f07'
+down_revision: Union[str, Sequence[str], None] = 'a7c3e5f9b210'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'batch_jobs',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('total', sa.Integer(), nullable=False),
+        sa.Column('completed', sa.Integer(), nullable=False),
+        sa.Column('failed', sa.Integer(), nullable=False),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_batch_jobs_id', 'batch_jobs', ['id'])
+    op.create_index('ix_batch_jobs_user_id', 'batch_jobs', ['user_id'])
+    op.create_table(
+        'batch_items',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('job_id', sa.Integer(), nullable=False),
+        sa.Column('idx', sa.Integer(), nullable=False),
+        sa.Column('prompt', sa.Text(), nullable=False),
+        sa.Column('title', sa.String(length=200), nullable=True),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('post_id', sa.Integer(), nullable=True),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['job_id'], ['batch_jobs.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['post_id'], ['posts.id'], ondelete='SET NULL'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('job_id', 'idx', name='uq_batch_items_job_id_idx'),
+    )
+    op.create_index('ix_batch_items_id', 'batch_items', ['id'])
+    op.create_index('ix_batch_items_status_job_id', 'batch_items', ['status', 'job_id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_batch_items_status_job_id', table_name='batch_items')
+    op.drop_index('ix_batch_items_id', table_name='batch_items')
+    op.drop_table('batch_items')
+    op.drop_index('ix_batch_jobs_user_id', table_name='batch_jobs')
+    op.drop_index('ix_batch_jobs_id', table_name='batch_jobs')
+    op.drop_table('batch_jobs')
@@ -0,0 +1,83 @@
+"""add search index
+
+Revision ID: f9d1c3b7e526
+Revises: e2b8d4a61f07
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f9d1c3b7e526'
+down_revision: Union[str, Sequence[str], None] = 'e2b8d4a61f07'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Frozen copy of search.SQLITE_DDL / POSTGRES_DDL as of this revision
+SQLITE_UPGRADE = [
+    "CREATE VIRTUAL TABLE messages_fts USING fts5(content, owner, post_id UNINDEXED, tokenize='porter unicode61')",
+    "INSERT INTO messages_fts(messages_fts, rank) VALUES ('rank', 'bm25(1.0, 0.0)')",
+    "CREATE VIRTUAL TABLE posts_fts USING fts5(title, owner, tokenize='porter unicode61')",
+    "INSERT INTO posts_fts(posts_fts, rank) VALUES ('rank', 'bm25(1.0, 0.0)')",
+    """CREATE TRIGGER messages_fts_insert AFTER INSERT ON messages BEGIN
+        INSERT INTO messages_fts(rowid, content, owner, post_id)
+        SELECT new.id, new.content, 'u' || user_id, new.post_id FROM posts WHERE id = new.post_id;
+    END""",
+    """CREATE TRIGGER messages_fts_update AFTER UPDATE OF content ON messages BEGIN
+        UPDATE messages_fts SET content = new.content WHERE rowid = new.id;
+    END""",
+    """CREATE TRIGGER messages_fts_delete AFTER DELETE ON messages BEGIN
+        DELETE FROM messages_fts WHERE rowid = old.id;
+    END""",
+    """CREATE TRIGGER posts_fts_insert AFTER INSERT ON posts BEGIN
+        INSERT INTO posts_fts(rowid, title, owner) VALUES (new.id, coalesce(new.title, ''), 'u' || new.user_id);
+    END""",
+    """CREATE TRIGGER posts_fts_update AFTER UPDATE OF title ON posts BEGIN
+        UPDATE posts_fts SET title = coalesce(new.title, '') WHERE rowid = new.id;
+    END""",
+    """CREATE TRIGGER posts_fts_delete AFTER DELETE ON posts BEGIN
+        DELETE FROM posts_fts WHERE rowid = old.id;
+    END""",
+    # Index what is already there
+    """INSERT INTO messages_fts(rowid, content, owner, post_id)
+        SELECT m.id, m.content, 'u' || p.user_id, m.post_id FROM messages m JOIN posts p ON p.id = m.post_id""",
+    "INSERT INTO posts_fts(rowid, title, owner) SELECT id, coalesce(title, ''), 'u' || user_id FROM posts",
+]
+
+SQLITE_DOWNGRADE = [
+    "DROP TRIGGER posts_fts_delete",
+    "DROP TRIGGER posts_fts_update",
+    "DROP TRIGGER posts_fts_insert",
+    "DROP TRIGGER messages_fts_delete",
+    "DROP TRIGGER messages_fts_update",
+    "DROP TRIGGER messages_fts_insert",
+    "DROP TABLE posts_fts",
+    "DROP TABLE messages_fts",
+]
+
+POSTGRES_UPGRADE = [
+    "CREATE INDEX ix_messages_content_fts ON messages USING GIN (to_tsvector('english', content))",
+    "CREATE INDEX ix_posts_title_fts ON posts USING GIN (to_tsvector('english', coalesce(title, '')))",
+]
+
+POSTGRES_DOWNGRADE = [
+    "DROP INDEX ix_posts_title_fts",
+    "DROP INDEX ix_messages_content_fts",
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    dialect = op.get_bind().dialect.name
+    for statement in {"sqlite": SQLITE_UPGRADE, "postgresql": POSTGRES_UPGRADE}.get(dialect, []):
+        op.execute(statement)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    dialect = op.get_bind().dialect.name
+    for statement in {"sqlite": SQLITE_DOWNGRADE, "postgresql": POSTGRES_DOWNGRADE}.get(dialect, []):
+        op.execute(statement)
@@ -0,0 +1,278 @@
+"""Tiered storage for chat histories.
+
+Conversations nobody has touched for ARCHIVE_IDLE_DAYS are compacted: their
+messages (all but the first ARCHIVE_KEEP_MESSAGES, which the sidebar
+preview reads) are encoded into one compressed blob in post_archives and
+the rows deleted. The post row itself stays where it is, marked by
+Post.archived_at, so listings and titles are unaffected. The deleted rows'
+search entries are replaced by one index-only document per post
+(search.index_archive), so archived chats stay searchable; only the
+snippet of such a match waits until the post is opened.
+
+Anything that reads or appends to the history calls rehydrate() first; it
+puts the rows back exactly as they were (ids and seqs included) and drops
+the blob, in the caller's transaction. The post's version is left alone
+either way, so ETags held by clients stay valid.
+
+Compaction is an offline job, for cron or a maintenance window:
+
+    python archive.py compact [--idle-days 90] [--limit 1000] [--vacuum]
+    python archive.py stats
+    python archive.py rehydrate 42
+"""
+import argparse
+import json
+import os
+import time
+import zlib
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import func, insert, select, text, update
+from sqlalchemy.orm import Session
+
+import search
+import wire
+from database import engine, session_scope
+from models import Message, Post, PostArchive
+
+try:
+    import zstandard
+except ImportError:  # optional: archives are zlib-compressed without it
+    zstandard = None
+
+# ------------------- CONFIG -------------------
+ARCHIVE_IDLE_DAYS = int(os.getenv("ARCHIVE_IDLE_DAYS", "90"))
+ARCHIVE_CODEC = os.getenv("ARCHIVE_CODEC", "zstd" if zstandard is not None else "zlib")  # zstd | zlib
+ARCHIVE_ZSTD_LEVEL = int(os.getenv("ARCHIVE_ZSTD_LEVEL", "9"))
+ARCHIVE_ZLIB_LEVEL = int(os.getenv("ARCHIVE_ZLIB_LEVEL", "9"))
+# Leading messages left in place; seq 0 is the sidebar preview
+ARCHIVE_KEEP_MESSAGES = int(os.getenv("ARCHIVE_KEEP_MESSAGES", "1"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "100"))  # posts archived per transaction
+
+if ARCHIVE_CODEC == "zstd" and zstandard is None:
+    raise RuntimeError("ARCHIVE_CODEC=zstd needs the zstandard package")
+
+# Archived message fields, in blob order
+FIELDS = ("id", "seq", "role", "content", "extra", "token_count", "created_at")
+CONTENT = FIELDS.index("content")
+
+_loads = wire.orjson.loads if wire.orjson is not None else json.loads
+
+counts = {"archived": 0, "rehydrated": 0, "raw_bytes": 0, "stored_bytes": 0}
+rehydrate_seconds = {"total": 0.0, "max": 0.0}
+
+
+# ------------------- CODECS -------------------
+def compress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=ARCHIVE_ZSTD_LEVEL).compress(data)
+    return zlib.compress(data, ARCHIVE_ZLIB_LEVEL)
+
+
+def decompress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("This archive is zstd-compressed; install zstandard to read it")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+# ------------------- ARCHIVE -------------------
+def candidates(db: Session, cutoff: datetime, limit: int) -> List[int]:
+    """Posts idle since before cutoff that still have messages past the kept ones."""
+    has_tail = select(Message.id).where(Message.post_id == Post.id, Message.seq >= ARCHIVE_KEEP_MESSAGES).exists()
+    return list(db.scalars(
+        select(Post.id)
+        .where(Post.archived_at.is_(None), Post.updated_at < cutoff, has_tail)
+        .order_by(Post.updated_at)
+        .limit(limit)
+    ))
+
+
+def archive_post(db: Session, post_id: int, cutoff: datetime) -> Optional[PostArchive]:
+    """Move a post's history into a compressed blob, if it is still idle. The caller commits.
+
+    The conditional UPDATE claims the post: a write that lands first moves
+    updated_at past the cutoff and the post is skipped, one that lands
+    after finds it archived and rehydrates it.
+    """
+    user_id = db.execute(
+        update(Post)
+        .where(Post.id == post_id, Post.archived_at.is_(None), Post.updated_at < cutoff)
+        # updated_at is set to itself, or onupdate would make the chat look active
+        .values(archived_at=datetime.utcnow(), updated_at=Post.updated_at)
+        .returning(Post.user_id)
+    ).scalar()
+    if user_id is None:
+        return None
+    rows = db.execute(
+        select(*(getattr(Message, field) for field in FIELDS))
+        .where(Message.post_id == post_id, Message.seq >= ARCHIVE_KEEP_MESSAGES)
+        .order_by(Message.seq)
+    ).all()
+    raw = wire.dumps([list(row) for row in rows])
+    archive = PostArchive(
+        post_id=post_id,
+        codec=ARCHIVE_CODEC,
+        data=compress(raw, ARCHIVE_CODEC),
+        message_count=len(rows),
+        raw_bytes=len(raw),
+    )
+    archive.stored_bytes = len(archive.data)
+    db.add(archive)
+    # The search index triggers drop these rows' entries; the archive's document takes their place
+    db.query(Message).filter(Message.post_id == post_id, Message.seq >= ARCHIVE_KEEP_MESSAGES).delete(synchronize_session=False)
+    db.flush()
+    search.index_archive(db, post_id, user_id, search_text(rows))
+    return archive
+
+
+def rehydrate(db: Session, post: Post) -> bool:
+    """Restore an archived post's messages, within the caller's transaction. The caller commits.
+
+    A no-op for posts that aren't archived. Of two requests opening the same
+    archived post, the conditional UPDATE lets exactly one restore it; the
+    other waits for its commit and then reads the restored rows. Clearing
+    archived_at also moves updated_at to now, so a chat that was just
+    opened isn't compacted again by the next run.
+    """
+    if post.archived_at is None:
+        return False
+    started = time.perf_counter()
+    restored = db.execute(
+        update(Post).where(Post.id == post.id, Post.archived_at.isnot(None)).values(archived_at=None)
+    ).rowcount
+    post.archived_at = None
+    if not restored:
+        return False
+    archive = db.get(PostArchive, post.id)
+    if archive is not None:
+        rows = _loads(decompress(archive.data, archive.codec))
+        search.unindex_archive(db, post.id, post.user_id, search_text(rows))
+        if rows:
+            # The search index triggers index the messages again
+            db.execute(insert(Message), [_message_row(post.id, row) for row in rows])
+        db.delete(archive)
+    db.flush()
+    elapsed = time.perf_counter() - started
+    counts["rehydrated"] += 1
+    rehydrate_seconds["total"] += elapsed
+    rehydrate_seconds["max"] = max(rehydrate_seconds["max"], elapsed)
+    return True
+
+
+def search_text(rows: list) -> str:
+    """The archived messages' text as one search document."""
+    return "\n".join(row[CONTENT] or "" for row in rows)
+
+
+def _message_row(post_id: int, row: list) -> dict:
+    message = dict(zip(FIELDS, row), post_id=post_id)
+    if message["created_at"]:
+        message["created_at"] = datetime.fromisoformat(message["created_at"])
+    return message
+
+
+def drop(db: Session, post: Post):
+    """Delete a post's archive, if any, and its search document, along with the post. The caller commits."""
+    archive = db.get(PostArchive, post.id)
+    if archive is not None:
+        search.unindex_archive(db, post.id, post.user_id, search_text(_loads(decompress(archive.data, archive.codec))))
+        db.delete(archive)
+
+
+def compact(idle_days: int = ARCHIVE_IDLE_DAYS, limit: Optional[int] = None) -> dict:
+    """Archive every post idle for idle_days, ARCHIVE_BATCH_SIZE posts per transaction."""
+    cutoff = datetime.utcnow() - timedelta(days=idle_days)
+    result = {"posts": 0, "messages": 0, "raw_bytes": 0, "stored_bytes": 0}
+    while limit is None or result["posts"] < limit:
+        batch = ARCHIVE_BATCH_SIZE if limit is None else min(ARCHIVE_BATCH_SIZE, limit - result["posts"])
+        with session_scope() as db:
+            post_ids = candidates(db, cutoff, batch)
+            if not post_ids:
+                break
+            archives = [
+                (archive.message_count, archive.raw_bytes, archive.stored_bytes)
+                for archive in (archive_post(db, post_id, cutoff) for post_id in post_ids) if archive
+            ]
+            db.commit()
+        for message_count, raw_bytes, stored_bytes in archives:
+            result["posts"] += 1
+            result["messages"] += message_count
+            result["raw_bytes"] += raw_bytes
+            result["stored_bytes"] += stored_bytes
+        if not archives:  # every candidate was written to meanwhile
+            break
+    counts["archived"] += result["posts"]
+    counts["raw_bytes"] += result["raw_bytes"]
+    counts["stored_bytes"] += result["stored_bytes"]
+    return result
+
+
+def totals() -> dict:
+    """What is archived across the whole database."""
+    with session_scope() as db:
+        posts, messages, raw, stored = db.execute(select(
+            func.count(PostArchive.post_id),
+            func.coalesce(func.sum(PostArchive.message_count), 0),
+            func.coalesce(func.sum(PostArchive.raw_bytes), 0),
+            func.coalesce(func.sum(PostArchive.stored_bytes), 0),
+        )).one()
+    return {
+        "posts": posts,
+        "messages": messages,
+        "raw_bytes": raw,
+        "stored_bytes": stored,
+        "ratio": round(raw / stored, 2) if stored else 0.0,
+    }
+
+
+def stats() -> dict:
+    """Archiving and rehydration in this process."""
+    rehydrated = counts["rehydrated"]
+    return {
+        **counts,
+        "rehydrate_avg_ms": round(rehydrate_seconds["total"] / rehydrated * 1000, 2) if rehydrated else 0.0,
+        "rehydrate_max_ms": round(rehydrate_seconds["max"] * 1000, 2),
+    }
+
+
+def _cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    compact_parser = commands.add_parser("compact", help="archive posts idle for --idle-days")
+    compact_parser.add_argument("--idle-days", type=int, default=ARCHIVE_IDLE_DAYS)
+    compact_parser.add_argument("--limit", type=int, help="archive at most this many posts")
+    compact_parser.add_argument("--vacuum", action="store_true", help="then VACUUM, so SQLite gives the space back to the filesystem")
+    commands.add_parser("stats", help="totals of what is archived")
+    rehydrate_parser = commands.add_parser("rehydrate", help="restore one post now")
+    rehydrate_parser.add_argument("post_id", type=int)
+    args = parser.parse_args()
+
+    if args.command == "compact":
+        started = time.perf_counter()
+        result = compact(args.idle_days, args.limit)
+        print(f"archived {result['posts']} posts ({result['messages']} messages) in {time.perf_counter() - started:.1f}s: "
+              f"{result['raw_bytes']} bytes stored as {result['stored_bytes']} with {ARCHIVE_CODEC}")
+        if args.vacuum:
+            if engine.dialect.name == "sqlite":
+                with engine.connect() as conn:
+                    conn.execution_options(isolation_level="AUTOCOMMIT").execute(text("VACUUM"))
+                print("vacuumed")
+            else:
+                print("--vacuum only applies to SQLite; PostgreSQL's autovacuum reuses the space")
+    elif args.command == "stats":
+        print(totals())
+    elif args.command == "rehydrate":
+        with session_scope() as db:
+            post = db.get(Post, args.post_id)
+            if post is None:
+                parser.error(f"no post {args.post_id}")
+            restored = rehydrate(db, post)
+            db.commit()
+        print(f"post {args.post_id} {'rehydrated' if restored else 'was not archived'}")
+
+
+if __name__ == "__main__":
+    _cli()
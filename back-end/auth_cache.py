@@ -0,0 +1,193 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import Optional
+
+from fastapi.concurrency import run_in_threadpool
+
+try:
+    import redis
+except ImportError:  # optional: only needed for the shared backend
+    redis = None
+
+from models import User
+
+# ------------------- CONFIG -------------------
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "60"))  # seconds; 0 disables the cache
+AUTH_CACHE_MAX_SIZE = int(os.getenv("AUTH_CACHE_MAX_SIZE", "10000"))
+# Share principals (and invalidations) across workers through Redis
+AUTH_CACHE_REDIS_URL = os.getenv("AUTH_CACHE_REDIS_URL")
+REDIS_KEY_PREFIX = "auth:principal:"
+
+
+@dataclass(frozen=True)
+class Principal:
+    """The authenticated user as request handlers see it, detached from any DB session."""
+    id: int
+    email: str
+    plan: str
+    credit_remaining: Optional[float]
+
+    @classmethod
+    def from_user(cls, user: User) -> "Principal":
+        return cls(id=user.id, email=user.email, plan=user.plan, credit_remaining=user.credit_remaining)
+
+
+# ------------------- BACKENDS -------------------
+class MemoryBackend:
+    """Per-worker LRU with a TTL on every entry."""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()  # invalidations arrive from threadpool handlers too
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[Principal]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, principal = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return principal
+
+    def set(self, key: str, principal: Principal):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, principal)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisBackend:
+    """Shared backend so a plan change seen by one worker is seen by all of them."""
+
+    def __init__(self, url: str, ttl: float):
+        if redis is None:
+            raise RuntimeError("AUTH_CACHE_REDIS_URL is set but the redis package is not installed")
+        self.client = redis.Redis.from_url(url, socket_timeout=0.2)
+        self.ttl = ttl
+        self.evictions = 0  # Redis evicts on its own; nothing to count here
+
+    def get(self, key: str) -> Optional[Principal]:
+        raw = self.client.get(REDIS_KEY_PREFIX + key)
+        return Principal(**json.loads(raw)) if raw else None
+
+    def set(self, key: str, principal: Principal):
+        self.client.set(REDIS_KEY_PREFIX + key, json.dumps(asdict(principal)), px=int(self.ttl * 1000))
+
+    def delete(self, key: str):
+        self.client.delete(REDIS_KEY_PREFIX + key)
+
+    def clear(self):
+        for key in self.client.scan_iter(REDIS_KEY_PREFIX + "*"):
+            self.client.delete(key)
+
+    # No __len__: counting the shared keyspace means a SCAN on every /metrics scrape
+
+
+# ------------------- CACHE -------------------
+class AuthCache:
+    def __init__(self, backend, enabled: bool = True):
+        self.backend = backend
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    async def _call(self, fn, *args):
+        # Only the in-process LRU is cheap enough to touch on the event loop
+        if isinstance(self.backend, MemoryBackend):
+            return fn(*args)
+        return await run_in_threadpool(fn, *args)
+
+    async def aget(self, subject: str) -> Optional[Principal]:
+        """get() for the event loop: a shared backend is read from the threadpool."""
+        if not self.enabled:
+            return None
+        return await self._call(self.get, subject)
+
+    async def aset(self, subject: str, principal: Principal):
+        if self.enabled:
+            await self._call(self.set, subject, principal)
+
+    async def ainvalidate(self, subject: str):
+        if self.enabled:
+            await self._call(self.invalidate, subject)
+
+    def get(self, subject: str) -> Optional[Principal]:
+        if not self.enabled:
+            return None
+        try:
+            principal = self.backend.get(subject)
+        except Exception as e:
+            # A flaky shared backend must not take authentication down with it
+            print(f"Auth cache read error: {e}")
+            principal = None
+        if principal is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return principal
+
+    def set(self, subject: str, principal: Principal):
+        if not self.enabled:
+            return
+        try:
+            self.backend.set(subject, principal)
+        except Exception as e:
+            print(f"Auth cache write error: {e}")
+
+    def invalidate(self, subject: str):
+        """Drop a cached principal; call after anything that changes plan or credits."""
+        if not self.enabled:
+            return
+        self.invalidations += 1
+        try:
+            self.backend.delete(subject)
+        except Exception as e:
+            print(f"Auth cache invalidate error: {e}")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "backend": type(self.backend).__name__,
+            "size": len(self.backend) if hasattr(self.backend, "__len__") else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "invalidations": self.invalidations,
+            "evictions": self.backend.evictions,
+        }
+
+
+def _make_cache() -> AuthCache:
+    if AUTH_CACHE_REDIS_URL:
+        backend = RedisBackend(AUTH_CACHE_REDIS_URL, AUTH_CACHE_TTL)
+    else:
+        backend = MemoryBackend(AUTH_CACHE_MAX_SIZE, AUTH_CACHE_TTL)
+    return AuthCache(backend, enabled=AUTH_CACHE_TTL > 0)
+
+
+auth_cache = _make_cache()
@@ -0,0 +1,384 @@
+import asyncio
+import json
+import os
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Set
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import and_, func, select, update
+
+import chat_store
+import credits
+from auth_cache import auth_cache
+from database import session_scope
+from models import BatchItem, BatchJob, Post, UsageRecord, User
+from router import model_router
+from tokens import count_tokens
+
+# ------------------- CONFIG -------------------
+# start() requeues every item it finds running: on one host the leader worker runs it (lifecycle.Leader),
+# with several hosts enable it on one of them
+BATCH_WORKER_ENABLED = os.getenv("BATCH_WORKER_ENABLED", "true").lower() in ("1", "true", "yes")
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))  # prompts in flight per process
+BATCH_USER_CONCURRENCY = int(os.getenv("BATCH_USER_CONCURRENCY", "4"))  # ... of which one user may hold
+BATCH_USER_RATE = float(os.getenv("BATCH_USER_RATE", "60"))  # prompts per minute per user
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "1000"))  # lines per submitted batch
+BATCH_MAX_ATTEMPTS = int(os.getenv("BATCH_MAX_ATTEMPTS", "3"))
+BATCH_POLL_INTERVAL = float(os.getenv("BATCH_POLL_INTERVAL", "1.0"))
+
+ACTIVE_JOB_STATUSES = ("queued", "running")
+
+
+# ------------------- SUBMISSION -------------------
+def parse_jsonl(body: str) -> List[dict]:
+    """Parse a batch: one {"prompt": ..., "title": optional} object per non-empty line."""
+    items = []
+    for number, line in enumerate(body.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            raise ValueError(f"line {number}: not valid JSON")
+        if not isinstance(entry, dict) or not isinstance(entry.get("prompt"), str) or not entry["prompt"].strip():
+            raise ValueError(f"line {number}: expected an object with a non-empty \"prompt\"")
+        title = entry.get("title")
+        if title is not None and (not isinstance(title, str) or len(title) > 200):
+            raise ValueError(f"line {number}: title must be a string of at most 200 characters")
+        items.append({"prompt": entry["prompt"], "title": title})
+    if not items:
+        raise ValueError("the batch is empty")
+    if len(items) > BATCH_MAX_ITEMS:
+        raise ValueError(f"at most {BATCH_MAX_ITEMS} prompts per batch")
+    return items
+
+
+def create_job(db, user_id: int, items: List[dict]) -> BatchJob:
+    job = BatchJob(user_id=user_id, status="queued", total=len(items), completed=0, failed=0)
+    db.add(job)
+    db.flush()
+    db.bulk_insert_mappings(BatchItem, [
+        {"job_id": job.id, "idx": idx, "prompt": item["prompt"], "title": item["title"], "status": "pending", "attempts": 0}
+        for idx, item in enumerate(items)
+    ])
+    return job
+
+
+def job_to_dict(job: BatchJob, items: Optional[List[BatchItem]] = None) -> dict:
+    data = {
+        "job_id": job.id,
+        "status": job.status,
+        "total": job.total,
+        "completed": job.completed,
+        "failed": job.failed,
+        "pending": job.total - job.completed - job.failed,
+        "error": job.error,
+        "created_at": job.created_at,
+        "updated_at": job.updated_at,
+    }
+    if items is not None:
+        data["items"] = [
+            {"index": item.idx, "status": item.status, "post_id": item.post_id, "error": item.error}
+            for item in items
+        ]
+    return data
+
+
+# ------------------- RATE LIMITS -------------------
+class UserRateLimiter:
+    """Token bucket per user: `rate` prompts per minute, bursting up to one minute's worth."""
+
+    def __init__(self, rate_per_minute: float):
+        self.rate = rate_per_minute / 60.0
+        self.burst = max(rate_per_minute, 1.0)
+        self._buckets: Dict[int, List[float]] = {}
+
+    def try_acquire(self, user_id: int) -> bool:
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(user_id, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens < 1:
+            self._buckets[user_id] = (tokens, now)
+            return False
+        self._buckets[user_id] = (tokens - 1, now)
+        return True
+
+
+# ------------------- WORKER -------------------
+class BatchWorker:
+    """Runs pending batch items with bounded concurrency, in this process's event loop.
+
+    Item status is the checkpoint. Claiming an item and reserving its credit
+    commit together, and so do saving its post and marking it done; after a
+    crash, start() hands the credits of items left "running" back and requeues
+    them, so no prompt is billed twice or lost.
+    """
+
+    def __init__(
+        self,
+        system_prompt: dict,
+        params: dict,
+        cost_for_plan: Callable[[str], float],
+        concurrency: int = BATCH_CONCURRENCY,
+        user_concurrency: int = BATCH_USER_CONCURRENCY,
+        user_rate: float = BATCH_USER_RATE,
+    ):
+        self.system_prompt = system_prompt
+        self.params = params
+        self.cost_for_plan = cost_for_plan
+        self.concurrency = concurrency
+        self.user_concurrency = user_concurrency
+        self.limiter = UserRateLimiter(user_rate)
+        self._running: Dict[asyncio.Task, int] = {}  # task -> user_id
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.processed = 0
+
+    # ---- lifecycle ----
+    def start(self):
+        recovered = self._recover()
+        if recovered:
+            print(f"Batch worker: requeued {recovered} interrupted items")
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        tasks = list(self._running)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        self._wake = None
+
+    def wake(self):
+        if self._wake is not None:
+            self._wake.set()
+
+    def _recover(self) -> int:
+        """Requeue items a dead worker left running and refund the credit each had reserved."""
+        with session_scope() as db:
+            stranded = db.execute(
+                select(BatchItem.id, BatchJob.user_id)
+                .join(BatchJob, BatchJob.id == BatchItem.job_id)
+                .where(BatchItem.status == "running")
+            ).all()
+            for item_id, user_id in stranded:
+                credits.refund_credit(db, user_id)
+            if stranded:
+                db.execute(
+                    update(BatchItem)
+                    .where(BatchItem.id.in_([item_id for item_id, _ in stranded]))
+                    .values(status="pending")
+                )
+            db.commit()
+        return len(stranded)
+
+    # ---- dispatch ----
+    async def _run(self):
+        while True:
+            try:
+                dispatched = await self._dispatch()
+            except Exception as e:
+                print(f"Batch dispatch error: {e}")
+                dispatched = 0
+            if not dispatched:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=BATCH_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+
+    def _pending(self, per_job: int, limit: int, throttled: Set[int]) -> List[tuple]:
+        """The next few pending items of every active job, so one big job can't starve the rest.
+
+        Users in `throttled` are left out, so their jobs don't take up the page.
+        """
+        with session_scope() as db:
+            active = and_(BatchItem.status == "pending", BatchJob.status.in_(ACTIVE_JOB_STATUSES))
+            if throttled:
+                active = and_(active, BatchJob.user_id.not_in(list(throttled)))
+            ranked = (
+                select(
+                    BatchItem.id,
+                    BatchItem.job_id,
+                    BatchJob.user_id,
+                    func.row_number().over(partition_by=BatchItem.job_id, order_by=BatchItem.idx).label("rank"),
+                )
+                .join(BatchJob, BatchJob.id == BatchItem.job_id)
+                .where(active)
+                .subquery()
+            )
+            return db.execute(
+                select(ranked.c.id, ranked.c.job_id, ranked.c.user_id)
+                .where(ranked.c.rank <= per_job)
+                .order_by(ranked.c.rank, ranked.c.job_id)
+                .limit(limit)
+            ).all()
+
+    async def _dispatch(self) -> int:
+        free = self.concurrency - len(self._running)
+        if free <= 0:
+            return 0
+        dispatched = 0
+        # Users at their concurrency cap or out of tokens are left out of the next page,
+        # so one throttled job can't hold back every other job's items
+        throttled: Set[int] = set()
+        while dispatched < free:
+            page = await run_in_threadpool(self._pending, free, free * 4, throttled)
+            if not page:
+                break
+            for item_id, job_id, user_id in page:
+                if dispatched >= free:
+                    break
+                if user_id in throttled:
+                    continue
+                if sum(1 for uid in self._running.values() if uid == user_id) >= self.user_concurrency:
+                    throttled.add(user_id)
+                    continue
+                if not self.limiter.try_acquire(user_id):
+                    throttled.add(user_id)
+                    continue
+                claim = await run_in_threadpool(self._claim, item_id, job_id, user_id)
+                if claim is None:
+                    continue
+                task = asyncio.create_task(self._process(item_id, job_id, user_id, claim))
+                self._running[task] = user_id
+                task.add_done_callback(self._finished)
+                dispatched += 1
+        return dispatched
+
+    def _finished(self, task: asyncio.Task):
+        self._running.pop(task, None)
+        self.wake()
+
+    def _claim(self, item_id: int, job_id: int, user_id: int) -> Optional[dict]:
+        """Mark an item running and reserve its credit in one transaction.
+
+        Returns the item's prompt/title and the user's plan, or None when another
+        worker took it or the user ran out of credits (the job is then stopped).
+        """
+        with session_scope() as db:
+            claimed = db.execute(
+                update(BatchItem)
+                .where(BatchItem.id == item_id, BatchItem.status == "pending")
+                .values(status="running", attempts=BatchItem.attempts + 1)
+            ).rowcount
+            if not claimed:
+                return None
+            reservation = credits.reserve_credit(db, user_id)
+            if reservation is None:
+                db.rollback()
+                db.execute(
+                    update(BatchJob)
+                    .where(BatchJob.id == job_id, BatchJob.status.in_(ACTIVE_JOB_STATUSES))
+                    .values(status="stopped", error="No credits left. Upgrade your plan and resume the job.")
+                )
+                db.commit()
+                return None
+            db.execute(update(BatchJob).where(BatchJob.id == job_id, BatchJob.status == "queued").values(status="running"))
+            item = db.get(BatchItem, item_id)
+            email = db.query(User.email).filter(User.id == user_id).scalar()
+            db.commit()
+            return {"prompt": item.prompt, "title": item.title, "attempts": item.attempts, "plan": reservation[0], "email": email}
+
+    # ---- items ----
+    async def _process(self, item_id: int, job_id: int, user_id: int, claim: dict):
+        messages = [self.system_prompt, {"role": "user", "content": claim["prompt"]}]
+        try:
+            answer = await model_router.complete(messages, **self.params)
+        except asyncio.CancelledError:
+            # Shutting down: hand the credit back and leave the item for the next start
+            await run_in_threadpool(self._release, item_id, user_id, claim, None)
+            raise
+        except Exception as e:
+            print(f"Batch item {item_id} failed: {e}")
+            await run_in_threadpool(self._release, item_id, user_id, claim, str(e))
+            return
+        await run_in_threadpool(self._save, item_id, job_id, user_id, claim, answer)
+        self.processed += 1
+
+    def _save(self, item_id: int, job_id: int, user_id: int, claim: dict, answer: str):
+        with session_scope() as db:
+            post = Post(user_id=user_id, title=claim["title"] or claim["prompt"][:30])
+            db.add(post)
+            db.flush()
+            chat_store.append_messages(db, post.id, [
+                {"role": "user", "content": claim["prompt"]},
+                {"role": "assistant", "content": answer},
+            ])
+            db.execute(
+                update(BatchItem)
+                .where(BatchItem.id == item_id)
+                .values(status="done", post_id=post.id, error=None, finished_at=datetime.utcnow())
+            )
+            db.execute(update(BatchJob).where(BatchJob.id == job_id).values(completed=BatchJob.completed + 1))
+            # Written with the item rather than through the buffered usage ledger, so a crash
+            # can't separate the usage record from the post it bills for
+            db.add(UsageRecord(
+                user_id=user_id,
+                prompt=claim["prompt"],
+                tokens_used=count_tokens(self.system_prompt["content"]) + count_tokens(claim["prompt"]) + count_tokens(answer),
+                cost=self.cost_for_plan(claim["plan"]),
+            ))
+            self._complete_if_drained(db, job_id)
+            db.commit()
+        auth_cache.invalidate(claim["email"])
+
+    def _release(self, item_id: int, user_id: int, claim: dict, error: Optional[str]):
+        """Refund a failed or interrupted attempt; retry it unless it is out of attempts."""
+        with session_scope() as db:
+            credits.refund_credit(db, user_id)
+            job_id = db.query(BatchItem.job_id).filter(BatchItem.id == item_id).scalar()
+            if error is not None and claim["attempts"] >= BATCH_MAX_ATTEMPTS:
+                db.execute(
+                    update(BatchItem)
+                    .where(BatchItem.id == item_id)
+                    .values(status="failed", error=error[:500], finished_at=datetime.utcnow())
+                )
+                db.execute(update(BatchJob).where(BatchJob.id == job_id).values(failed=BatchJob.failed + 1))
+                self._complete_if_drained(db, job_id)
+            else:
+                db.execute(update(BatchItem).where(BatchItem.id == item_id).values(status="pending", error=error and error[:500]))
+            db.commit()
+        auth_cache.invalidate(claim["email"])
+
+    def _complete_if_drained(self, db, job_id: int):
+        open_items = (
+            select(BatchItem.id)
+            .where(BatchItem.job_id == job_id, BatchItem.status.in_(("pending", "running")))
+            .exists()
+        )
+        db.execute(
+            update(BatchJob)
+            .where(BatchJob.id == job_id, BatchJob.status.in_(ACTIVE_JOB_STATUSES), ~open_items)
+            .values(status="completed")
+        )
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self._task is not None,
+            "in_flight": len(self._running),
+            "concurrency": self.concurrency,
+            "processed": self.processed,
+        }
+
+
+# ------------------- JOB CONTROL -------------------
+def cancel_job(db, job: BatchJob):
+    """Stop a job; pending items are skipped, items already running still finish."""
+    db.execute(
+        update(BatchItem)
+        .where(and_(BatchItem.job_id == job.id, BatchItem.status == "pending"))
+        .values(status="skipped")
+    )
+    job.status = "cancelled"
+
+
+def resume_job(db, job: BatchJob):
+    """Requeue a job stopped for lack of credits; its pending items pick up where it left off."""
+    job.status = "queued"
+    job.error = None
@@ -0,0 +1,111 @@
+"""One noisy free-plan user against a handful of well-behaved ones.
+
+The fake upstream is given a provider quota (--max-concurrency streams, 429
+beyond that). A free-plan user hammers /api/generate_stream from --noisy
+concurrent loops while --quiet starter users each send one generation at a
+time, for --duration seconds, first with admission control off and then on
+(ADMISSION_MAX_UPSTREAM set to the quota). Reports, per user class, served
+and failed generations, 429s from our own admission layer, and time to first
+byte for the quiet users:
+
+    python bench/admission_fairness.py --noisy 40 --quiet 4 --duration 8
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import httpx
+
+from harness import create_user, percentile, start_backend, start_fake_upstream, stop
+
+QUOTA = 8
+
+
+async def drive(base_url: str, noisy_token: str, quiet_tokens: list, noisy: int, duration: float) -> dict:
+    results = {
+        "noisy": {"ok": 0, "failed": 0, "rejected": 0},
+        "quiet": {"ok": 0, "failed": 0, "rejected": 0, "ttfb": []},
+    }
+    deadline = time.perf_counter() + duration
+    async with httpx.AsyncClient(timeout=60, limits=httpx.Limits(max_connections=noisy + len(quiet_tokens) + 10)) as client:
+        async def generate(kind: str, token: str):
+            started = time.perf_counter()
+            ttfb, body = None, b""
+            async with client.stream(
+                "POST",
+                f"{base_url}/api/generate_stream",
+                json={"prompt": "Write a tagline for a bakery"},
+                headers={"Authorization": f"Bearer {token}"},
+            ) as res:
+                async for chunk in res.aiter_bytes():
+                    if ttfb is None:
+                        ttfb = time.perf_counter() - started
+                    body += chunk
+            counts = results[kind]
+            if res.status_code == 429:
+                counts["rejected"] += 1
+                return float(res.headers.get("retry-after", "1"))
+            if res.status_code == 200 and "Error:" not in body.decode("utf-8", "replace"):
+                counts["ok"] += 1
+                if kind == "quiet":
+                    counts["ttfb"].append(ttfb)
+            else:
+                counts["failed"] += 1
+            return 0.0
+
+        async def noisy_loop():
+            # Ignores Retry-After on purpose: a badly behaved client
+            while time.perf_counter() < deadline:
+                await generate("noisy", noisy_token)
+                await asyncio.sleep(0.05)
+
+        async def quiet_loop(token: str):
+            while time.perf_counter() < deadline:
+                retry_after = await generate("quiet", token)
+                await asyncio.sleep(max(0.5, retry_after))
+
+        await asyncio.gather(*(noisy_loop() for _ in range(noisy)), *(quiet_loop(t) for t in quiet_tokens))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--noisy", type=int, default=40, help="concurrent request loops of the noisy user")
+    parser.add_argument("--quiet", type=int, default=4, help="well-behaved users")
+    parser.add_argument("--duration", type=float, default=8.0)
+    args = parser.parse_args()
+
+    upstream, upstream_url = start_fake_upstream(tokens=40, token_rate=50, first_token_delay=0.1, max_concurrency=QUOTA)
+    print(f"{'admission':<10} {'noisy ok':>9} {'fail':>5} {'429':>5}   {'quiet ok':>9} {'fail':>5} {'429':>5} {'ttfb p50':>9} {'ttfb p99':>9}  upstream 429s")
+    try:
+        for enabled in (False, True):
+            before = httpx.get(f"{upstream_url}/stats").json()["throttled"]
+            database_url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'admission.db')}"
+            backend, base_url = start_backend(database_url, upstream_url, {
+                "ADMISSION_ENABLED": str(enabled).lower(),
+                "ADMISSION_MAX_UPSTREAM": str(QUOTA),
+            })
+            try:
+                noisy_token = create_user(base_url, database_url, "noisy@example.com", plan="free", credits=100000)
+                quiet_tokens = [
+                    create_user(base_url, database_url, f"quiet{i}@example.com", plan="starter", credits=100000)
+                    for i in range(args.quiet)
+                ]
+                result = asyncio.run(drive(base_url, noisy_token, quiet_tokens, args.noisy, args.duration))
+            finally:
+                stop(backend)
+            throttled = httpx.get(f"{upstream_url}/stats").json()["throttled"] - before
+            noisy, quiet = result["noisy"], result["quiet"]
+            print(
+                f"{'on' if enabled else 'off':<10} {noisy['ok']:>9} {noisy['failed']:>5} {noisy['rejected']:>5}   "
+                f"{quiet['ok']:>9} {quiet['failed']:>5} {quiet['rejected']:>5} "
+                f"{percentile(quiet['ttfb'], 50) * 1000:>7.0f}ms {percentile(quiet['ttfb'], 99) * 1000:>7.0f}ms  {throttled}"
+            )
+    finally:
+        stop(upstream)
+
+
+if __name__ == "__main__":
+    main()
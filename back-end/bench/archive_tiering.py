@@ -0,0 +1,177 @@
+"""Tiered storage benchmark: storage saved by archiving cold chats, and what opening one costs.
+
+Seeds --posts posts of --messages-per-post messages of about --chars
+characters each into SQLite, loading through the search index triggers,
+with --cold-share of the posts last touched --idle-days + 30 days ago.
+Runs archive.compact() and VACUUM and reports the database file before and
+after, and the blob compression ratio. Then times GET /api/posts/{id}
+in-process for hot posts, for archived posts on first open (rehydrating)
+and for the same posts opened again, and checks every rehydrated history
+is identical to the one seeded. Each post's last message carries a word of
+its own, and /api/search must find every sampled post by it while archived
+and after rehydration. Exits non-zero if any check fails:
+
+    python bench/archive_tiering.py --posts 2000 --messages-per-post 20 --cold-share 0.8
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'archive.db')}"
+
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlalchemy import insert, text  # noqa: E402
+
+import archive  # noqa: E402
+import main  # noqa: E402
+from database import SessionLocal, engine  # noqa: E402
+from harness import percentile  # noqa: E402
+from models import Base, Message, Post, User  # noqa: E402
+
+WORDS = ("the of and to in is you that it was for on are as with they at be this have from or one had by word but not what all "
+         "were we when your can said there use an each which she do how their if will up other about out many then them these "
+         "marketing content strategy audience brand campaign engagement growth social media post headline").split()
+
+
+def make_content(chars: int, rng: random.Random) -> str:
+    words = []
+    while sum(len(w) + 1 for w in words) < chars:
+        words.append(rng.choice(WORDS))
+    return "## " + " ".join(words[:5]).title() + "\n\n" + " ".join(words) + "\n\n- **Tip:** " + rng.choice(WORDS) + " ✅"
+
+
+def seed(args, rng: random.Random) -> list:
+    """Returns the ids of the cold posts."""
+    db = SessionLocal()
+    db.execute(insert(User), [{"id": 1, "email": "archive@example.com", "hashed_password": "x", "plan": "pro"}])
+    now = datetime.utcnow()
+    old = now - timedelta(days=args.idle_days + 30)
+    cold = []
+    for offset in range(0, args.posts, 500):
+        batch = range(offset, min(offset + 500, args.posts))
+        posts = []
+        for i in batch:
+            is_cold = rng.random() < args.cold_share
+            if is_cold:
+                cold.append(i + 1)
+            touched = old if is_cold else now
+            posts.append({"id": i + 1, "user_id": 1, "title": f"Chat {i}", "created_at": touched, "updated_at": touched})
+        db.execute(insert(Post), posts)
+        db.execute(insert(Message), [
+            {"post_id": i + 1, "seq": seq, "role": "user" if seq % 2 == 0 else "assistant",
+             "content": make_content(args.chars if seq % 2 else args.chars // 8, rng) + (f" needle{i + 1}" if seq == args.messages_per_post - 1 else ""),
+             "extra": json.dumps({"imageUrl": f"https://example.com/api/assets/{i:064x}.png"}) if seq % 10 == 9 else None,
+             "token_count": args.chars // 4, "created_at": old}
+            for i in batch for seq in range(args.messages_per_post)
+        ])
+        db.commit()
+    db.close()
+    return cold
+
+
+def histories(post_ids: list) -> dict:
+    db = SessionLocal()
+    try:
+        rows = db.execute(
+            text("SELECT post_id, id, seq, role, content, extra, token_count, created_at FROM messages WHERE post_id IN (%s) ORDER BY post_id, seq"
+                 % ",".join(str(p) for p in post_ids))
+        ).all()
+    finally:
+        db.close()
+    result = {p: [] for p in post_ids}
+    for row in rows:
+        result[row[0]].append(tuple(row[1:]))
+    return result
+
+
+def time_gets(client: TestClient, headers: dict, post_ids: list) -> list:
+    latencies = []
+    for post_id in post_ids:
+        started = time.perf_counter()
+        res = client.get(f"/api/posts/{post_id}", headers=headers)
+        latencies.append(time.perf_counter() - started)
+        res.raise_for_status()
+    return latencies
+
+
+def search_misses(client: TestClient, headers: dict, post_ids: list, archived: bool) -> int:
+    """Posts that /api/search doesn't find by their own word, or reports in the wrong tier."""
+    misses = 0
+    for post_id in post_ids:
+        res = client.get("/api/search", params={"q": f"needle{post_id}"}, headers=headers)
+        res.raise_for_status()
+        items = [item for item in res.json()["items"] if item["id"] == post_id]
+        if not items or items[0]["archived"] != archived:
+            misses += 1
+    return misses
+
+
+def report(label: str, latencies: list):
+    print(f"  {label:<28} p50 {percentile(latencies, 50) * 1000:>7.2f}ms  p99 {percentile(latencies, 99) * 1000:>7.2f}ms")
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--posts", type=int, default=2000)
+    parser.add_argument("--messages-per-post", type=int, default=20)
+    parser.add_argument("--chars", type=int, default=1500, help="characters per assistant message; prompts are 1/8 of it")
+    parser.add_argument("--cold-share", type=float, default=0.8)
+    parser.add_argument("--idle-days", type=int, default=archive.ARCHIVE_IDLE_DAYS)
+    parser.add_argument("--sample", type=int, default=200, help="posts of each kind opened")
+    args = parser.parse_args()
+
+    rng = random.Random(11)
+    Base.metadata.create_all(bind=engine)
+    cold = seed(args, rng)
+    db_file = engine.url.database
+    with engine.connect() as conn:
+        conn.execution_options(isolation_level="AUTOCOMMIT").execute(text("VACUUM"))
+    before = os.path.getsize(db_file)
+    print(f"{args.posts} posts x {args.messages_per_post} messages, {len(cold)} cold; database {before / 2**20:.1f}MB")
+
+    sample_cold = rng.sample(cold, min(args.sample, len(cold)))
+    seeded = histories(sample_cold)
+
+    started = time.perf_counter()
+    result = archive.compact(args.idle_days)
+    compact_seconds = time.perf_counter() - started
+    with engine.connect() as conn:
+        conn.execution_options(isolation_level="AUTOCOMMIT").execute(text("VACUUM"))
+    after = os.path.getsize(db_file)
+    print(f"compacted {result['posts']} posts ({result['messages']} messages) in {compact_seconds:.1f}s with {archive.ARCHIVE_CODEC}: "
+          f"{result['raw_bytes'] / 2**20:.1f}MB of history stored as {result['stored_bytes'] / 2**20:.1f}MB "
+          f"({result['raw_bytes'] / max(1, result['stored_bytes']):.1f}x)")
+    print(f"database after VACUUM {after / 2**20:.1f}MB, {(1 - after / before) * 100:.0f}% smaller")
+
+    client = TestClient(main.app)
+    headers = {"Authorization": f"Bearer {main.create_access_token({'sub': 'archive@example.com'})}"}
+    cold_set = set(cold)
+    hot = [p for p in range(1, args.posts + 1) if p not in cold_set]
+    sample_hot = rng.sample(hot, min(args.sample, len(hot)))
+    misses_archived = search_misses(client, headers, sample_cold, archived=True)
+    print(f"archived posts not found by search: {misses_archived} of {len(sample_cold)}")
+    print("GET /api/posts/{id}:")
+    report("hot", time_gets(client, headers, sample_hot))
+    report("archived, first open", time_gets(client, headers, sample_cold))
+    report("archived, opened again", time_gets(client, headers, sample_cold))
+    print(f"  rehydrate alone: {archive.stats()}")
+
+    restored = histories(sample_cold)
+    mismatched = sum(1 for p in sample_cold if restored[p] != seeded[p])
+    print(f"rehydrated histories differing from the seeded ones: {mismatched} of {len(sample_cold)}")
+    misses_rehydrated = search_misses(client, headers, sample_cold, archived=False)
+    print(f"rehydrated posts not found by search: {misses_rehydrated} of {len(sample_cold)}")
+    ok = not (mismatched or misses_archived or misses_rehydrated)
+    print("PASS" if ok else "FAIL")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main_()
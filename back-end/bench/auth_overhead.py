@@ -0,0 +1,71 @@
+"""Authentication overhead with and without the principal cache.
+
+Times GET /api/me in-process (TestClient, throwaway SQLite database) with
+the auth cache disabled and enabled, next to the unauthenticated
+GET /api/plans as a baseline, and prints the cache counters:
+
+    python bench/auth_overhead.py --requests 2000 --users 50
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'auth.db')}"
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import main  # noqa: E402
+from auth_cache import auth_cache  # noqa: E402
+from database import SessionLocal, engine  # noqa: E402
+from harness import percentile  # noqa: E402
+from models import Base, User  # noqa: E402
+
+
+def seed(n_users: int):
+    db = SessionLocal()
+    db.add_all(User(email=f"user{i}@example.com", hashed_password="x", plan="free", credit_remaining=10) for i in range(n_users))
+    db.commit()
+    db.close()
+    return [{"Authorization": f"Bearer {main.create_access_token({'sub': f'user{i}@example.com'})}"} for i in range(n_users)]
+
+
+def run(client: TestClient, url: str, headers: list, n: int) -> list:
+    latencies = []
+    for _ in range(n):
+        started = time.perf_counter()
+        client.get(url, headers=random.choice(headers)).raise_for_status()
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=50)
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    headers = seed(args.users)
+    client = TestClient(main.app)
+    run(client, "/api/me", headers, 100)  # warm up imports, pool and JIT-ish caches
+
+    auth_cache.enabled = False
+    baseline = run(client, "/api/plans", headers, args.requests)
+    uncached = run(client, "/api/me", headers, args.requests)
+    auth_cache.enabled = True
+    auth_cache.backend.clear()
+    cached = run(client, "/api/me", headers, args.requests)
+
+    print(f"{'case':<24} {'p50':>9} {'p99':>9}")
+    for name, latencies in (("/api/plans (no auth)", baseline), ("/api/me, cache off", uncached), ("/api/me, cache on", cached)):
+        print(f"{name:<24} {percentile(latencies, 50) * 1000:>7.2f}ms {percentile(latencies, 99) * 1000:>7.2f}ms")
+    print("auth cache:", auth_cache.stats())
+
+
+if __name__ == "__main__":
+    main_()
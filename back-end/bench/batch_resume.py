@@ -0,0 +1,104 @@
+"""Batch generation end to end, including a crash in the middle.
+
+Boots the backend against the fake OpenRouter server, gives a starter-plan
+account fewer credits than the batch needs and submits --prompts prompts.
+Part-way through the backend is SIGKILLed and restarted on the same
+database. The job then stops when credits run out, is topped up and resumed.
+Exits non-zero unless every prompt produced exactly one Post, one usage
+record and one credit:
+
+    python bench/batch_resume.py --prompts 200 --credits 150
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import httpx
+from sqlalchemy import create_engine, text
+
+from harness import create_user, start_backend, start_fake_upstream, stop
+
+
+def wait_for(base_url: str, headers: dict, job_id: int, done, timeout: float = 300) -> dict:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = httpx.get(f"{base_url}/api/batch/{job_id}", headers=headers).json()
+        if done(job):
+            return job
+        time.sleep(0.2)
+    raise RuntimeError(f"batch job did not get there in {timeout}s: {job}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--prompts", type=int, default=200)
+    parser.add_argument("--credits", type=int, default=150)
+    parser.add_argument("--kill-after", type=int, default=50, help="completed prompts before the SIGKILL")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--user-rate", type=float, default=6000, help="BATCH_USER_RATE, prompts per minute")
+    args = parser.parse_args()
+
+    database_url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'batch.db')}"
+    env = {
+        "BATCH_CONCURRENCY": str(args.concurrency),
+        "BATCH_USER_CONCURRENCY": str(args.concurrency),
+        "BATCH_USER_RATE": str(args.user_rate),
+        "BATCH_POLL_INTERVAL": "0.2",
+        "USAGE_LEDGER_FLUSH_INTERVAL": "0.2",
+    }
+    upstream, upstream_url = start_fake_upstream(tokens=50, token_rate=500, first_token_delay=0.05)
+    backend, base_url = start_backend(database_url, upstream_url, env)
+    engine = create_engine(database_url)
+    try:
+        token = create_user(base_url, database_url, "batch@example.com", plan="starter")
+        headers = {"Authorization": f"Bearer {token}"}
+        with engine.begin() as conn:
+            conn.execute(text("UPDATE users SET credit_remaining = :c"), {"c": args.credits})
+
+        body = "\n".join(json.dumps({"prompt": f"Write a tagline for product #{i}"}) for i in range(args.prompts))
+        started = time.perf_counter()
+        job_id = httpx.post(f"{base_url}/api/batch", content=body, headers=headers).json()["job_id"]
+
+        job = wait_for(base_url, headers, job_id, lambda j: j["completed"] >= args.kill_after)
+        backend.kill()
+        backend.wait()
+        print(f"killed backend at {job['completed']} completed")
+        backend, base_url = start_backend(database_url, upstream_url, env)
+
+        job = wait_for(base_url, headers, job_id, lambda j: j["status"] in ("stopped", "completed"))
+        print(f"after restart: {job['status']} with {job['completed']}/{job['total']} ({job['error']})")
+        with engine.begin() as conn:
+            conn.execute(text("UPDATE users SET credit_remaining = credit_remaining + :c"), {"c": args.prompts})
+        httpx.post(f"{base_url}/api/batch/{job_id}/resume", headers=headers).raise_for_status()
+        job = wait_for(base_url, headers, job_id, lambda j: j["status"] == "completed")
+        elapsed = time.perf_counter() - started
+        time.sleep(1.0)  # let the usage ledger flush
+
+        items = httpx.get(f"{base_url}/api/batch/{job_id}?items=true", headers=headers).json()["items"]
+        with engine.connect() as conn:
+            posts = conn.execute(text("SELECT COUNT(*) FROM posts")).scalar()
+            usage = conn.execute(text("SELECT COUNT(*) FROM usage_records")).scalar()
+            balance = conn.execute(text("SELECT credit_remaining FROM users")).scalar()
+    finally:
+        stop(backend, upstream)
+        engine.dispose()
+
+    post_ids = {item["post_id"] for item in items}
+    print(f"{job['completed']} completed, {job['failed']} failed in {elapsed:.1f}s including the restart")
+    print(f"posts={posts} distinct post_ids={len(post_ids)} usage_records={usage} credit_remaining={balance}")
+    ok = (
+        job["completed"] == args.prompts
+        and posts == args.prompts
+        and len(post_ids) == args.prompts
+        and usage == args.prompts
+        and balance == args.credits
+    )
+    print("PASS" if ok else "FAIL")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
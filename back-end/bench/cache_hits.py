@@ -0,0 +1,95 @@
+"""Response cache hit rate and latency on a templated-prompt workload.
+
+Boots the backend with RESPONSE_CACHE_ENABLED against the fake OpenRouter
+server and sends --requests new-chat generations drawn (Zipf-like) from
+--distinct templated prompts, some with stray whitespace that the cache key
+normalizes away. Prints time-to-first-byte and total time for misses and
+hits, and the cache's own counters from /api/metrics/response-cache:
+
+    python bench/cache_hits.py --requests 300 --distinct 40 --backend sqlite
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+import httpx
+
+from harness import create_user, percentile, start_backend, start_fake_upstream, stop
+
+PRODUCTS = ["coffee shop", "yoga studio", "bike repair", "bakery", "bookstore", "dog groomer", "tea room", "gym"]
+FORMATS = ["tagline", "Instagram caption", "product description", "email subject line", "tweet"]
+
+
+def prompts(distinct: int) -> list:
+    pool = [f"Write a {fmt} for a {product}" for product in PRODUCTS for fmt in FORMATS]
+    return pool[:distinct]
+
+
+async def fire(base_url: str, token: str, pool: list, n: int, concurrency: int) -> dict:
+    results = {"hit": {"ttfb": [], "total": []}, "miss": {"ttfb": [], "total": []}}
+    weights = [1 / (rank + 1) for rank in range(len(pool))]
+    gate = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(timeout=120) as client:
+        async def one():
+            prompt = random.choices(pool, weights)[0]
+            if random.random() < 0.3:
+                prompt = "  " + prompt.replace(" ", "  ") + "\n"
+            async with gate:
+                started = time.perf_counter()
+                ttfb = None
+                async with client.stream(
+                    "POST",
+                    f"{base_url}/api/generate_stream",
+                    json={"prompt": prompt},
+                    headers={"Authorization": f"Bearer {token}"},
+                ) as res:
+                    res.raise_for_status()
+                    async for _ in res.aiter_bytes():
+                        if ttfb is None:
+                            ttfb = time.perf_counter() - started
+                bucket = results[res.headers.get("X-Response-Cache", "miss")]
+                bucket["ttfb"].append(ttfb)
+                bucket["total"].append(time.perf_counter() - started)
+
+        await asyncio.gather(*(one() for _ in range(n)))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--distinct", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--backend", default="memory", choices=["memory", "sqlite", "redis"])
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    database_url = f"sqlite:///{os.path.join(workdir, 'cache.db')}"
+    upstream, upstream_url = start_fake_upstream(tokens=100, token_rate=200, first_token_delay=0.3)
+    backend, base_url = start_backend(database_url, upstream_url, {
+        "RESPONSE_CACHE_ENABLED": "true",
+        "RESPONSE_CACHE_BACKEND": args.backend,
+        "RESPONSE_CACHE_SQLITE_PATH": os.path.join(workdir, "responses.db"),
+    })
+    try:
+        token = create_user(base_url, database_url, "cache@example.com")
+        results = asyncio.run(fire(base_url, token, prompts(args.distinct), args.requests, args.concurrency))
+        stats = httpx.get(f"{base_url}/api/metrics/response-cache").json()
+    finally:
+        stop(backend, upstream)
+
+    print(f"{'':<6} {'count':>6} {'ttfb p50':>10} {'ttfb p99':>10} {'total p50':>10}")
+    for name, bucket in results.items():
+        if bucket["total"]:
+            print(
+                f"{name:<6} {len(bucket['total']):>6} {percentile(bucket['ttfb'], 50) * 1000:>8.1f}ms "
+                f"{percentile(bucket['ttfb'], 99) * 1000:>8.1f}ms {percentile(bucket['total'], 50) * 1000:>8.1f}ms"
+            )
+    print("response cache:", stats)
+
+
+if __name__ == "__main__":
+    main()
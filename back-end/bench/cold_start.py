@@ -0,0 +1,163 @@
+"""Cold start and graceful shutdown of the serve.py launcher.
+
+For each worker count in --workers, on a fresh SQLite database:
+
+- migrate: `alembic upgrade head` once, as serve.py --migrate does
+- boot: spawn serve.py and poll until /healthz answers, until the first
+  /readyz is 200, and until every worker has answered /readyz with 200
+  (each reports its pid)
+
+Times are the median of --runs boots. Also reported, for comparison with
+the old per-worker `Base.metadata.create_all` at import: the import time of
+main and what create_all costs against an up-to-date schema.
+
+Last, with --drain, a generation is started against the fake upstream
+(--drain-tokens tokens at 50/s), SIGTERM is sent half a second in, and the
+bench checks the stream still completes and reports how long exit took:
+
+    python bench/cold_start.py --workers 1,4 --runs 3 --drain
+"""
+import argparse
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+
+from harness import BACKEND_DIR, create_user, free_port, migrate, start_fake_upstream, stop
+
+
+def fresh_database() -> str:
+    return f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'cold.db')}"
+
+
+def spawn(database_url: str, workers: int, extra_env: dict = None):
+    port = free_port()
+    env = dict(os.environ, DATABASE_URL=database_url, OPENROUTER_API_KEY="bench", ADMISSION_ENABLED="false", **(extra_env or {}))
+    proc = subprocess.Popen(
+        [sys.executable, "serve.py", "--port", str(port), "--workers", str(workers), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        env=env,
+    )
+    return proc, f"http://127.0.0.1:{port}"
+
+
+def boot(database_url: str, workers: int, timeout: float = 60.0) -> dict:
+    started = time.perf_counter()
+    proc, base_url = spawn(database_url, workers)
+    times = {}
+    ready_workers = set()
+    # A fresh connection per poll, so the kernel can hand it to any worker; one client, so
+    # polling stays cheap on the CPU the workers are booting on
+    client = httpx.Client(timeout=1.0, headers={"Connection": "close"})
+    try:
+        while time.perf_counter() - started < timeout and len(ready_workers) < workers:
+            try:
+                if "healthz" not in times:
+                    client.get(f"{base_url}/healthz").raise_for_status()
+                    times["healthz"] = time.perf_counter() - started
+                res = client.get(f"{base_url}/readyz")
+                if res.status_code == 200:
+                    times.setdefault("first_ready", time.perf_counter() - started)
+                    ready_workers.add(res.json()["worker"])
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.01)
+        if len(ready_workers) == workers:
+            times["all_ready"] = time.perf_counter() - started
+    finally:
+        client.close()
+        stop(proc)
+    return times
+
+
+def python_seconds(database_url: str, code: str) -> float:
+    out = subprocess.run(
+        [sys.executable, "-c", code], cwd=BACKEND_DIR, env=dict(os.environ, DATABASE_URL=database_url),
+        check=True, capture_output=True, text=True,
+    ).stdout
+    return float(out.strip().splitlines()[-1])
+
+
+def drain(tokens: int) -> dict:
+    database_url = fresh_database()
+    migrate(database_url)
+    upstream, upstream_url = start_fake_upstream(tokens=tokens, token_rate=50.0, first_token_delay=0.1)
+    proc, base_url = spawn(database_url, 1, {"OPENROUTER_BASE_URL": upstream_url, "DRAIN_TIMEOUT": "30"})
+    try:
+        deadline = time.time() + 30
+        while time.time() < deadline:
+            try:
+                if httpx.get(f"{base_url}/readyz", timeout=1.0).status_code == 200:
+                    break
+            except httpx.HTTPError:
+                time.sleep(0.05)
+        token = create_user(base_url, database_url, "drain@example.com")
+        result = {}
+
+        def generate():
+            with httpx.stream("POST", f"{base_url}/api/generate_stream", json={"prompt": "drain me"},
+                              headers={"Authorization": f"Bearer {token}"}, timeout=60) as res:
+                result["text"] = "".join(res.iter_text())
+
+        client = threading.Thread(target=generate)
+        client.start()
+        time.sleep(0.5)
+        signalled = time.perf_counter()
+        proc.send_signal(signal.SIGTERM)
+        client.join()
+        proc.wait(timeout=60)
+        return {
+            "tokens_received": result.get("text", "").count("tok"),
+            "tokens_expected": tokens,
+            "exit_after_sigterm": time.perf_counter() - signalled,
+            "exit_code": proc.returncode,
+        }
+    finally:
+        stop(proc, upstream)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default="1,4", help="comma separated worker counts")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--drain", action="store_true")
+    parser.add_argument("--drain-tokens", type=int, default=150)
+    args = parser.parse_args()
+
+    database_url = fresh_database()
+    started = time.perf_counter()
+    migrate(database_url)
+    print(f"migrate a fresh database: {time.perf_counter() - started:.2f}s (once per deploy)")
+    import_main = python_seconds(database_url, "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)")
+    create_all = python_seconds(database_url, (
+        "import search, time; from database import engine; from models import Base; "
+        "t = time.perf_counter(); Base.metadata.create_all(bind=engine); print(time.perf_counter() - t)"
+    ))
+    print(f"import main: {import_main * 1000:.0f}ms; create_all on an up-to-date schema, no longer run per worker: {create_all * 1000:.0f}ms")
+
+    print(f"{'workers':>7} {'healthz':>9} {'first ready':>12} {'all ready':>10}")
+    for workers in (int(n) for n in args.workers.split(",")):
+        runs = [boot(database_url, workers) for _ in range(args.runs)]
+
+        def median(key):
+            values = [run[key] for run in runs if key in run]
+            return f"{statistics.median(values):.2f}s" if values else "-"
+
+        print(f"{workers:>7} {median('healthz'):>9} {median('first_ready'):>12} {median('all_ready'):>10}")
+
+    if args.drain:
+        result = drain(args.drain_tokens)
+        # uvicorn re-raises the signal once it has shut down, so a clean exit reads as -SIGTERM
+        exit_status = "clean" if result["exit_code"] in (0, -signal.SIGTERM) else f"code {result['exit_code']}"
+        print(f"SIGTERM mid-generation: {result['tokens_received']} of {result['tokens_expected']} tokens delivered, "
+              f"{exit_status} exit after {result['exit_after_sigterm']:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
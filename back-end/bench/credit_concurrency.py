@@ -0,0 +1,79 @@
+"""Fire hundreds of parallel generations at one prepaid account.
+
+Boots the backend against the fake OpenRouter server, gives a starter-plan
+account --credits credits and launches --requests simultaneous
+/api/generate_stream calls. Exits non-zero unless exactly --credits of them
+stream, the rest get 403, the balance ends at zero and the usage ledger
+wrote one UsageRecord per successful generation:
+
+    python bench/credit_concurrency.py --requests 300 --credits 50
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import httpx
+from sqlalchemy import create_engine, text
+
+from harness import create_user, start_backend, start_fake_upstream, stop
+
+
+async def fire(base_url: str, token: str, n: int) -> dict:
+    counts = {}
+    limits = httpx.Limits(max_connections=n, max_keepalive_connections=n)
+    async with httpx.AsyncClient(limits=limits, timeout=120) as client:
+        async def one():
+            res = await client.post(
+                f"{base_url}/api/generate_stream",
+                json={"prompt": "Tagline for a coffee shop"},
+                headers={"Authorization": f"Bearer {token}"},
+            )
+            counts[res.status_code] = counts.get(res.status_code, 0) + 1
+
+        await asyncio.gather(*(one() for _ in range(n)))
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--credits", type=int, default=50)
+    args = parser.parse_args()
+
+    database_url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'credits.db')}"
+    upstream, upstream_url = start_fake_upstream(tokens=20, token_rate=100, first_token_delay=0.05)
+    backend, base_url = start_backend(database_url, upstream_url, {"USAGE_LEDGER_FLUSH_INTERVAL": "0.5"})
+    engine = create_engine(database_url)
+    try:
+        token = create_user(base_url, database_url, "credits@example.com", plan="starter")
+        with engine.begin() as conn:
+            conn.execute(text("UPDATE users SET credit_remaining = :c"), {"c": args.credits})
+
+        started = time.perf_counter()
+        counts = asyncio.run(fire(base_url, token, args.requests))
+        elapsed = time.perf_counter() - started
+        time.sleep(1.5)  # let the ledger flush
+        with engine.connect() as conn:
+            balance = conn.execute(text("SELECT credit_remaining FROM users")).scalar()
+            usage_rows = conn.execute(text("SELECT COUNT(*) FROM usage_records")).scalar()
+    finally:
+        stop(backend, upstream)
+        engine.dispose()
+
+    print(f"{args.requests} requests in {elapsed:.2f}s: {counts}")
+    print(f"credit_remaining={balance} usage_records={usage_rows}")
+    ok = (
+        counts.get(200, 0) == args.credits
+        and counts.get(403, 0) == args.requests - args.credits
+        and balance == 0
+        and usage_rows == args.credits
+    )
+    print("PASS" if ok else "FAIL")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Model routing under injected upstream faults.
+
+Boots two fake OpenRouter servers ("primary" and "backup") and routes the
+backend to them through LLM_ROUTES, then runs each scenario: faults are
+injected into the primary via its /control endpoint and --requests
+generations are fired --concurrency at a time. Reports completed/failed
+streams, time to first byte, and where the router sent the traffic:
+
+    python bench/failover.py --requests 100 --concurrency 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+import httpx
+
+from harness import create_user, percentile, start_backend, start_fake_upstream, stop
+
+SCENARIOS = [
+    # name, primary faults, backend env
+    ("healthy", {}, {}),
+    ("primary down", {"fail_rate": 1.0}, {}),
+    ("primary slow 30%, no failover", {"slow_rate": 0.3, "slow_delay": 3.0}, {"LLM_FIRST_BYTE_TIMEOUT": "30"}),
+    ("primary slow 30%, 1s first-byte timeout", {"slow_rate": 0.3, "slow_delay": 3.0}, {"LLM_FIRST_BYTE_TIMEOUT": "1"}),
+    ("primary slow 30%, hedge after 0.4s", {"slow_rate": 0.3, "slow_delay": 3.0}, {"LLM_FIRST_BYTE_TIMEOUT": "30", "LLM_HEDGE_AFTER": "0.4"}),
+]
+
+
+async def fire(base_url: str, token: str, n: int, concurrency: int) -> dict:
+    results = {"ok": 0, "failed": 0, "ttfb": []}
+    gate = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(timeout=120) as client:
+        async def one():
+            async with gate:
+                started = time.perf_counter()
+                ttfb, body = None, b""
+                async with client.stream(
+                    "POST",
+                    f"{base_url}/api/generate_stream",
+                    json={"prompt": "Write a tagline for a bakery"},
+                    headers={"Authorization": f"Bearer {token}"},
+                ) as res:
+                    async for chunk in res.aiter_bytes():
+                        if ttfb is None:
+                            ttfb = time.perf_counter() - started
+                        body += chunk
+                if res.status_code == 200 and "Error:" not in body.decode("utf-8", "replace"):
+                    results["ok"] += 1
+                    results["ttfb"].append(ttfb)
+                else:
+                    results["failed"] += 1
+
+        await asyncio.gather(*(one() for _ in range(n)))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=10)
+    args = parser.parse_args()
+
+    primary, primary_url = start_fake_upstream(tokens=30, token_rate=200, first_token_delay=0.1)
+    backup, backup_url = start_fake_upstream(tokens=30, token_rate=200, first_token_delay=0.25)
+    routes = json.dumps([
+        {"name": "primary", "model": "fake/primary", "base_url": primary_url},
+        {"name": "backup", "model": "fake/backup", "base_url": backup_url},
+    ])
+    print(f"{'scenario':<42} {'ok':>4} {'fail':>5} {'ttfb p50':>9} {'ttfb p99':>9}  routed (successes primary/backup, primary breaker)")
+    try:
+        for name, faults, env in SCENARIOS:
+            httpx.post(f"{primary_url}/control", json={"fail_rate": 0, "slow_rate": 0, **faults}).raise_for_status()
+            database_url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'failover.db')}"
+            backend, base_url = start_backend(database_url, primary_url, {"LLM_ROUTES": routes, **env})
+            try:
+                token = create_user(base_url, database_url, "failover@example.com")
+                result = asyncio.run(fire(base_url, token, args.requests, args.concurrency))
+                routed = httpx.get(f"{base_url}/api/metrics/llm").json()["routes"]
+            finally:
+                stop(backend)
+            print(
+                f"{name:<42} {result['ok']:>4} {result['failed']:>5} "
+                f"{percentile(result['ttfb'], 50) * 1000:>7.0f}ms {percentile(result['ttfb'], 99) * 1000:>7.0f}ms  "
+                f"{routed['primary']['successes']}/{routed['backup']['successes']}, {routed['primary']['breaker']}"
+            )
+    finally:
+        stop(primary, backup)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""Local stand-in for the OpenRouter chat completions API.
+
+Streams a fixed number of tokens at a configurable rate so the backend can be
+load tested without network access or API spend:
+
+    python bench/fake_openrouter.py --port 9100 --tokens 200 --token-rate 50
+
+Point the backend at it with OPENROUTER_BASE_URL=http://127.0.0.1:9100.
+
+Faults can be injected to exercise routing and failover: --fail-rate answers
+that share of requests with a 500, --slow-rate delays the first token of that
+share by --slow-delay seconds. Both can be changed on a running server with
+POST /control {"fail_rate": 1.0, "slow_rate": 0, "slow_delay": 5}.
+
+--max-concurrency models a provider quota: streams beyond it are answered
+with a 429, as OpenRouter does when an account is over its limits.
+
+POST /images/generations answers like the OpenAI images API with a small
+PNG after --image-delay seconds; point IMAGE_BASE_URL at this server to
+exercise the image pipeline's real client path.
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import random
+import struct
+import time
+import zlib
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+def create_app(
+    tokens: int = 200,
+    token_rate: float = 50.0,
+    first_token_delay: float = 0.2,
+    fail_rate: float = 0.0,
+    slow_rate: float = 0.0,
+    slow_delay: float = 5.0,
+    max_concurrency: int = 0,
+    image_delay: float = 1.0,
+) -> FastAPI:
+    app = FastAPI()
+    app.state.stats = {"images": 0, "requests": 0, "active": 0, "peak_active": 0, "cancelled": 0, "failed": 0, "slowed": 0, "throttled": 0}
+    app.state.faults = {"fail_rate": fail_rate, "slow_rate": slow_rate, "slow_delay": slow_delay}
+
+    def chunk(model: str, content: str = None, finish_reason: str = None) -> str:
+        delta = {"content": content} if content is not None else {}
+        body = {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        return f"data: {json.dumps(body)}\n\n"
+
+    @app.post("/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "fake-model")
+        n_tokens = min(tokens, body.get("max_tokens") or tokens)
+        stats = app.state.stats
+        faults = app.state.faults
+        stats["requests"] += 1
+
+        if random.random() < faults["fail_rate"]:
+            stats["failed"] += 1
+            return JSONResponse({"error": {"message": "injected failure", "code": 500}}, status_code=500)
+        if max_concurrency and stats["active"] >= max_concurrency:
+            stats["throttled"] += 1
+            return JSONResponse({"error": {"message": "rate limit exceeded", "code": 429}}, status_code=429)
+        delay = first_token_delay
+        if random.random() < faults["slow_rate"]:
+            stats["slowed"] += 1
+            delay += faults["slow_delay"]
+
+        if not body.get("stream"):
+            await asyncio.sleep(delay + n_tokens / token_rate)
+            return JSONResponse({
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": " ".join(f"tok{i}" for i in range(n_tokens))},
+                    "finish_reason": "stop",
+                }],
+            })
+
+        async def events():
+            stats["active"] += 1
+            stats["peak_active"] = max(stats["peak_active"], stats["active"])
+            try:
+                await asyncio.sleep(delay)
+                for i in range(n_tokens):
+                    yield chunk(model, f"tok{i} ")
+                    await asyncio.sleep(1 / token_rate)
+                yield chunk(model, finish_reason="stop")
+                yield "data: [DONE]\n\n"
+            except asyncio.CancelledError:
+                stats["cancelled"] += 1
+                raise
+            finally:
+                stats["active"] -= 1
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.post("/images/generations")
+    async def image_generations(request: Request):
+        body = await request.json()
+        app.state.stats["images"] += 1
+        if random.random() < app.state.faults["fail_rate"]:
+            app.state.stats["failed"] += 1
+            return JSONResponse({"error": {"message": "injected failure", "code": 500}}, status_code=500)
+        await asyncio.sleep(image_delay)
+        image = png(64, 64, hashlib.sha256(body.get("prompt", "").encode("utf-8")).digest()[:3])
+        return JSONResponse({"created": int(time.time()), "data": [{"b64_json": base64.b64encode(image).decode("ascii")}]})
+
+    @app.post("/control")
+    async def control(request: Request):
+        updates = await request.json()
+        app.state.faults.update({k: float(v) for k, v in updates.items() if k in app.state.faults})
+        return JSONResponse(app.state.faults)
+
+    @app.get("/stats")
+    async def get_stats():
+        return JSONResponse(app.state.stats)
+
+    return app
+
+
+def png(width: int, height: int, rgb: bytes) -> bytes:
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    pixels = (b"\x00" + rgb * width) * height
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(pixels)) + chunk(b"IEND", b"")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--tokens", type=int, default=200, help="tokens per completion")
+    parser.add_argument("--token-rate", type=float, default=50.0, help="tokens per second per stream")
+    parser.add_argument("--first-token-delay", type=float, default=0.2, help="seconds before the first token")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of requests answered with a 500")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="share of requests whose first token is delayed")
+    parser.add_argument("--slow-delay", type=float, default=5.0, help="extra seconds before a slowed first token")
+    parser.add_argument("--max-concurrency", type=int, default=0, help="streams served at once before answering 429 (0: unlimited)")
+    parser.add_argument("--image-delay", type=float, default=1.0, help="seconds to produce an image")
+    args = parser.parse_args()
+    uvicorn.run(
+        create_app(args.tokens, args.token_rate, args.first_token_delay, args.fail_rate, args.slow_rate, args.slow_delay, args.max_concurrency, args.image_delay),
+        host=args.host,
+        port=args.port,
+        log_level="warning",
+    )
@@ -0,0 +1,113 @@
+"""Shared helpers for the benchmark scripts: process boot, users, percentiles."""
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+from sqlalchemy import create_engine, text
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.join(BACKEND_DIR, "bench")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_http(url: str, timeout: float = 20.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def start_fake_upstream(tokens: int = 200, token_rate: float = 50.0, first_token_delay: float = 0.2, **faults):
+    """Boot bench/fake_openrouter.py; faults are its --fail-rate/--slow-rate/--slow-delay/--max-concurrency options."""
+    port = free_port()
+    proc = subprocess.Popen(
+        [
+            sys.executable, os.path.join(BENCH_DIR, "fake_openrouter.py"),
+            "--port", str(port),
+            "--tokens", str(tokens),
+            "--token-rate", str(token_rate),
+            "--first-token-delay", str(first_token_delay),
+            *(arg for name, value in faults.items() for arg in (f"--{name.replace('_', '-')}", str(value))),
+        ],
+        cwd=BACKEND_DIR,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    wait_for_http(f"{base_url}/stats")
+    return proc, base_url
+
+
+def migrate(database_url: str):
+    """Bring the database to the newest revision; the backend never creates tables itself."""
+    subprocess.run(
+        [sys.executable, "-m", "alembic", "upgrade", "head"],
+        cwd=BACKEND_DIR,
+        env=dict(os.environ, DATABASE_URL=database_url),
+        check=True,
+        capture_output=True,
+    )
+
+
+def start_backend(database_url: str, upstream_url: str, extra_env: dict = None, workers: int = 1):
+    """Migrate, then boot the backend with uvicorn; admission control is off unless extra_env
+    turns it on, since most benches drive one user far past its plan's limits on purpose."""
+    migrate(database_url)
+    port = free_port()
+    env = dict(
+        os.environ,
+        DATABASE_URL=database_url,
+        OPENROUTER_BASE_URL=upstream_url,
+        OPENROUTER_API_KEY="bench",
+        ADMISSION_ENABLED="false",
+    )
+    env.update(extra_env or {})
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"]
+        + (["--workers", str(workers)] if workers > 1 else []),
+        cwd=BACKEND_DIR,
+        env=env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    wait_for_http(f"{base_url}/api/plans")
+    return proc, base_url
+
+
+def stop(*procs):
+    for proc in procs:
+        proc.terminate()
+    for proc in procs:
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def create_user(base_url: str, database_url: str, email: str, password: str = "bench-password", plan: str = "flexible", credits: float = 0) -> str:
+    """Register a user, force its plan and credits directly in the database and return a bearer token."""
+    httpx.post(f"{base_url}/api/register", json={"email": email, "password": password}).raise_for_status()
+    engine = create_engine(database_url)
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE users SET plan = :plan, credit_remaining = :credits WHERE email = :email"), {"plan": plan, "credits": credits, "email": email})
+    engine.dispose()
+    res = httpx.post(f"{base_url}/api/login", json={"email": email, "password": password})
+    res.raise_for_status()
+    return res.json()["access_token"]
+
+
+def percentile(values, pct: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
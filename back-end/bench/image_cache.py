@@ -0,0 +1,86 @@
+"""Image jobs: cold prompts, concurrent duplicates and cache hits.
+
+Boots the backend with the stub image backend (--stub-delay seconds per
+picture) and a throwaway asset cache, then asks for --prompts distinct
+prompts, each from --copies concurrent clients. Every client polls its
+job until the image is ready and downloads it. A second round repeats
+the same prompts, which should all be answered from the cache. Reports
+time to a usable imageUrl per round, upstream calls made and the asset
+download with and without If-None-Match:
+
+    python bench/image_cache.py --prompts 20 --copies 5 --stub-delay 1.0
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import httpx
+
+from harness import create_user, percentile, start_backend, stop
+
+
+async def fetch_image(client: httpx.AsyncClient, base_url: str, prompt: str) -> tuple:
+    started = time.perf_counter()
+    res = await client.post(f"{base_url}/api/generate_image", json={"prompt": prompt})
+    res.raise_for_status()
+    data = res.json()
+    while data["status"] not in ("done", "failed"):
+        await asyncio.sleep(0.1)
+        data = (await client.get(data.get("status_url") or f"{base_url}/api/generate_image/{data['job_id']}")).json()
+    if data["status"] == "failed":
+        raise RuntimeError(f"image job failed: {data['error']}")
+    return time.perf_counter() - started, data["imageUrl"], res.status_code
+
+
+async def round_trip(base_url: str, token: str, prompts: list, copies: int) -> tuple:
+    headers = {"Authorization": f"Bearer {token}"}
+    async with httpx.AsyncClient(headers=headers, timeout=60) as client:
+        results = await asyncio.gather(*(fetch_image(client, base_url, p) for p in prompts for _ in range(copies)))
+    latencies = [r[0] for r in results]
+    statuses = {}
+    for _, _, code in results:
+        statuses[code] = statuses.get(code, 0) + 1
+    return latencies, statuses, results[0][1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--prompts", type=int, default=20)
+    parser.add_argument("--copies", type=int, default=5, help="concurrent requests per prompt")
+    parser.add_argument("--stub-delay", type=float, default=1.0)
+    parser.add_argument("--downloads", type=int, default=500)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    database_url = f"sqlite:///{os.path.join(workdir, 'images.db')}"
+    backend, base_url = start_backend(database_url, "http://127.0.0.1:9", {
+        "IMAGE_BACKEND": "stub",
+        "IMAGE_STUB_DELAY": str(args.stub_delay),
+        "IMAGE_CACHE_DIR": os.path.join(workdir, "image_cache"),
+    })
+    try:
+        token = create_user(base_url, database_url, "images@example.com", plan="pro", credits=10_000)
+        prompts = [f"A watercolour lighthouse at dusk, variation {i}" for i in range(args.prompts)]
+        for label in ("cold", "cached"):
+            latencies, statuses, image_url = asyncio.run(round_trip(base_url, token, prompts, args.copies))
+            stats = httpx.get(f"{base_url}/api/metrics/images").json()
+            print(f"{label:<7} {len(latencies)} requests: p50 {percentile(latencies, 50) * 1000:.0f}ms, "
+                  f"p99 {percentile(latencies, 99) * 1000:.0f}ms, statuses {statuses}, "
+                  f"upstream calls so far {stats['upstream_calls']}, joined in flight {stats['shared']}")
+
+        with httpx.Client() as client:
+            for label, headers in (("full", {}), ("If-None-Match", {"If-None-Match": client.get(image_url).headers["etag"]})):
+                started = time.perf_counter()
+                for _ in range(args.downloads):
+                    res = client.get(image_url, headers=headers)
+                elapsed = time.perf_counter() - started
+                print(f"asset download ({label}): {res.status_code}, {len(res.content)} bytes, "
+                      f"{elapsed / args.downloads * 1000:.2f}ms each")
+    finally:
+        stop(backend)
+
+
+if __name__ == "__main__":
+    main()
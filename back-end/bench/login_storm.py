@@ -0,0 +1,86 @@
+"""Login storm: many simultaneous /api/login calls against one worker.
+
+Runs the same storm twice, once with the hashing pool effectively unbounded
+(40 workers, no queue limit: what running bcrypt inline in the default
+threadpool amounted to) and once with the bounded defaults, while probing
+/api/plans to see how much the storm hurts unrelated traffic:
+
+    python bench/login_storm.py --logins 400 --rounds 10
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+import httpx
+
+from harness import percentile, start_backend, start_fake_upstream, stop
+
+CONFIGS = {
+    "unbounded": {"PASSWORD_HASH_WORKERS": "40", "PASSWORD_HASH_MAX_QUEUE": "1000000"},
+    "bounded": {},
+}
+
+
+async def storm(base_url: str, emails: list, n: int) -> dict:
+    logins, probes, statuses = [], [], {}
+    limits = httpx.Limits(max_connections=n + 10, max_keepalive_connections=n + 10)
+    async with httpx.AsyncClient(limits=limits, timeout=300) as client:
+        done = asyncio.Event()
+
+        async def login():
+            started = time.perf_counter()
+            res = await client.post(f"{base_url}/api/login", json={"email": random.choice(emails), "password": "storm-password"})
+            statuses[res.status_code] = statuses.get(res.status_code, 0) + 1
+            if res.status_code == 200:
+                logins.append(time.perf_counter() - started)
+
+        async def probe():
+            while not done.is_set():
+                started = time.perf_counter()
+                await client.get(f"{base_url}/api/plans")
+                probes.append(time.perf_counter() - started)
+                await asyncio.sleep(0.05)
+
+        prober = asyncio.create_task(probe())
+        started = time.perf_counter()
+        await asyncio.gather(*(login() for _ in range(n)))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await prober
+    return {"elapsed": elapsed, "logins": logins, "probes": probes, "statuses": statuses}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=400)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=10, help="BCRYPT_ROUNDS for the run")
+    args = parser.parse_args()
+
+    upstream, upstream_url = start_fake_upstream()
+    try:
+        print(f"{'config':<10} {'ok/s':>7} {'login p50':>10} {'login p99':>10} {'probe p99':>10}  statuses")
+        for name, env in CONFIGS.items():
+            database_url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'storm.db')}"
+            backend, base_url = start_backend(database_url, upstream_url, {"BCRYPT_ROUNDS": str(args.rounds), **env})
+            try:
+                emails = [f"storm{i}@example.com" for i in range(args.users)]
+                for email in emails:
+                    httpx.post(f"{base_url}/api/register", json={"email": email, "password": "storm-password"}, timeout=60).raise_for_status()
+                result = asyncio.run(storm(base_url, emails, args.logins))
+            finally:
+                stop(backend)
+            print(
+                f"{name:<10} {len(result['logins']) / result['elapsed']:>7.1f} "
+                f"{percentile(result['logins'], 50) * 1000:>8.0f}ms {percentile(result['logins'], 99) * 1000:>8.0f}ms "
+                f"{percentile(result['probes'], 99) * 1000:>8.1f}ms  {result['statuses']}"
+            )
+    finally:
+        stop(upstream)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Cost of request metrics on cheap requests.
+
+Times GET /api/plans (no database) and GET /api/posts/{id} (auth cache on,
+two queries) in-process (TestClient, throwaway SQLite database) with
+metrics off, on for every request, and sampled at --sample-rate, then
+times rendering /metrics once the histograms hold those series:
+
+    python bench/metrics_overhead.py --requests 3000 --sample-rate 0.1
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'metrics.db')}"
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import main  # noqa: E402
+import metrics  # noqa: E402
+from database import SessionLocal, engine  # noqa: E402
+from harness import percentile  # noqa: E402
+from models import Base, Post, User  # noqa: E402
+
+
+def seed():
+    db = SessionLocal()
+    user = User(email="user@example.com", hashed_password="x", plan="free", credit_remaining=10)
+    db.add(user)
+    db.flush()
+    post = Post(user_id=user.id, title="Benchmark")
+    db.add(post)
+    db.commit()
+    post_id = post.id
+    db.close()
+    return post_id, {"Authorization": f"Bearer {main.create_access_token({'sub': 'user@example.com'})}"}
+
+
+def run(client: TestClient, url: str, headers: dict, n: int) -> list:
+    latencies = []
+    for _ in range(n):
+        started = time.perf_counter()
+        client.get(url, headers=headers).raise_for_status()
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--sample-rate", type=float, default=0.1)
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    post_id, headers = seed()
+    client = TestClient(main.app)
+    urls = [("/api/plans", "/api/plans"), ("/api/posts/{id}", f"/api/posts/{post_id}")]
+    for _, url in urls:
+        run(client, url, headers, 200)  # warm up imports, pool and the auth cache
+
+    modes = [("off", False, 1.0), ("every request", True, 1.0), (f"sampled {args.sample_rate:g}", True, args.sample_rate)]
+    print(f"{'route':<18} {'metrics':<14} {'p50':>9} {'p99':>9} {'mean':>9}")
+    for name, url in urls:
+        for label, enabled, rate in modes:
+            metrics.METRICS_ENABLED, metrics.METRICS_SAMPLE_RATE = enabled, rate
+            latencies = run(client, url, headers, args.requests)
+            print(f"{name:<18} {label:<14} {percentile(latencies, 50) * 1e6:>7.0f}us {percentile(latencies, 99) * 1e6:>7.0f}us "
+                  f"{sum(latencies) / len(latencies) * 1e6:>7.0f}us")
+
+    started = time.perf_counter()
+    body = metrics.render()
+    print(f"render /metrics: {(time.perf_counter() - started) * 1000:.2f}ms for {body.count(chr(10))} lines")
+
+
+if __name__ == "__main__":
+    main_()
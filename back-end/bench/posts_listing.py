@@ -0,0 +1,107 @@
+"""Sidebar listing benchmark: unpaginated full-history listing vs keyset pages.
+
+Seeds one user with --posts conversations on a throwaway SQLite database and
+times both variants in-process through FastAPI's TestClient:
+
+    python bench/posts_listing.py --posts 10000 --messages 6
+
+"legacy" reproduces the pre-pagination GET /api/posts (every post with its
+full messages JSON); "page" is the current endpoint, timed on the first page
+and on a page deep in the listing.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'listing.db')}"
+
+from fastapi import Depends  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlalchemy import insert  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+
+import chat_store  # noqa: E402
+import main  # noqa: E402
+import wire  # noqa: E402
+from database import SessionLocal, engine, get_db  # noqa: E402
+from harness import percentile  # noqa: E402
+from models import Base, Message, Post, User  # noqa: E402
+
+
+@main.app.get("/bench/legacy_posts")
+def legacy_posts(current_user: User = Depends(main.get_current_user), db: Session = Depends(get_db)):
+    posts = db.query(Post).filter(Post.user_id == current_user.id).order_by(Post.created_at.desc()).all()
+    histories = chat_store.load_messages_for_posts(db, [p.id for p in posts])
+    return wire.FastJSONResponse([chat_store.post_to_dict(p, histories[p.id]) for p in posts])
+
+
+def seed(n_posts: int, n_messages: int) -> str:
+    db = SessionLocal()
+    user = User(email="listing@example.com", hashed_password="x", plan="pro", credit_remaining=0)
+    db.add(user)
+    db.commit()
+    body = "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 12
+    start = datetime.utcnow() - timedelta(days=365)
+    for offset in range(0, n_posts, 1000):
+        batch = range(offset, min(offset + 1000, n_posts))
+        db.execute(insert(Post), [
+            {"id": i + 1, "user_id": user.id, "title": f"Chat {i}", "created_at": start + timedelta(minutes=i), "updated_at": start}
+            for i in batch
+        ])
+        db.execute(insert(Message), [
+            {"post_id": i + 1, "seq": seq, "role": "user" if seq % 2 == 0 else "assistant", "content": body}
+            for i in batch for seq in range(n_messages)
+        ])
+        db.commit()
+    db.close()
+    return main.create_access_token({"sub": "listing@example.com"})
+
+
+def measure(client: TestClient, url: str, headers: dict, runs: int):
+    latencies, size, body = [], 0, None
+    for _ in range(runs):
+        started = time.perf_counter()
+        res = client.get(url, headers=headers)
+        latencies.append(time.perf_counter() - started)
+        res.raise_for_status()
+        size, body = len(res.content), res.json()
+    return latencies, size, body
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--posts", type=int, default=10000)
+    parser.add_argument("--messages", type=int, default=6, help="messages per post")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--limit", type=int, default=20, help="page size")
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    token = seed(args.posts, args.messages)
+    headers = {"Authorization": f"Bearer {token}"}
+    client = TestClient(main.app)
+
+    # Walk to a page roughly in the middle of the listing for the deep-page case
+    cursor = None
+    for _ in range(args.posts // args.limit // 2):
+        cursor = client.get(f"/api/posts?limit={args.limit}" + (f"&cursor={cursor}" if cursor else ""), headers=headers).json()["next_cursor"]
+
+    cases = [
+        ("legacy (all posts)", "/bench/legacy_posts", max(1, args.runs // 10)),
+        ("page 1", f"/api/posts?limit={args.limit}", args.runs),
+        ("deep page", f"/api/posts?limit={args.limit}&cursor={cursor}", args.runs),
+    ]
+    print(f"{args.posts} posts x {args.messages} messages")
+    print(f"{'endpoint':<20} {'p50':>10} {'p99':>10} {'payload':>12}")
+    for name, url, runs in cases:
+        latencies, size, _ = measure(client, url, headers, runs)
+        print(f"{name:<20} {percentile(latencies, 50) * 1000:>8.1f}ms {percentile(latencies, 99) * 1000:>8.1f}ms {size / 1024:>10.1f}KB")
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,163 @@
+"""Full-text search benchmark on a large SQLite history.
+
+Seeds --messages messages (default 1M) with a Zipf-distributed vocabulary
+across --users users, one of whom (the "heavy" user) owns --heavy-share of
+everything, loading through the FTS5 triggers. Then times GET /api/search
+in-process against a LIKE scan of the user's messages (what finding a chat
+cost before) for rare, mid-frequency, common, two-word, phrase and prefix
+queries, and the per-message write overhead of keeping the index current:
+
+    python bench/search_index.py --messages 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'search.db')}"
+
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlalchemy import insert, text  # noqa: E402
+
+import main  # noqa: E402
+import search  # noqa: E402
+from database import SessionLocal, engine  # noqa: E402
+from harness import percentile  # noqa: E402
+from models import Base, Message, Post, User  # noqa: E402
+
+WORDS_PER_MESSAGE = 30
+MESSAGES_PER_POST = 10
+
+
+def make_vocabulary(size: int, rng: random.Random):
+    syllables = ["ka", "lo", "mi", "ten", "ra", "vu", "sel", "dor", "pin", "qua", "zel", "mon", "tri", "bex", "ul", "fa"]
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))))
+    words = sorted(words)
+    rng.shuffle(words)
+    weights = [1 / (rank + 1) for rank in range(size)]  # Zipf: word i is 1/(i+1) as frequent as the top one
+    return words, weights
+
+
+def seed(n_messages: int, n_users: int, heavy_share: float, words, weights, rng: random.Random):
+    db = SessionLocal()
+    db.execute(insert(User), [{"id": u + 1, "email": f"user{u}@example.com", "hashed_password": "x", "plan": "pro"} for u in range(n_users)])
+    db.commit()
+    n_posts = n_messages // MESSAGES_PER_POST
+    heavy_posts = int(n_posts * heavy_share)
+    now = datetime.utcnow()
+    started = time.perf_counter()
+    for offset in range(0, n_posts, 1000):
+        batch = range(offset, min(offset + 1000, n_posts))
+        db.execute(insert(Post), [
+            {"id": i + 1, "user_id": 1 if i < heavy_posts else 2 + i % (n_users - 1), "title": " ".join(rng.choices(words, weights, k=4)),
+             "created_at": now, "updated_at": now}
+            for i in batch
+        ])
+        contents = rng.choices(words, weights, k=len(batch) * MESSAGES_PER_POST * WORDS_PER_MESSAGE)
+        db.execute(insert(Message), [
+            {"post_id": i + 1, "seq": seq, "role": "user" if seq % 2 == 0 else "assistant",
+             "content": " ".join(contents[k * WORDS_PER_MESSAGE:(k + 1) * WORDS_PER_MESSAGE])}
+            for k, (i, seq) in enumerate((i, seq) for i in batch for seq in range(MESSAGES_PER_POST))
+        ])
+        db.commit()
+        done = (offset + len(batch)) * MESSAGES_PER_POST
+        if done % 100000 == 0:
+            print(f"  seeded {done} messages ({time.perf_counter() - started:.0f}s)", flush=True)
+    elapsed = time.perf_counter() - started
+    db.close()
+    return elapsed
+
+
+def like_scan(user_id: int, terms):
+    """Every post whose messages contain every term; like a client-side scan, it has to see them all to rank."""
+    db = SessionLocal()
+    try:
+        clauses = " AND ".join(f"m.content LIKE :t{i}" for i in range(len(terms)))
+        return db.execute(
+            text(f"SELECT DISTINCT m.post_id FROM messages m JOIN posts p ON p.id = m.post_id WHERE p.user_id = :user_id AND {clauses}"),
+            {"user_id": user_id, **{f"t{i}": f"%{t.rstrip('*')}%" for i, t in enumerate(terms)}},
+        ).all()
+    finally:
+        db.close()
+
+
+def write_overhead(n: int) -> float:
+    """Seconds per message appended one transaction at a time (as save_generation does)."""
+    db = SessionLocal()
+    try:
+        post_id = db.execute(text("SELECT max(id) FROM posts")).scalar()
+        seq = db.execute(text("SELECT max(seq) FROM messages WHERE post_id = :p"), {"p": post_id}).scalar() + 1
+        started = time.perf_counter()
+        for i in range(n):
+            db.execute(insert(Message), {"post_id": post_id, "seq": seq + i, "role": "user", "content": "benchmark write " * 60})
+            db.commit()
+        return (time.perf_counter() - started) / n
+    finally:
+        db.close()
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=1000000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--heavy-share", type=float, default=0.1, help="share of all messages owned by user 1")
+    parser.add_argument("--vocabulary", type=int, default=20000)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    words, weights = make_vocabulary(args.vocabulary, rng)
+    Base.metadata.create_all(bind=engine)
+    load_seconds = seed(args.messages, args.users, args.heavy_share, words, weights, rng)
+    db_file = engine.url.database
+    print(f"{args.messages} messages, {args.users} users; loaded through the index triggers in {load_seconds:.0f}s "
+          f"({args.messages / load_seconds:.0f} msg/s), database {os.path.getsize(db_file) / 2**20:.0f}MB")
+
+    sample = SessionLocal().execute(text("SELECT content FROM messages WHERE post_id = 2 LIMIT 1")).scalar().split()
+    queries = [
+        ("rare word", [words[args.vocabulary - 50]]),
+        ("mid word", [words[500]]),
+        ("common word", [words[3]]),
+        ("two words", [words[40], words[300]]),
+        ("phrase", [f'"{sample[3]} {sample[4]}"']),
+        ("prefix", [words[800][:4] + "*"]),
+    ]
+    client = TestClient(main.app)
+    users = [("typical user", 2), ("heavy user", 1)]
+    print(f"{'query':<14} {'user':<14} {'hits':>5} {'search p50':>11} {'p99':>9} {'LIKE scan p50':>14}")
+    for name, terms in queries:
+        for label, user_id in users:
+            token = main.create_access_token({"sub": f"user{user_id - 1}@example.com"})
+            q = " ".join(terms)
+            latencies = []
+            for _ in range(args.runs):
+                started = time.perf_counter()
+                res = client.get("/api/search", params={"q": q}, headers={"Authorization": f"Bearer {token}"})
+                latencies.append(time.perf_counter() - started)
+                res.raise_for_status()
+            hits = len(res.json()["items"])
+            scans = []
+            for _ in range(max(1, args.runs // 10)):
+                started = time.perf_counter()
+                like_scan(user_id, [t.strip('"') for t in terms])
+                scans.append(time.perf_counter() - started)
+            print(f"{name:<14} {label:<14} {hits:>5} {percentile(latencies, 50) * 1000:>9.1f}ms {percentile(latencies, 99) * 1000:>7.1f}ms "
+                  f"{percentile(scans, 50) * 1000:>12.1f}ms")
+
+    with_index = write_overhead(500)
+    with engine.begin() as conn:
+        for trigger in ("messages_fts_insert", "messages_fts_update", "messages_fts_delete"):
+            conn.execute(text(f"DROP TRIGGER {trigger}"))
+    without_index = write_overhead(500)
+    print(f"append one message: {with_index * 1e6:.0f}us with the index, {without_index * 1e6:.0f}us without")
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,110 @@
+"""Social fan-out: many posts shared to every platform at once, some scheduled.
+
+Boots the backend with the mock adapters (--delay seconds per publish,
+--fail-rate of attempts failing retryably), seeds --users users with
+--posts posts between them and shares every post to all four platforms
+from --concurrency clients. A further --scheduled posts are scheduled
+--schedule-in seconds ahead. Waits for every delivery to settle, then
+reports time to settle, attempts and outcomes per platform, and checks
+the database:
+
+- every sent delivery set its post's shared_* column
+- no scheduled delivery went out before its time
+
+    python bench/social_fanout.py --posts 200 --users 20 --fail-rate 0.2
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import httpx
+from sqlalchemy import create_engine, text
+
+from harness import create_user, percentile, start_backend, stop
+
+PLATFORMS = ["facebook", "twitter", "linkedin", "instagram"]
+
+
+async def share_all(base_url: str, jobs: list, concurrency: int) -> list:
+    latencies = []
+    queue = list(jobs)
+
+    async def client_loop(client: httpx.AsyncClient):
+        while queue:
+            headers, body = queue.pop()
+            started = time.perf_counter()
+            res = await client.post(f"{base_url}/api/social/post", json=body, headers=headers)
+            res.raise_for_status()
+            latencies.append(time.perf_counter() - started)
+
+    async with httpx.AsyncClient(timeout=30) as client:
+        await asyncio.gather(*(client_loop(client) for _ in range(concurrency)))
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--posts", type=int, default=200)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--scheduled", type=int, default=20)
+    parser.add_argument("--schedule-in", type=float, default=5.0)
+    parser.add_argument("--delay", type=float, default=0.2, help="seconds per mock publish")
+    parser.add_argument("--fail-rate", type=float, default=0.2)
+    parser.add_argument("--rate", type=float, default=60, help="posts per minute per account and platform")
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+
+    database_url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'social.db')}"
+    env = {
+        "SOCIAL_MOCK_DELAY": str(args.delay),
+        "SOCIAL_MOCK_FAIL_RATE": str(args.fail_rate),
+        "SOCIAL_RETRY_BASE": "0.5",
+        "SOCIAL_POLL_INTERVAL": "0.2",
+        **{f"SOCIAL_RATE_{p.upper()}": str(args.rate) for p in PLATFORMS},
+    }
+    backend, base_url = start_backend(database_url, "http://127.0.0.1:9", env)
+    engine = create_engine(database_url)
+    try:
+        headers = [{"Authorization": f"Bearer {create_user(base_url, database_url, f'social{i}@example.com')}"} for i in range(args.users)]
+        jobs = []
+        for i in range(args.posts + args.scheduled):
+            user_headers = headers[i % args.users]
+            post_id = httpx.post(f"{base_url}/api/posts", json={"title": f"Post {i}", "messages": "[]"}, headers=user_headers).json()["id"]
+            body = {"platforms": PLATFORMS, "content": f"Post number {i} is out now.", "post_id": post_id}
+            if i >= args.posts:
+                body["scheduled_at"] = (datetime.utcnow() + timedelta(seconds=args.schedule_in)).isoformat()
+            jobs.append((user_headers, body))
+
+        started = time.perf_counter()
+        latencies = asyncio.run(share_all(base_url, jobs, args.concurrency))
+        print(f"{len(jobs)} shares to {len(PLATFORMS)} platforms accepted: p50 {percentile(latencies, 50) * 1000:.1f}ms, "
+              f"p99 {percentile(latencies, 99) * 1000:.1f}ms")
+        with engine.connect() as conn:
+            while conn.execute(text("SELECT count(*) FROM social_deliveries WHERE status IN ('pending', 'sending')")).scalar():
+                time.sleep(0.2)
+            settled = time.perf_counter() - started
+            print(f"all {len(jobs) * len(PLATFORMS)} deliveries settled after {settled:.1f}s:",
+                  httpx.get(f"{base_url}/api/metrics/social").json())
+            for platform, status, count, attempts in conn.execute(text(
+                "SELECT platform, status, count(*), sum(attempts) FROM social_deliveries GROUP BY platform, status ORDER BY platform, status"
+            )):
+                print(f"  {platform:<10} {status:<8} {count:>6} deliveries, {attempts:>6} attempts")
+            unflagged = conn.execute(text(
+                "SELECT count(*) FROM social_deliveries d JOIN posts p ON p.id = d.post_id WHERE d.status = 'sent' AND ("
+                "(d.platform = 'facebook' AND NOT p.shared_facebook) OR (d.platform = 'twitter' AND NOT p.shared_twitter) "
+                "OR (d.platform = 'linkedin' AND NOT p.shared_linkedin))"
+            )).scalar()
+            early = conn.execute(text(
+                "SELECT count(*) FROM social_deliveries WHERE sent_at < run_at AND status = 'sent'"
+            )).scalar()
+        print(f"sent deliveries without their shared_* flag: {unflagged}; sent before their scheduled time: {early}")
+    finally:
+        engine.dispose()
+        stop(backend)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Concurrent-stream load test for /api/generate_stream.
+
+Boots the backend on a throwaway SQLite database against the fake OpenRouter
+server, then opens increasing numbers of simultaneous streams while probing
+/api/plans to measure how responsive the event loop stays:
+
+    python bench/stream_load.py --levels 25,50,100,200 --tokens 100 --token-rate 50
+
+A level counts as "held" when every stream completes and the probe p99 stays
+under --probe-budget-ms. The last column is the connection pool's peak
+checkout from /api/metrics/db; pass --pool-size/--max-overflow to check that
+a small pool still carries many more streams than it has connections.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import httpx
+
+from harness import create_user, percentile, start_backend, start_fake_upstream, stop
+
+
+async def one_stream(client: httpx.AsyncClient, base_url: str, token: str, results: dict):
+    started = time.perf_counter()
+    ttft = None
+    try:
+        async with client.stream(
+            "POST",
+            f"{base_url}/api/generate_stream",
+            json={"prompt": "Write a short product blurb"},
+            headers={"Authorization": f"Bearer {token}"},
+        ) as res:
+            res.raise_for_status()
+            async for _ in res.aiter_bytes():
+                if ttft is None:
+                    ttft = time.perf_counter() - started
+        results["ttft"].append(ttft)
+        results["total"].append(time.perf_counter() - started)
+    except httpx.HTTPError:
+        results["errors"] += 1
+
+
+async def probe(client: httpx.AsyncClient, base_url: str, stop_event: asyncio.Event, latencies: list):
+    while not stop_event.is_set():
+        started = time.perf_counter()
+        await client.get(f"{base_url}/api/plans")
+        latencies.append(time.perf_counter() - started)
+        await asyncio.sleep(0.05)
+
+
+async def run_level(base_url: str, token: str, concurrency: int) -> dict:
+    results = {"ttft": [], "total": [], "errors": 0}
+    probe_latencies = []
+    limits = httpx.Limits(max_connections=concurrency + 10, max_keepalive_connections=concurrency + 10)
+    async with httpx.AsyncClient(limits=limits, timeout=120) as client:
+        stop_event = asyncio.Event()
+        prober = asyncio.create_task(probe(client, base_url, stop_event, probe_latencies))
+        await asyncio.gather(*(one_stream(client, base_url, token, results) for _ in range(concurrency)))
+        stop_event.set()
+        await prober
+        pool = (await client.get(f"{base_url}/api/metrics/db")).json()
+    return {
+        "concurrency": concurrency,
+        "ok": len(results["total"]),
+        "errors": results["errors"],
+        "ttft_p50_ms": percentile(results["ttft"], 50) * 1000,
+        "ttft_p99_ms": percentile(results["ttft"], 99) * 1000,
+        "total_p50_s": percentile(results["total"], 50),
+        "probe_p99_ms": percentile(probe_latencies, 99) * 1000,
+        "pool_peak": pool.get("peak_checked_out"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--levels", default="25,50,100,200", help="comma separated concurrency levels")
+    parser.add_argument("--tokens", type=int, default=100)
+    parser.add_argument("--token-rate", type=float, default=50.0)
+    parser.add_argument("--probe-budget-ms", type=float, default=100.0)
+    parser.add_argument("--pool-size", type=int, default=None, help="DB_POOL_SIZE for the backend")
+    parser.add_argument("--max-overflow", type=int, default=None, help="DB_MAX_OVERFLOW for the backend")
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    database_url = f"sqlite:///{db_path}"
+    upstream, upstream_url = start_fake_upstream(args.tokens, args.token_rate)
+    pool_env = {}
+    if args.pool_size is not None:
+        pool_env["DB_POOL_SIZE"] = str(args.pool_size)
+    if args.max_overflow is not None:
+        pool_env["DB_MAX_OVERFLOW"] = str(args.max_overflow)
+    backend, base_url = start_backend(database_url, upstream_url, pool_env)
+    try:
+        token = create_user(base_url, database_url, "stream-load@example.com")
+        print(f"{'streams':>8} {'ok':>5} {'err':>5} {'ttft p50':>10} {'ttft p99':>10} {'total p50':>10} {'probe p99':>10}  held  pool peak")
+        for level in (int(x) for x in args.levels.split(",")):
+            row = asyncio.run(run_level(base_url, token, level))
+            held = row["errors"] == 0 and row["probe_p99_ms"] < args.probe_budget_ms
+            print(
+                f"{row['concurrency']:>8} {row['ok']:>5} {row['errors']:>5} "
+                f"{row['ttft_p50_ms']:>8.0f}ms {row['ttft_p99_ms']:>8.0f}ms "
+                f"{row['total_p50_s']:>9.2f}s {row['probe_p99_ms']:>8.1f}ms  {'yes' if held else 'no':<4}  {row['pool_peak']}"
+            )
+    finally:
+        stop(backend, upstream)
+
+
+if __name__ == "__main__":
+    main()
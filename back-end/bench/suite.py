@@ -0,0 +1,368 @@
+"""Reproducible performance suite with a JSON baseline.
+
+Boots the backend (uvicorn, --workers processes) against a throwaway
+SQLite database or the Postgres database given with --database-url, plus
+the fake OpenRouter server at --token-rate, seeds it, and runs these
+scenarios one after another:
+
+    login_storm    concurrent /api/login across many accounts
+    sidebar        GET /api/posts, first page and deeper pages, for a user with many chats
+    streaming      concurrent /api/generate_stream to completion (TTFT and total)
+    long_history   generations continuing chats with hundreds of earlier messages
+    webhook_burst  Gumroad pings with duplicates, from many clients at once
+
+Each reports throughput, p50/p95/p99 latency and errors; peak RSS per
+worker is sampled throughout. --save writes the results as JSON (with the
+commit they were taken at); --compare checks a run against such a file and
+exits 1 when throughput dropped or p95 rose by more than --tolerance:
+
+    python bench/suite.py --save bench/baseline.json
+    python bench/suite.py --compare bench/baseline.json --tolerance 0.2
+
+A Postgres database passed with --database-url is wiped and recreated.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import httpx
+from sqlalchemy import create_engine, text
+
+from harness import BACKEND_DIR, migrate, percentile, start_backend, start_fake_upstream, stop
+
+PASSWORD = "bench-password"
+SCENARIOS = ("login_storm", "sidebar", "streaming", "long_history", "webhook_burst")
+# Metrics --compare checks: (key, True if higher is better)
+COMPARED = (("rps", True), ("p95_ms", False))
+
+
+# ------------------- MEASUREMENT -------------------
+def summarize(latencies: list, elapsed: float, errors: int) -> dict:
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+    }
+
+
+async def hammer(requests: list, concurrency: int, send) -> dict:
+    """Run `send(client, request)` over the requests from `concurrency` clients; returns summarize()."""
+    queue = list(reversed(requests))
+    latencies, errors = [], 0
+
+    async def worker(client):
+        nonlocal errors
+        while queue:
+            request = queue.pop()
+            started = time.perf_counter()
+            try:
+                await send(client, request)
+            except (httpx.HTTPError, AssertionError):
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=120) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return summarize(latencies, elapsed, errors)
+
+
+def _rss_kb(pid: int, field: str = "VmRSS") -> int:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def worker_pids(proc) -> list:
+    """uvicorn's worker processes, or the server itself when it runs a single one."""
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            with open(f"/proc/{entry}/cmdline", "rb") as f:
+                cmdline = f.read()
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == proc.pid and b"spawn_main" in cmdline:
+            children.append(int(entry))
+    return children or [proc.pid]
+
+
+class MemorySampler:
+    """Polls the workers' RSS in a thread; peak_mb() is the largest any single worker reached."""
+
+    def __init__(self, pids: list, interval: float = 0.2):
+        self.pids = pids
+        self.interval = interval
+        self.peak_kb = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak_kb = max([self.peak_kb] + [_rss_kb(pid) for pid in self.pids])
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def peak_mb(self) -> float:
+        return round(self.peak_kb / 1024, 1)
+
+
+# ------------------- SEEDING -------------------
+def prepare_database(database_url: str):
+    """Start from an empty, migrated schema; a reused non-SQLite database is dropped first."""
+    engine = create_engine(database_url)
+    if engine.dialect.name != "sqlite":
+        os.environ["DATABASE_URL"] = database_url
+        sys.path.insert(0, BACKEND_DIR)
+        from models import Base
+
+        Base.metadata.drop_all(bind=engine)
+        with engine.begin() as conn:
+            conn.execute(text("DROP TABLE IF EXISTS alembic_version"))
+    engine.dispose()
+    migrate(database_url)
+
+
+def seed(base_url: str, database_url: str, args) -> dict:
+    """Users for every scenario, sharing one bcrypt hash; a long sidebar; long chats."""
+    httpx.post(f"{base_url}/api/register", json={"email": "seed@example.com", "password": PASSWORD}).raise_for_status()
+    engine = create_engine(database_url)
+    now = datetime.utcnow()
+    body = "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor. " * 6
+    with engine.begin() as conn:
+        hashed = conn.execute(text("SELECT hashed_password FROM users WHERE email = 'seed@example.com'")).scalar()
+        emails = [f"bench{i}@example.com" for i in range(args.users)]
+        conn.execute(
+            text("INSERT INTO users (email, hashed_password, plan, credit_remaining, created_at) VALUES (:email, :hashed, 'pro', 1000000, :now)"),
+            [{"email": email, "hashed": hashed, "now": now} for email in emails],
+        )
+        owner = conn.execute(text("SELECT id FROM users WHERE email = 'bench0@example.com'")).scalar()
+        post_ids = []
+        for i in range(args.sidebar_posts + args.long_chats):
+            post_ids.append(conn.execute(
+                text("INSERT INTO posts (user_id, title, version, summary_seq, created_at, updated_at) "
+                     "VALUES (:user_id, :title, 1, 0, :at, :at) RETURNING id"),
+                {"user_id": owner, "title": f"Chat {i}", "at": now - timedelta(minutes=i)},
+            ).scalar())
+        short, long = post_ids[:args.sidebar_posts], post_ids[args.sidebar_posts:]
+        messages = [(post_id, 4) for post_id in short] + [(post_id, args.long_messages) for post_id in long]
+        for start in range(0, len(messages), 200):
+            conn.execute(
+                text("INSERT INTO messages (post_id, seq, role, content, created_at) VALUES (:post_id, :seq, :role, :content, :at)"),
+                [{"post_id": post_id, "seq": seq, "role": "user" if seq % 2 == 0 else "assistant", "content": body, "at": now}
+                 for post_id, count in messages[start:start + 200] for seq in range(count)],
+            )
+    engine.dispose()
+
+    async def login_all():
+        # A few at a time: the password hashing pool sheds load beyond its queue
+        responses = []
+        async with httpx.AsyncClient(timeout=120) as client:
+            for start in range(0, len(emails), 4):
+                responses += await asyncio.gather(*(
+                    client.post(f"{base_url}/api/login", json={"email": email, "password": PASSWORD}) for email in emails[start:start + 4]
+                ))
+        return [{"Authorization": f"Bearer {res.raise_for_status().json()['access_token']}"} for res in responses]
+
+    return {"emails": emails, "headers": asyncio.run(login_all()), "long_posts": long}
+
+
+# ------------------- SCENARIOS -------------------
+async def login_storm(base_url: str, data: dict, args) -> dict:
+    async def send(client, email):
+        res = await client.post(f"{base_url}/api/login", json={"email": email, "password": PASSWORD})
+        assert res.status_code == 200, res.status_code
+    requests = [random.choice(data["emails"]) for _ in range(args.logins)]
+    return await hammer(requests, args.concurrency, send)
+
+
+async def sidebar(base_url: str, data: dict, args) -> dict:
+    headers = data["headers"][0]
+
+    async def send(client, depth):
+        cursor = None
+        for _ in range(depth + 1):
+            res = await client.get(f"{base_url}/api/posts", params={"limit": 20, **({"cursor": cursor} if cursor else {})}, headers=headers)
+            assert res.status_code == 200, res.status_code
+            cursor = res.json()["next_cursor"]
+    # Mostly the first page, as the sidebar loads it; now and then a scroll a few pages down
+    return await hammer([0 if random.random() < 0.8 else 5 for _ in range(args.listings)], args.concurrency, send)
+
+
+async def _generate(client, base_url: str, headers: dict, body: dict, ttfts: list):
+    started = time.perf_counter()
+    ttft = None
+    async with client.stream("POST", f"{base_url}/api/generate_stream", json=body, headers=headers) as res:
+        assert res.status_code == 200, res.status_code
+        async for chunk in res.aiter_bytes():
+            if ttft is None:
+                ttft = time.perf_counter() - started
+            assert b"Error:" not in chunk
+    ttfts.append(ttft)
+
+
+async def streaming(base_url: str, data: dict, args) -> dict:
+    ttfts = []
+
+    async def send(client, headers):
+        await _generate(client, base_url, headers, {"prompt": "Write a short product blurb"}, ttfts)
+    result = await hammer([data["headers"][i % len(data["headers"])] for i in range(args.streams)], args.streams_concurrency, send)
+    return {**result, "ttft_p50_ms": round(percentile(ttfts, 50) * 1000, 1), "ttft_p99_ms": round(percentile(ttfts, 99) * 1000, 1)}
+
+
+async def long_history(base_url: str, data: dict, args) -> dict:
+    ttfts = []
+    headers = data["headers"][0]
+
+    async def send(client, post_id):
+        await _generate(client, base_url, headers, {"prompt": "Continue where we left off", "post_id": post_id}, ttfts)
+    requests = [data["long_posts"][i % len(data["long_posts"])] for i in range(args.long_generations)]
+    result = await hammer(requests, min(args.streams_concurrency, len(data["long_posts"])), send)
+    return {**result, "ttft_p50_ms": round(percentile(ttfts, 50) * 1000, 1), "ttft_p99_ms": round(percentile(ttfts, 99) * 1000, 1)}
+
+
+async def webhook_burst(base_url: str, data: dict, args) -> dict:
+    sales = [
+        {"sale_id": f"suite-{random.random():.12f}", "sale_timestamp": datetime.utcnow().isoformat() + "Z",
+         "email": random.choice(data["emails"]), "product_id": "dnvjmb", "price": "2900", "success": "true"}
+        for _ in range(args.webhooks)
+    ]
+    pings = [sale for sale in sales for _ in range(random.randint(1, 3))]
+    random.shuffle(pings)
+
+    async def send(client, ping):
+        res = await client.post(f"{base_url}/api/gumroad-webhook", data=ping)
+        assert res.status_code == 200, res.status_code
+    return {**await hammer(pings, args.concurrency, send), "distinct_sales": len(sales)}
+
+
+# ------------------- BASELINE -------------------
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+def compare(baseline: dict, results: dict, tolerance: float) -> list:
+    regressions = []
+    print(f"\n{'scenario':<14} {'metric':<12} {'baseline':>10} {'now':>10} {'change':>8}")
+    for name, now in results["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        for key, higher_is_better in COMPARED + (("peak_rss_mb", False),):
+            if not before.get(key) or key not in now:
+                continue
+            change = (now[key] - before[key]) / before[key]
+            worse = -change if higher_is_better else change
+            flag = "  REGRESSION" if worse > tolerance else ""
+            print(f"{name:<14} {key:<12} {before[key]:>10} {now[key]:>10} {change:>+7.0%}{flag}")
+            if flag:
+                regressions.append(f"{name}.{key}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="defaults to a throwaway SQLite file")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--only", help=f"comma separated subset of {','.join(SCENARIOS)}")
+    parser.add_argument("--tokens", type=int, default=100, help="tokens per fake completion")
+    parser.add_argument("--token-rate", type=float, default=100.0, help="fake upstream tokens per second per stream")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=50, help="clients for the request/response scenarios")
+    parser.add_argument("--logins", type=int, default=300)
+    parser.add_argument("--sidebar-posts", type=int, default=2000)
+    parser.add_argument("--listings", type=int, default=1000)
+    parser.add_argument("--streams", type=int, default=200)
+    parser.add_argument("--streams-concurrency", type=int, default=50)
+    parser.add_argument("--long-chats", type=int, default=10)
+    parser.add_argument("--long-messages", type=int, default=400, help="messages in each long chat")
+    parser.add_argument("--long-generations", type=int, default=40)
+    parser.add_argument("--webhooks", type=int, default=1000, help="distinct sales; each is delivered 1-3 times")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON file to check the results against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    args = parser.parse_args()
+    random.seed(args.seed)
+    selected = args.only.split(",") if args.only else list(SCENARIOS)
+
+    database_url = args.database_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'suite.db')}"
+    prepare_database(database_url)
+    upstream, upstream_url = start_fake_upstream(tokens=args.tokens, token_rate=args.token_rate, first_token_delay=0.1)
+    backend, base_url = start_backend(database_url, upstream_url, {"WEBHOOK_POLL_INTERVAL": "0.5"}, workers=args.workers)
+    results = {
+        "commit": git_commit(),
+        "taken_at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "database": database_url.split(":", 1)[0],
+        "workers": args.workers,
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "args": {k: v for k, v in vars(args).items() if k not in ("save", "compare", "only", "database_url")},
+        "scenarios": {},
+    }
+    try:
+        pids = worker_pids(backend)
+        data = seed(base_url, database_url, args)
+        results["idle_rss_mb"] = round(max(_rss_kb(pid) for pid in pids) / 1024, 1)
+        print(f"{'scenario':<14} {'requests':>8} {'err':>5} {'req/s':>8} {'p50':>9} {'p95':>9} {'p99':>9} {'peak RSS':>9}")
+        for name in selected:
+            with MemorySampler(pids) as memory:
+                row = asyncio.run(globals()[name](base_url, data, args))
+            row["peak_rss_mb"] = memory.peak_mb()
+            results["scenarios"][name] = row
+            print(f"{name:<14} {row['requests']:>8} {row['errors']:>5} {row['rps']:>8.1f} {row['p50_ms']:>7.1f}ms "
+                  f"{row['p95_ms']:>7.1f}ms {row['p99_ms']:>7.1f}ms {row['peak_rss_mb']:>7.1f}MB")
+    finally:
+        stop(backend, upstream)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"saved to {args.save}")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if (baseline.get("database"), baseline.get("workers")) != (results["database"], results["workers"]):
+            print("note: the baseline was taken with a different database or worker count")
+        regressions = compare(baseline, results, args.tolerance)
+        if regressions:
+            print(f"regressed beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
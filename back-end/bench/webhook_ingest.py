@@ -0,0 +1,151 @@
+"""Gumroad webhook ingestion under duplicated, out-of-order delivery.
+
+Boots the backend, seeds --users users (a few more buyers are left
+unregistered), and makes --sales sales spread over them with increasing
+sale timestamps. Every sale is delivered 1 to --max-copies times and the
+whole stream is shuffled, then POSTed from --concurrency clients. Reports
+ingest throughput and latency, waits for the consumer to drain the inbox,
+then registers the missing buyers, requeues their failed events with the
+replay tool and checks the outcome against the database:
+
+- every ping was answered 200
+- exactly one Transaction per distinct sale, however often it arrived
+- every user's plan is the product of their newest sale, with that plan's credits
+
+and exits non-zero unless all of them hold:
+
+    python bench/webhook_ingest.py --sales 3000 --max-copies 4 --concurrency 50
+"""
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import httpx
+from sqlalchemy import create_engine, text
+
+from harness import BACKEND_DIR, percentile, start_backend, stop
+
+PRODUCTS = {"uivryd": ("starter", 500, 1000), "dnvjmb": ("pro", 2500, 2900), "ntaktl": ("flexible", None, 0)}
+
+
+def make_sales(n_sales: int, emails: list, rng: random.Random) -> list:
+    started = datetime(2026, 1, 1)
+    sales = []
+    for i in range(n_sales):
+        product_id = rng.choice(list(PRODUCTS))
+        sales.append({
+            "sale_id": f"sale-{i}",
+            "sale_timestamp": (started + timedelta(minutes=i)).isoformat() + "Z",
+            "email": rng.choice(emails),
+            "product_id": product_id,
+            "price": str(PRODUCTS[product_id][2]),
+            "currency": "usd",
+            "success": "true",
+        })
+    return sales
+
+
+async def deliver(base_url: str, pings: list, concurrency: int) -> tuple:
+    latencies, statuses = [], {}
+    queue = list(pings)
+
+    async def client_loop(client: httpx.AsyncClient):
+        while queue:
+            ping = queue.pop()
+            started = time.perf_counter()
+            res = await client.post(f"{base_url}/api/gumroad-webhook", data=ping)
+            latencies.append(time.perf_counter() - started)
+            key = res.json().get("message", res.status_code) if res.status_code == 200 else res.status_code
+            statuses[key] = statuses.get(key, 0) + 1
+
+    async with httpx.AsyncClient(timeout=30, limits=httpx.Limits(max_connections=concurrency)) as client:
+        await asyncio.gather(*(client_loop(client) for _ in range(concurrency)))
+    return latencies, statuses
+
+
+def wait_drained(base_url: str, settled: int, timeout: float = 120.0) -> float:
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        consumer = httpx.get(f"{base_url}/api/metrics/webhooks").json()["consumer"]
+        if consumer["applied"] + consumer["superseded"] + consumer["failed"] >= settled:
+            return time.perf_counter() - started
+        time.sleep(0.1)
+    raise RuntimeError(f"consumer did not settle {settled} events within {timeout}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sales", type=int, default=3000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--unregistered", type=int, default=10, help="buyers who only register after paying")
+    parser.add_argument("--max-copies", type=int, default=4, help="deliveries per sale, uniformly 1..N")
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    rng = random.Random(11)
+    emails = [f"buyer{i}@example.com" for i in range(args.users + args.unregistered)]
+    sales = make_sales(args.sales, emails, rng)
+    pings = [sale for sale in sales for _ in range(rng.randint(1, args.max_copies))]
+    rng.shuffle(pings)
+
+    database_url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'webhooks.db')}"
+    backend, base_url = start_backend(database_url, "http://127.0.0.1:9", {"WEBHOOK_POLL_INTERVAL": "0.5"})
+    engine = create_engine(database_url)
+    try:
+        registered, late = emails[:args.users], emails[args.users:]
+        with engine.begin() as conn:
+            conn.execute(text("INSERT INTO users (email, hashed_password, plan, credit_remaining) VALUES (:email, 'x', 'free', 10)"),
+                         [{"email": email} for email in registered])
+
+        started = time.perf_counter()
+        latencies, statuses = asyncio.run(deliver(base_url, pings, args.concurrency))
+        elapsed = time.perf_counter() - started
+        print(f"{len(pings)} pings for {len(sales)} sales from {args.concurrency} clients: {len(pings) / elapsed:.0f}/s, "
+              f"p50 {percentile(latencies, 50) * 1000:.1f}ms, p99 {percentile(latencies, 99) * 1000:.1f}ms, {statuses}")
+        drained = wait_drained(base_url, len(sales))
+        print(f"consumer drained the inbox {drained:.1f}s after the last ping:", httpx.get(f"{base_url}/api/metrics/webhooks").json())
+
+        with engine.begin() as conn:
+            conn.execute(text("INSERT INTO users (email, hashed_password, plan, credit_remaining) VALUES (:email, 'x', 'free', 10)"),
+                         [{"email": email} for email in late])
+        env = dict(os.environ, DATABASE_URL=database_url)
+        replay = subprocess.run([sys.executable, "webhooks.py", "requeue"], cwd=BACKEND_DIR, env=env, capture_output=True, text=True)
+        print("replay tool:", replay.stdout.strip() or replay.stderr.strip())
+        deadline = time.perf_counter() + 30
+        with engine.connect() as conn:
+            while conn.execute(text("SELECT count(*) FROM webhook_events WHERE status IN ('pending', 'failed')")).scalar():
+                if time.perf_counter() > deadline:
+                    raise RuntimeError("requeued events were not applied")
+                time.sleep(0.2)
+
+            per_event = conn.execute(text("SELECT count(*), count(DISTINCT event_id) FROM transactions")).one()
+            newest = {}
+            for sale in sales:
+                newest[sale["email"]] = sale  # sales are in timestamp order
+            wrong = 0
+            for email, plan, credit in conn.execute(text("SELECT email, plan, credit_remaining FROM users")):
+                if email not in newest:
+                    continue
+                expected_plan, expected_credits, _ = PRODUCTS[newest[email]["product_id"]]
+                if plan != expected_plan or (expected_credits is not None and credit != expected_credits):
+                    wrong += 1
+        print(f"transactions: {per_event[0]} for {len(sales)} sales ({per_event[1]} distinct events); "
+              f"users whose plan isn't their newest sale's: {wrong}")
+    finally:
+        engine.dispose()
+        stop(backend)
+
+    rejected = sum(count for key, count in statuses.items() if isinstance(key, int))
+    ok = rejected == 0 and per_event[0] == per_event[1] == len(sales) and wrong == 0
+    print("PASS" if ok else "FAIL")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Chat-history payloads on the wire: encoding CPU, bytes, compression and stream writes.
+
+In-process, no server. For a history of --messages messages of about
+--chars characters each (every fourth one carries an imageUrl in
+Message.extra) it compares:
+
+- legacy: rows -> dicts -> json.dumps string -> jsonable_encoder -> stdlib
+  JSONResponse, the history escaped a second time inside the body
+- raw: rows spliced into JSON bytes and embedded as is by FastJSONResponse
+
+reporting CPU per response and body size, then the size and CPU of gzip
+and (when zstandard is installed) zstd on the raw body. Last, a synthetic
+token stream at --token-rate tokens/s is run through wire.coalesce() and
+the number of writes, and bytes as SSE events, compared with one write per
+token:
+
+    python bench/wire_payloads.py --messages 400 --chars 1500 --token-rate 80
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from starlette.responses import JSONResponse  # noqa: E402
+
+import chat_store  # noqa: E402
+import wire  # noqa: E402
+from stream_buffers import format_event  # noqa: E402
+
+WORDS = "the of and to in is you that it he was for on are as with his they at be this have from or one had by".split()
+
+
+def make_rows(n_messages: int, chars: int, rng: random.Random) -> list:
+    rows = []
+    for seq in range(n_messages):
+        words = []
+        while sum(len(w) + 1 for w in words) < chars:
+            words.append(rng.choice(WORDS))
+        content = "## Heading\n\n" + " ".join(words) + ' — "quoted", naïve ✅\n'
+        extra = json.dumps({"imageUrl": f"https://example.com/api/assets/{seq:064x}.png"}) if seq % 4 == 3 else None
+        rows.append(("user" if seq % 2 == 0 else "assistant", content, extra))
+    return rows
+
+
+def legacy_body(post: dict, rows: list) -> bytes:
+    messages = []
+    for role, content, extra in rows:
+        message = {"role": role, "content": content}
+        if extra:
+            message.update(json.loads(extra))
+        messages.append(message)
+    return JSONResponse(jsonable_encoder({**post, "messages": json.dumps(messages)})).body
+
+
+def raw_body(post: dict, rows: list) -> bytes:
+    messages = wire.join_objects([chat_store.message_json(role, content, extra) for role, content, extra in rows])
+    return wire.FastJSONResponse({**post, "messages": messages}).body
+
+
+def cpu_per_call(fn, *args, repeat: int) -> tuple:
+    started = time.process_time()
+    for _ in range(repeat):
+        result = fn(*args)
+    return (time.process_time() - started) / repeat, result
+
+
+async def token_stream(n_tokens: int, rate: float):
+    for i in range(n_tokens):
+        await asyncio.sleep(1 / rate)
+        yield f"tok{i} "
+
+
+async def count_writes(n_tokens: int, rate: float, coalesced: bool) -> tuple:
+    source = token_stream(n_tokens, rate)
+    chunks = wire.coalesce(source) if coalesced else source
+    writes, sse_bytes, seq = 0, 0, 0
+    async for content in chunks:
+        writes += 1
+        sse_bytes += len(format_event("stream-id-1234", seq, "token", {"content": content}))
+        seq += 1
+    return writes, sse_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=400)
+    parser.add_argument("--chars", type=int, default=1500)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--tokens", type=int, default=400)
+    parser.add_argument("--token-rate", type=float, default=80)
+    args = parser.parse_args()
+
+    rows = make_rows(args.messages, args.chars, random.Random(5))
+    post = {"id": 1, "title": "A long conversation", "created_at": "2026-01-01T00:00:00", "version": 7}
+    legacy_cpu, legacy = cpu_per_call(legacy_body, post, rows, repeat=args.repeat)
+    raw_cpu, raw = cpu_per_call(raw_body, post, rows, repeat=args.repeat)
+    assert json.loads(json.loads(legacy)["messages"]) == json.loads(raw)["messages"]
+
+    print(f"history of {args.messages} messages, encoder: {'orjson' if wire.orjson else 'json'}")
+    print(f"{'body':<18} {'bytes':>10} {'cpu/response':>14}")
+    print(f"{'legacy (escaped)':<18} {len(legacy):>10} {legacy_cpu * 1000:>12.2f}ms")
+    print(f"{'raw':<18} {len(raw):>10} {raw_cpu * 1000:>12.2f}ms")
+    encodings = ["gzip"] + (["zstd"] if wire.zstandard else [])
+    for encoding in encodings:
+        cpu, compressed = cpu_per_call(wire.compress, raw, encoding, repeat=args.repeat)
+        print(f"{'raw + ' + encoding:<18} {len(compressed):>10} {cpu * 1000:>12.2f}ms  (compression only, {len(raw) / len(compressed):.1f}x)")
+    if not wire.zstandard:
+        print("zstd: zstandard not installed, skipped")
+
+    print(f"\n{args.tokens} tokens at {args.token_rate:g}/s, flush at {wire.STREAM_FLUSH_CHARS} chars or {wire.STREAM_FLUSH_INTERVAL * 1000:.0f}ms:")
+    for label, coalesced in (("per token", False), ("coalesced", True)):
+        writes, sse_bytes = asyncio.run(count_writes(args.tokens, args.token_rate, coalesced))
+        print(f"  {label:<10} {writes:>6} writes, {sse_bytes:>8} bytes as SSE events")
+
+
+if __name__ == "__main__":
+    main()
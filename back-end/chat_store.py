@@ -0,0 +1,315 @@
+import base64
+import json
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, func, insert, literal, select, tuple_, update
+from sqlalchemy.orm import Session
+
+import wire
+from models import Message, Post
+from tokens import count_message_tokens
+
+# Keys stored in their own columns; anything else the client sends rides along in Message.extra
+CORE_KEYS = ("role", "content")
+
+PREVIEW_LENGTH = 120
+# Upper bound on operations in one PATCH request
+MAX_PATCH_OPS = 500
+
+
+# ------------------- CONVERSION -------------------
+def message_to_dict(row: Message) -> dict:
+    message = {"role": row.role, "content": row.content}
+    if row.extra:
+        message.update(json.loads(row.extra))
+    return message
+
+
+def message_json(role: str, content: str, extra: Optional[str]) -> bytes:
+    """A stored message as JSON bytes, with Message.extra spliced in rather than parsed and re-encoded."""
+    data = wire.dumps({"role": role, "content": content})
+    if extra and extra != "{}":
+        data = data[:-1] + b"," + extra.strip()[1:].encode("utf-8")
+    return data
+
+
+def message_columns(message: dict) -> dict:
+    extra = {k: v for k, v in message.items() if k not in CORE_KEYS}
+    columns = {
+        "role": message.get("role", "user"),
+        "content": message.get("content") or "",
+        "extra": json.dumps(extra) if extra else None,
+    }
+    columns["token_count"] = count_message_tokens(columns)
+    return columns
+
+
+def parse_messages(messages_json: str) -> List[dict]:
+    """Parse the JSON history string clients send in PostCreate/PostUpdate."""
+    try:
+        messages = json.loads(messages_json)
+    except (TypeError, ValueError):
+        raise ValueError("messages must be a JSON array")
+    if not isinstance(messages, list) or not all(isinstance(m, dict) for m in messages):
+        raise ValueError("messages must be a JSON array of objects")
+    return messages
+
+
+def post_to_dict(post: Post, messages) -> dict:
+    """Response shape shared by the /api/posts* endpoints, for wire.FastJSONResponse.
+
+    messages is the history as a list or as wire.RawJSON from
+    load_messages_json(); either way it is embedded as a JSON array.
+    """
+    return {
+        "id": post.id,
+        "title": post.title,
+        "messages": messages if isinstance(messages, wire.RawJSON) else wire.RawJSON(wire.dumps(messages)),
+        "created_at": post.created_at,
+        "version": post.version,
+    }
+
+
+def post_summary_to_dict(post: Post, preview: Optional[str]) -> dict:
+    """Lightweight shape for the sidebar listing; full history comes from GET /api/posts/{id}."""
+    return {
+        "id": post.id,
+        "title": post.title,
+        "preview": preview or "",
+        "created_at": post.created_at,
+        "updated_at": post.updated_at,
+    }
+
+
+# ------------------- CURSORS -------------------
+def encode_cursor(post: Post) -> str:
+    raw = f"{post.created_at.isoformat()}|{post.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, post_id = raw.split("|")
+        return datetime.fromisoformat(created_at), int(post_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+
+
+# ------------------- VERSIONS -------------------
+def etag(post: Post) -> str:
+    return f'"{post.id}-{post.version}"'
+
+
+def etag_matches(header: Optional[str], current: str) -> bool:
+    """True when an If-None-Match / If-Match header names the current ETag (or is "*")."""
+    if not header:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return "*" in tags or current in tags
+
+
+def bump_version(db: Session, post_id: int, expected: Optional[int] = None) -> bool:
+    """Advance a post's version; with expected set, only if it is still that version.
+
+    The conditional UPDATE is the optimistic-concurrency check: of two writers
+    holding the same ETag exactly one gets rowcount 1. The caller commits.
+    """
+    query = update(Post).where(Post.id == post_id)
+    if expected is not None:
+        query = query.where(Post.version == expected)
+    return db.execute(query.values(version=Post.version + 1)).rowcount == 1
+
+
+# ------------------- READS -------------------
+def list_posts(db: Session, user_id: int, limit: int, cursor: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+    """One keyset page of a user's posts, newest first, with a short preview of each.
+
+    Pages seek on (created_at, id) through ix_posts_user_id_created_at, so
+    deep pages cost the same as the first one.
+    """
+    query = (
+        db.query(Post, func.substr(Message.content, 1, PREVIEW_LENGTH))
+        .outerjoin(Message, and_(Message.post_id == Post.id, Message.seq == 0))
+        .filter(Post.user_id == user_id)
+    )
+    if cursor:
+        created_at, post_id = decode_cursor(cursor)
+        query = query.filter(tuple_(Post.created_at, Post.id) < tuple_(created_at, post_id))
+    rows = query.order_by(Post.created_at.desc(), Post.id.desc()).limit(limit + 1).all()
+
+    next_cursor = encode_cursor(rows[limit - 1][0]) if len(rows) > limit else None
+    return [post_summary_to_dict(post, preview) for post, preview in rows[:limit]], next_cursor
+
+
+def load_messages(db: Session, post_id: int) -> List[dict]:
+    rows = db.query(Message).filter(Message.post_id == post_id).order_by(Message.seq).all()
+    return [message_to_dict(row) for row in rows]
+
+
+def load_messages_json(db: Session, post_id: int) -> wire.RawJSON:
+    """A post's history encoded straight from the rows, for responses."""
+    rows = (
+        db.query(Message.role, Message.content, Message.extra)
+        .filter(Message.post_id == post_id)
+        .order_by(Message.seq)
+        .all()
+    )
+    return wire.join_objects([message_json(role, content, extra) for role, content, extra in rows])
+
+
+def load_messages_for_posts(db: Session, post_ids: List[int]) -> Dict[int, List[dict]]:
+    """Fetch the histories of several posts in one query."""
+    histories = {post_id: [] for post_id in post_ids}
+    if not post_ids:
+        return histories
+    rows = (
+        db.query(Message)
+        .filter(Message.post_id.in_(post_ids))
+        .order_by(Message.post_id, Message.seq)
+        .all()
+    )
+    for row in rows:
+        histories[row.post_id].append(message_to_dict(row))
+    return histories
+
+
+# ------------------- WRITES -------------------
+# Writers leave Post.version alone; callers bump_version() once per request.
+def lock_post(db: Session, post_id: int):
+    """Hold the post's row until the transaction ends, so appends to one post run one at a time.
+
+    Two concurrent INSERT ... SELECT MAX(seq) + 1 would otherwise pick the
+    same seq on PostgreSQL and one of them fail on the (post_id, seq) unique
+    constraint. SQLite has no row locks and doesn't need one: its writers
+    already run one at a time, and the INSERT reads MAX(seq) under the write lock.
+    """
+    db.execute(select(Post.id).where(Post.id == post_id).with_for_update())
+
+
+def append_message(db: Session, post_id: int, message: dict):
+    """Append one message as a single INSERT ... SELECT that picks the next seq.
+
+    The MAX(seq) lookup is served by the (post_id, seq) unique index, so the
+    cost of a turn no longer depends on how long the conversation is.
+    """
+    lock_post(db, post_id)
+    columns = message_columns(message)
+    next_seq = (
+        select(
+            literal(post_id),
+            func.coalesce(func.max(Message.seq), -1) + 1,
+            literal(columns["role"]),
+            literal(columns["content"]),
+            literal(columns["extra"]),
+            literal(columns["token_count"]),
+        )
+        .where(Message.post_id == post_id)
+    )
+    db.execute(
+        insert(Message).from_select(["post_id", "seq", "role", "content", "extra", "token_count"], next_seq)
+    )
+
+
+def append_messages(db: Session, post_id: int, messages: List[dict]):
+    for message in messages:
+        append_message(db, post_id, message)
+
+
+def replace_messages(db: Session, post_id: int, messages: List[dict]):
+    """Overwrite a post's whole history (used by the full-history PUT)."""
+    delete_messages(db, post_id)
+    if messages:
+        db.execute(
+            insert(Message),
+            [dict(post_id=post_id, seq=seq, **message_columns(m)) for seq, m in enumerate(messages)],
+        )
+
+
+def delete_messages(db: Session, post_id: int):
+    db.query(Message).filter(Message.post_id == post_id).delete(synchronize_session=False)
+
+
+def _shift_messages(db: Session, post_id: int, after_seq: int, by: int):
+    """Move every message past after_seq down by `by` positions.
+
+    Goes through negative seqs so no intermediate row collides with the
+    (post_id, seq) unique constraint, whatever order the database updates in.
+    """
+    moving = and_(Message.post_id == post_id, Message.seq > after_seq)
+    db.execute(update(Message).where(moving).values(seq=-(Message.seq - by) - 1))
+    db.execute(update(Message).where(Message.post_id == post_id, Message.seq < 0).values(seq=-Message.seq - 1))
+
+
+def _index(op: dict, key: str, upper: int) -> int:
+    value = op.get(key)
+    if not isinstance(value, int) or isinstance(value, bool) or not 0 <= value <= upper:
+        raise ValueError(f"{op.get('op')}: {key} must be an integer between 0 and {upper}")
+    return value
+
+
+def apply_ops(db: Session, post: Post, ops: List[dict]):
+    """Apply PATCH operations to a post, in order, within the caller's transaction.
+
+    Indexes refer to the history as left by the previous operation:
+      {"op": "append", "messages": [{...}, ...]}
+      {"op": "edit", "index": 3, "message": {...}}   whole message, or
+      {"op": "edit", "index": 3, "content": "..."}   content only
+      {"op": "delete", "start": 2, "end": 4}         end exclusive
+      {"op": "rename", "title": "..."}
+    Raises ValueError on the first invalid operation; the caller rolls back.
+    """
+    if len(ops) > MAX_PATCH_OPS:
+        raise ValueError(f"At most {MAX_PATCH_OPS} operations per request")
+    count = db.query(func.count(Message.id)).filter(Message.post_id == post.id).scalar()
+    first_changed = None  # lowest seq whose content changed, to invalidate the rolling summary
+
+    for op in ops:
+        kind = op.get("op") if isinstance(op, dict) else None
+        if kind == "append":
+            messages = op.get("messages")
+            if not isinstance(messages, list) or not all(isinstance(m, dict) for m in messages):
+                raise ValueError("append: messages must be a list of objects")
+            if messages:
+                db.execute(insert(Message), [
+                    dict(post_id=post.id, seq=count + i, **message_columns(m)) for i, m in enumerate(messages)
+                ])
+                count += len(messages)
+        elif kind == "edit":
+            index = _index(op, "index", count - 1)
+            row = db.query(Message).filter(Message.post_id == post.id, Message.seq == index).one()
+            if isinstance(op.get("message"), dict):
+                message = op["message"]
+            elif isinstance(op.get("content"), str):
+                message = {**message_to_dict(row), "content": op["content"]}
+            else:
+                raise ValueError("edit: pass a message object or a content string")
+            for column, value in message_columns(message).items():
+                setattr(row, column, value)
+            db.flush()
+            first_changed = index if first_changed is None else min(first_changed, index)
+        elif kind == "delete":
+            start = _index(op, "start", count)
+            end = _index(op, "end", count)
+            if end < start:
+                raise ValueError("delete: end must not be before start")
+            if end > start:
+                db.query(Message).filter(
+                    Message.post_id == post.id, Message.seq >= start, Message.seq < end
+                ).delete(synchronize_session=False)
+                _shift_messages(db, post.id, end - 1, end - start)
+                count -= end - start
+                first_changed = start if first_changed is None else min(first_changed, start)
+        elif kind == "rename":
+            title = op.get("title")
+            if not isinstance(title, str) or not title.strip() or len(title) > 200:
+                raise ValueError("rename: title must be a non-empty string of at most 200 characters")
+            post.title = title
+        else:
+            raise ValueError(f"Unknown op: {kind!r}")
+
+    if first_changed is not None and post.summary_seq and first_changed < post.summary_seq:
+        # The summary describes messages that just changed; rebuild it from scratch later
+        post.summary = None
+        post.summary_seq = 0
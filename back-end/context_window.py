@@ -0,0 +1,125 @@
+import os
+from typing import List, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+from router import model_router
+from database import session_scope
+from models import Message, Post
+from tokens import count_message_tokens
+
+# ------------------- CONFIG -------------------
+# Prompt-side budget (system prompt + summary + history + new prompt); the reply's max_tokens is extra
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+# Fold turns that fall out of the budget into Post.summary instead of dropping them
+CONTEXT_SUMMARY_ENABLED = os.getenv("CONTEXT_SUMMARY_ENABLED", "false").lower() in ("1", "true", "yes")
+SUMMARY_MAX_TOKENS = int(os.getenv("CONTEXT_SUMMARY_MAX_TOKENS", "400"))
+
+SUMMARY_INSTRUCTIONS = (
+    "You maintain a running summary of a conversation between a user and an assistant. "
+    "Merge the existing summary with the new messages into one concise summary that keeps "
+    "names, facts, decisions and the user's stated preferences. Reply with the summary only."
+)
+
+
+# ------------------- ASSEMBLY -------------------
+def _row_tokens(row: Message) -> int:
+    if row.token_count is None:
+        # Rows migrated from the old JSON blob have no count yet; cache it on first use
+        row.token_count = count_message_tokens({"content": row.content})
+    return row.token_count
+
+
+def assemble_context(db: Session, post: Post, system_prompt: dict, prompt: str, budget: int = CONTEXT_TOKEN_BUDGET) -> Tuple[List[dict], dict]:
+    """Build the message list for the next turn within the token budget.
+
+    Always keeps the system prompt and the new prompt, then adds history from
+    the newest message backwards until the budget is spent. With summaries
+    enabled, the stored rolling summary stands in for the turns it covers.
+
+    Returns the messages and a stats dict: tokens_before / tokens_after
+    (prompt tokens with and without trimming), messages_dropped, and
+    "fold" — the dropped messages not yet covered by the summary, which
+    the caller can hand to update_summary() once the reply is done.
+    """
+    rows = db.query(Message).filter(Message.post_id == post.id).order_by(Message.seq).all()
+    prompt_message = {"role": "user", "content": prompt}
+    fixed_tokens = count_message_tokens(system_prompt) + count_message_tokens(prompt_message)
+    history_tokens = sum(_row_tokens(row) for row in rows)
+
+    summary_message = None
+    candidates = rows
+    if CONTEXT_SUMMARY_ENABLED and post.summary:
+        summary_message = {"role": "system", "content": f"Summary of the earlier conversation:\n{post.summary}"}
+        candidates = [row for row in rows if row.seq >= (post.summary_seq or 0)]
+
+    remaining = budget - fixed_tokens
+    if summary_message is not None:
+        remaining -= count_message_tokens(summary_message)
+
+    kept = []
+    for row in reversed(candidates):
+        if _row_tokens(row) > remaining:
+            break
+        remaining -= row.token_count
+        kept.append(row)
+    kept.reverse()
+    # Don't open the window with a reply whose question was trimmed away
+    while kept and len(kept) < len(candidates) and kept[0].role == "assistant":
+        kept.pop(0)
+    dropped = candidates[: len(candidates) - len(kept)]
+
+    messages = [system_prompt]
+    if summary_message is not None:
+        messages.append(summary_message)
+    messages.extend({"role": row.role, "content": row.content} for row in kept)
+    messages.append(prompt_message)
+
+    stats = {
+        "tokens_before": fixed_tokens + history_tokens,
+        "tokens_after": sum(count_message_tokens(m) for m in messages),
+        "messages_dropped": len(rows) - len(kept),
+        "fold": [{"seq": row.seq, "role": row.role, "content": row.content} for row in dropped] if CONTEXT_SUMMARY_ENABLED else [],
+    }
+    return messages, stats
+
+
+def metric_headers(stats: dict) -> dict:
+    return {
+        "X-Context-Tokens-Before": str(stats["tokens_before"]),
+        "X-Context-Tokens-After": str(stats["tokens_after"]),
+        "X-Context-Messages-Dropped": str(stats["messages_dropped"]),
+    }
+
+
+# ------------------- SUMMARIES -------------------
+async def update_summary(post_id: int, previous_summary: str, fold: List[dict]):
+    """Fold messages that fell out of the context window into the post's rolling summary."""
+    if not fold:
+        return
+    transcript = "\n\n".join(f"{m['role']}: {m['content']}" for m in fold)
+    try:
+        summary = await model_router.complete(
+            [
+                {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+                {"role": "user", "content": f"Existing summary:\n{previous_summary or '(none)'}\n\nNew messages:\n{transcript}"},
+            ],
+            max_tokens=SUMMARY_MAX_TOKENS,
+        )
+    except Exception as e:
+        print(f"Summary update error: {e}")
+        return
+
+    await run_in_threadpool(_store_summary, post_id, summary, fold[-1]["seq"] + 1)
+
+
+def _store_summary(post_id: int, summary: str, upto_seq: int):
+    with session_scope() as db:
+        # Only move forward: a concurrent turn may already have folded further
+        db.query(Post).filter(
+            Post.id == post_id,
+            or_(Post.summary_seq.is_(None), Post.summary_seq < upto_seq),
+        ).update({Post.summary: summary, Post.summary_seq: upto_seq}, synchronize_session=False)
+        db.commit()
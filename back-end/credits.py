@@ -0,0 +1,189 @@
+import asyncio
+import os
+import threading
+from datetime import datetime
+from typing import Optional
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import case, func, insert, or_, update
+from sqlalchemy.exc import InterfaceError, OperationalError
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import UsageRecord, User
+
+# ------------------- CONFIG -------------------
+# Prepaid plans spend one credit per generation; "flexible" counts generations up instead
+METERED_PLANS = ("starter", "pro", "free")
+LEDGER_BATCH_SIZE = int(os.getenv("USAGE_LEDGER_BATCH_SIZE", "200"))
+LEDGER_FLUSH_INTERVAL = float(os.getenv("USAGE_LEDGER_FLUSH_INTERVAL", "2.0"))
+# Rows held while the database is unreachable; past this the oldest are dropped
+LEDGER_BUFFER_MAX = int(os.getenv("USAGE_LEDGER_BUFFER_MAX", "50000"))
+
+
+# ------------------- RESERVATIONS -------------------
+def _charge(direction: int):
+    """credit_remaining after one generation (direction=1) or its refund (direction=-1)."""
+    return case(
+        (User.plan.in_(METERED_PLANS), User.credit_remaining - direction),
+        (User.plan == "flexible", func.coalesce(User.credit_remaining, 0) + direction),
+        else_=User.credit_remaining,
+    )
+
+
+def reserve_credit(db: Session, user_id: int) -> Optional[tuple]:
+    """Atomically take one generation's credit before streaming starts.
+
+    A single conditional UPDATE ... RETURNING, so concurrent streams from the
+    same account can never spend below zero. Returns (plan, credit_remaining)
+    after the charge, or None when a prepaid plan has no credits left.
+    The caller commits.
+    """
+    row = db.execute(
+        update(User)
+        .where(User.id == user_id)
+        .where(or_(User.plan.is_(None), User.plan.not_in(METERED_PLANS), User.credit_remaining > 0))
+        .values(credit_remaining=_charge(1))
+        .returning(User.plan, User.credit_remaining)
+    ).first()
+    return tuple(row) if row else None
+
+
+def refund_credit(db: Session, user_id: int):
+    """Give back a reservation whose upstream call failed. The caller commits."""
+    db.execute(update(User).where(User.id == user_id).values(credit_remaining=_charge(-1)))
+
+
+# ------------------- USAGE LEDGER -------------------
+class UsageLedger:
+    """Buffers UsageRecord rows in memory and writes them as bulk INSERTs.
+
+    Rows are flushed every LEDGER_FLUSH_INTERVAL seconds, as soon as
+    LEDGER_BATCH_SIZE are waiting, and on shutdown. While the database is
+    down at most LEDGER_BUFFER_MAX rows are kept (oldest dropped first); a
+    row the database rejects on its own is logged and discarded.
+    """
+
+    def __init__(self, batch_size: int = LEDGER_BATCH_SIZE, flush_interval: float = LEDGER_FLUSH_INTERVAL,
+                 max_buffer: int = LEDGER_BUFFER_MAX):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.flushed = 0
+        self.dropped = 0
+        self.rejected = 0
+
+    def _trim(self):
+        """Drop the oldest rows past max_buffer. Caller holds _lock."""
+        excess = len(self._buffer) - self.max_buffer
+        if excess > 0:
+            del self._buffer[:excess]
+            self.dropped += excess
+
+    def record(self, user_id: int, prompt: str, tokens_used: int, cost: float):
+        with self._lock:
+            self._buffer.append({
+                "user_id": user_id,
+                "prompt": prompt,
+                "tokens_used": tokens_used,
+                "cost": cost,
+                "created_at": datetime.utcnow(),
+                "billed": False,
+            })
+            self._trim()
+            full = len(self._buffer) >= self.batch_size
+        if full:
+            if self._wake is not None:
+                self._wake.set()
+            else:
+                self.flush()
+
+    def flush(self) -> int:
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+        if not rows:
+            return 0
+        db = SessionLocal()
+        try:
+            db.execute(insert(UsageRecord), rows)
+            db.commit()
+            written = len(rows)
+        except (OperationalError, InterfaceError) as e:
+            db.rollback()
+            print(f"Usage ledger flush error: {e}")
+            self._requeue(rows)
+            return 0
+        except Exception as e:
+            db.rollback()
+            print(f"Usage ledger bulk insert failed, retrying row by row: {e}")
+            written = self._insert_each(db, rows)
+        finally:
+            db.close()
+        self.flushed += written
+        return written
+
+    def _insert_each(self, db: Session, rows: list) -> int:
+        """Insert rows one at a time, discarding the ones the database rejects."""
+        written = 0
+        for i, row in enumerate(rows):
+            try:
+                db.execute(insert(UsageRecord), [row])
+                db.commit()
+                written += 1
+            except (OperationalError, InterfaceError) as e:
+                db.rollback()
+                print(f"Usage ledger flush error: {e}")
+                self._requeue(rows[i:])
+                break
+            except Exception as e:
+                db.rollback()
+                self.rejected += 1
+                print(f"Usage ledger dropped a row for user {row['user_id']}: {e}")
+        return written
+
+    def _requeue(self, rows: list):
+        with self._lock:
+            self._buffer[:0] = rows  # keep them for the next attempt
+            self._trim()
+
+    def pending(self) -> int:
+        return len(self._buffer)
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._buffer),
+            "flushed": self.flushed,
+            "dropped": self.dropped,
+            "rejected": self.rejected,
+        }
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await run_in_threadpool(self.flush)
+
+    def start(self):
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        self._wake = None
+        await run_in_threadpool(self.flush)
+
+
+usage_ledger = UsageLedger()
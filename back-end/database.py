@@ -1,20 +1,195 @@
-from sqlalchemy import create_engine
+from contextlib import contextmanager
+import threading
+import time
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker, declarative_base
 from dotenv import load_dotenv
 import os
 
+import metrics
+
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-engine = create_engine(DATABASE_URL)
+# ------------------- POOL CONFIG -------------------
+# Size the pool against concurrent requests, not concurrent streams: no
+# connection is checked out while tokens stream (see generate_stream)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+# Seconds to wait for a free connection before failing the request
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+# Replace connections older than this (seconds); keeps us under server/proxy idle cutoffs
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+# Per-statement limit in milliseconds, 0 disables
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "15000"))
+# Also build an AsyncEngine/AsyncSession factory (needs asyncpg or aiosqlite)
+DB_ASYNC = os.getenv("DB_ASYNC", "false").lower() in ("1", "true", "yes")
+
+
+# ------------------- ENGINE FACTORY -------------------
+def _is_memory_sqlite(url) -> bool:
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+
+def _engine_options(url) -> dict:
+    options = {"pool_pre_ping": DB_POOL_PRE_PING}
+    connect_args = {}
+    backend = url.get_backend_name()
+    if backend == "sqlite":
+        # Sessions move between the event loop's threadpool workers
+        connect_args["check_same_thread"] = False
+        # Wait for a locked database for as long as a statement may run
+        if DB_STATEMENT_TIMEOUT_MS:
+            connect_args["timeout"] = DB_STATEMENT_TIMEOUT_MS / 1000
+    elif backend == "postgresql" and DB_STATEMENT_TIMEOUT_MS:
+        connect_args["options"] = f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"
+    elif backend == "mysql" and DB_STATEMENT_TIMEOUT_MS:
+        connect_args["init_command"] = f"SET SESSION max_execution_time={DB_STATEMENT_TIMEOUT_MS}"
+    if connect_args:
+        options["connect_args"] = connect_args
+    if not _is_memory_sqlite(url):
+        options.update(
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+        )
+    return options
+
+
+def _install_sqlite_statement_timeout(engine, timeout_ms: int):
+    """SQLite has no statement_timeout; abort statements that overrun via the progress handler."""
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        deadline = connection_record.info["statement_deadline"] = [None]
+
+        def _check():
+            return 1 if deadline[0] is not None and time.monotonic() > deadline[0] else 0
+
+        dbapi_connection.set_progress_handler(_check, 10000)
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _start(conn, cursor, statement, parameters, context, executemany):
+        deadline = conn.info.get("statement_deadline")
+        if deadline is not None:
+            deadline[0] = time.monotonic() + timeout_ms / 1000
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _finish(conn, cursor, statement, parameters, context, executemany):
+        deadline = conn.info.get("statement_deadline")
+        if deadline is not None:
+            deadline[0] = None
+
+
+def make_engine(database_url: str = None, **overrides):
+    """Build the app's Engine with explicit pool and timeout settings; keyword
+    arguments override the DB_* environment defaults."""
+    url = make_url(database_url or DATABASE_URL)
+    engine = create_engine(url, **{**_engine_options(url), **overrides})
+    if url.get_backend_name() == "sqlite" and DB_STATEMENT_TIMEOUT_MS:
+        _install_sqlite_statement_timeout(engine, DB_STATEMENT_TIMEOUT_MS)
+    _track_pool(engine)
+    metrics.instrument_engine(engine)
+    return engine
+
+
+def make_async_engine(database_url: str = None, **overrides):
+    """AsyncEngine counterpart of make_engine, mapping the URL to an async driver."""
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    url = make_url(database_url or DATABASE_URL)
+    drivers = {"postgresql": "asyncpg", "sqlite": "aiosqlite", "mysql": "aiomysql"}
+    if url.get_backend_name() in drivers:
+        url = url.set(drivername=f"{url.get_backend_name()}+{drivers[url.get_backend_name()]}")
+    options = _engine_options(url)
+    if url.get_backend_name() == "postgresql":
+        # asyncpg takes server settings instead of a libpq options string
+        options.pop("connect_args", None)
+        if DB_STATEMENT_TIMEOUT_MS:
+            options["connect_args"] = {"server_settings": {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}}
+    engine = create_async_engine(url, **{**options, **overrides})
+    _track_pool(engine.sync_engine)
+    metrics.instrument_engine(engine.sync_engine)
+    return engine
+
+
+# ------------------- POOL METRICS -------------------
+_pool_counters = {}
+_pool_lock = threading.Lock()
+
+
+def _track_pool(engine):
+    counters = _pool_counters[id(engine.pool)] = {"checkouts": 0, "peak_checked_out": 0, "invalidated": 0}
+
+    @event.listens_for(engine, "checkout")
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        with _pool_lock:
+            counters["checkouts"] += 1
+            counters["peak_checked_out"] = max(counters["peak_checked_out"], engine.pool.checkedout())
+
+    @event.listens_for(engine, "invalidate")
+    def _on_invalidate(dbapi_connection, connection_record, exception):
+        with _pool_lock:
+            counters["invalidated"] += 1
+
+
+def pool_stats(engine=None) -> dict:
+    """Current occupancy of the engine's pool plus counters since startup."""
+    engine = engine or globals()["engine"]
+    pool = engine.pool
+    stats = {"pool": type(pool).__name__}
+    for name in ("size", "checkedout", "checkedin", "overflow"):
+        if hasattr(pool, name):
+            stats[name] = getattr(pool, name)()
+    if hasattr(pool, "_max_overflow"):
+        stats["max_overflow"] = pool._max_overflow
+    with _pool_lock:
+        stats.update(_pool_counters.get(id(pool), {}))
+    return stats
+
+
+engine = make_engine()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = None
+AsyncSessionLocal = None
+if DB_ASYNC:
+    from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+    async_engine = make_async_engine()
+    AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
+# ------------------- SESSIONS -------------------
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+@contextmanager
+def session_scope():
+    """Short-lived session for work outside a request (stream epilogues,
+    background jobs); rolls back on error and always returns the connection."""
+    db = SessionLocal()
+    try:
+        yield db
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+async def get_async_db():
+    if AsyncSessionLocal is None:
+        raise RuntimeError("Set DB_ASYNC=true to use async sessions")
+    async with AsyncSessionLocal() as db:
+        yield db
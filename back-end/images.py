@@ -0,0 +1,365 @@
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import struct
+import tempfile
+import unicodedata
+import uuid
+import zlib
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import update
+
+import credits
+import llm
+from auth_cache import auth_cache
+from database import session_scope
+from models import ImageJob, User
+
+# ------------------- CONFIG -------------------
+# "openai" needs IMAGE_API_KEY (or OPENAI_API_KEY); without one image requests get 503.
+# "stub" draws placeholder PNGs locally, for development and benches.
+IMAGE_BACKEND = os.getenv("IMAGE_BACKEND", "openai")  # openai | stub
+# Any OpenAI-compatible images API; the stub needs neither
+IMAGE_BASE_URL = os.getenv("IMAGE_BASE_URL", "https://api.openai.com/v1")
+IMAGE_MODEL = os.getenv("IMAGE_MODEL", "dall-e-3")
+IMAGE_SIZE = os.getenv("IMAGE_SIZE", "1024x1024")
+IMAGE_PROMPT_MAX_CHARS = int(os.getenv("IMAGE_PROMPT_MAX_CHARS", "1000"))
+# Shared by the workers of one host; assets are immutable, so any of them may serve any file
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", "image_cache")
+IMAGE_CACHE_MAX_MB = int(os.getenv("IMAGE_CACHE_MAX_MB", "2048"))  # 0 keeps everything
+IMAGE_CONCURRENCY = int(os.getenv("IMAGE_CONCURRENCY", "4"))  # upstream calls in flight per process
+IMAGE_JOB_TIMEOUT = float(os.getenv("IMAGE_JOB_TIMEOUT", "120"))  # seconds, queueing included
+IMAGE_STUB_DELAY = float(os.getenv("IMAGE_STUB_DELAY", "0.5"))
+# Where browsers fetch assets from, e.g. a CDN in front of /api/assets; defaults to this server's own URL
+IMAGE_PUBLIC_URL = os.getenv("IMAGE_PUBLIC_URL", "").rstrip("/")
+# Assets never change under their URL
+ASSET_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+ACTIVE_STATUSES = ("queued", "running")
+# A job still active this long after submission lost its worker (restart, crash)
+STALE_AFTER = IMAGE_JOB_TIMEOUT + 30
+
+
+# ------------------- KEYS -------------------
+def is_digest(value: str) -> bool:
+    return len(value) == 64 and all(c in "0123456789abcdef" for c in value)
+
+
+def normalize_prompt(prompt: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", prompt or "").split())[:IMAGE_PROMPT_MAX_CHARS]
+
+
+def make_key(prompt: str, model: str, size: str) -> str:
+    """Hash of everything that determines the picture; the request side of the cache."""
+    payload = {"model": model, "size": size, "prompt": normalize_prompt(prompt)}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+# ------------------- ASSET STORE -------------------
+class AssetStore:
+    """Content-addressed files on disk.
+
+    assets/<d[:2]>/<digest>.png holds the bytes under the sha256 of their
+    content, so identical pictures are stored once and a URL can never
+    change meaning. keys/<k[:2]>/<key> maps a request key to its digest.
+    Both are written to a temp file and renamed into place, so concurrent
+    workers never see a partial file.
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.pruned = 0
+
+    def _key_path(self, key: str) -> str:
+        return os.path.join(self.root, "keys", key[:2], key)
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.root, "assets", digest[:2], f"{digest}.png")
+
+    def _write(self, path: str, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+
+    def lookup(self, key: str) -> Optional[str]:
+        """Digest of the asset generated for this request key, if it is still on disk."""
+        try:
+            with open(self._key_path(key), "r") as f:
+                digest = f.read().strip()
+        except OSError:
+            self.misses += 1
+            return None
+        try:
+            os.utime(self.path(digest))  # keeps prune() least-recently-used
+        except OSError:  # pruned since
+            self.misses += 1
+            return None
+        self.hits += 1
+        return digest
+
+    def put(self, key: str, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+        if not os.path.exists(path):
+            self._write(path, data)
+            self.stored += 1
+        self._write(self._key_path(key), digest.encode("ascii"))
+        if self.max_bytes and self.stored % 50 == 0:
+            self.prune()
+        return digest
+
+    def prune(self):
+        """Delete the least recently used assets until the store fits max_bytes.
+        Key files pointing at them are left behind and read as misses."""
+        files = []
+        for dirpath, _, names in os.walk(os.path.join(self.root, "assets")):
+            for name in names:
+                if name.startswith(".tmp-"):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
+            self.pruned += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "stored": self.stored,
+            "pruned": self.pruned,
+        }
+
+
+# ------------------- BACKENDS -------------------
+class OpenAIImages:
+    """The images endpoint of an OpenAI-compatible API, on the worker's pooled client."""
+
+    def __init__(self, base_url: str, api_key: Optional[str], model: str):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.model = model
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.api_key)
+
+    async def generate(self, prompt: str, size: str) -> bytes:
+        client = llm.get_client(self.base_url, self.api_key)
+        result = await client.images.generate(model=self.model, prompt=prompt, size=size, n=1, response_format="b64_json")
+        return base64.b64decode(result.data[0].b64_json)
+
+
+class StubImages:
+    """Deterministic solid-colour PNGs after a fixed delay, for development, benches and tests."""
+
+    model = "stub"
+    configured = True
+
+    def __init__(self, delay: float = IMAGE_STUB_DELAY):
+        self.delay = delay
+        self.calls = 0
+
+    async def generate(self, prompt: str, size: str) -> bytes:
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        width, height = (int(n) for n in size.split("x"))
+        r, g, b = hashlib.sha256(prompt.encode("utf-8")).digest()[:3]
+        return png(width, height, (r, g, b))
+
+
+def png(width: int, height: int, rgb: tuple) -> bytes:
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    row = b"\x00" + bytes(rgb) * width
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(row * height)) + chunk(b"IEND", b"")
+
+
+def make_backend():
+    if IMAGE_BACKEND == "stub":
+        return StubImages()
+    if IMAGE_BACKEND == "openai":
+        backend = OpenAIImages(IMAGE_BASE_URL, os.getenv("IMAGE_API_KEY") or os.getenv("OPENAI_API_KEY"), IMAGE_MODEL)
+        if not backend.configured:
+            print("Image generation disabled: IMAGE_BACKEND=openai needs IMAGE_API_KEY or OPENAI_API_KEY")
+        return backend
+    raise ValueError(f"Unknown IMAGE_BACKEND {IMAGE_BACKEND!r}")
+
+
+# ------------------- JOBS -------------------
+def job_to_dict(job: ImageJob) -> dict:
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "digest": job.digest,
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+def fail_job(db, job_id: str, error: str) -> bool:
+    """Fail a job that is still active and give back its credit, then commit.
+    The conditional UPDATE lets only one caller win, so the credit is returned once."""
+    claimed = db.execute(
+        update(ImageJob)
+        .where(ImageJob.id == job_id, ImageJob.status.in_(ACTIVE_STATUSES))
+        .values(status="failed", error=error, finished_at=datetime.utcnow())
+    ).rowcount
+    email = None
+    if claimed:
+        job = db.get(ImageJob, job_id)
+        if job.charged:
+            credits.refund_credit(db, job.user_id)
+            email = db.query(User.email).filter(User.id == job.user_id).scalar()
+    db.commit()
+    if email:
+        auth_cache.invalidate(email)
+    return bool(claimed)
+
+
+def expire_stale(db, job: ImageJob):
+    """Fail a job whose worker went away (restart, crash) once it is past any chance of finishing."""
+    if job.status in ACTIVE_STATUSES and job.created_at < datetime.utcnow() - timedelta(seconds=STALE_AFTER):
+        fail_job(db, job.id, "Image generation was interrupted. Try again.")
+        db.refresh(job)
+
+
+class ImageGenerator:
+    """Runs image jobs in the background of the worker that accepted them.
+
+    Concurrent jobs for the same request key share one upstream call
+    (single flight), at most `concurrency` calls run at once, and every
+    result lands in the asset store before its jobs are marked done.
+    """
+
+    def __init__(self, store: AssetStore, backend, concurrency: int = IMAGE_CONCURRENCY, timeout: float = IMAGE_JOB_TIMEOUT):
+        self.store = store
+        self.backend = backend
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._jobs = set()
+        self.upstream_calls = 0
+        self.shared = 0
+        self.completed = 0
+        self.failed = 0
+
+    def request_key(self, prompt: str) -> str:
+        return make_key(prompt, getattr(self.backend, "model", IMAGE_MODEL), IMAGE_SIZE)
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._inflight
+
+    def create_job(self, db, user_id: int, key: str, charged: bool) -> ImageJob:
+        job = ImageJob(id=uuid.uuid4().hex, user_id=user_id, status="queued", request_key=key, charged=charged)
+        db.add(job)
+        db.flush()
+        return job
+
+    def start(self, job_id: str, key: str, prompt: str):
+        task = asyncio.create_task(self._run(job_id, key, prompt))
+        self._jobs.add(task)
+        task.add_done_callback(self._jobs.discard)
+
+    async def _run(self, job_id: str, key: str, prompt: str):
+        await run_in_threadpool(self._mark, job_id, "running")
+        try:
+            digest = await self._generate(key, prompt)
+        except asyncio.CancelledError:
+            raise  # shutting down; expire_stale refunds it
+        except Exception as e:
+            self.failed += 1
+            print(f"Image job {job_id} failed: {e!r}")
+            await run_in_threadpool(self._fail, job_id)
+            return
+        self.completed += 1
+        await run_in_threadpool(self._mark, job_id, "done", digest)
+
+    async def _generate(self, key: str, prompt: str) -> str:
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._inflight[key] = asyncio.create_task(self._call(key, prompt))
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.shared += 1
+        # Shielded: one job's cancellation must not abort the call others are waiting on
+        return await asyncio.shield(task)
+
+    async def _call(self, key: str, prompt: str) -> str:
+        async def call():
+            # A job that queued behind an identical one that has since finished
+            digest = await run_in_threadpool(self.store.lookup, key)
+            if digest:
+                return digest
+            async with self._semaphore:
+                self.upstream_calls += 1
+                data = await self.backend.generate(normalize_prompt(prompt), IMAGE_SIZE)
+            return await run_in_threadpool(self.store.put, key, data)
+
+        return await asyncio.wait_for(call(), self.timeout)
+
+    def _mark(self, job_id: str, status: str, digest: Optional[str] = None):
+        with session_scope() as db:
+            values = {"status": status}
+            if status == "done":
+                values.update(digest=digest, finished_at=datetime.utcnow())
+            db.execute(update(ImageJob).where(ImageJob.id == job_id, ImageJob.status.in_(ACTIVE_STATUSES)).values(**values))
+            db.commit()
+
+    def _fail(self, job_id: str):
+        with session_scope() as db:
+            fail_job(db, job_id, "Image generation failed. Try again.")
+
+    async def stop(self):
+        tasks = list(self._jobs) + list(self._inflight.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "jobs_running": len(self._jobs),
+            "upstream_in_flight": len(self._inflight),
+            "upstream_calls": self.upstream_calls,
+            "shared": self.shared,
+            "completed": self.completed,
+            "failed": self.failed,
+            **{f"cache_{k}": v for k, v in self.store.stats().items()},
+        }
+
+
+image_generator = ImageGenerator(AssetStore(IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_MB * 1024 * 1024), make_backend())
@@ -0,0 +1,243 @@
+"""Worker startup and shutdown: warm-up, readiness and draining.
+
+The schema is owned by Alembic (serve.py --migrate, or `alembic upgrade
+head` in the deploy step) and workers never run DDL, so any number of them
+can boot at once. Each one warms its pool and tokenizer before /readyz
+turns green.
+
+On SIGTERM a worker first goes unready but keeps serving for SHUTDOWN_DELAY
+seconds, so the load balancer can stop sending it traffic; then uvicorn
+closes the listener and waits for open responses (streams included) up to
+its graceful timeout. SSE generations whose readers are gone run on as
+tasks; those get DRAIN_TIMEOUT to finish before they are cancelled, which
+saves the partial answer like any disconnect does.
+
+Loops that must run once per database (batch jobs, social publishing) run
+in the worker holding the leader lock; see Leader.
+"""
+import asyncio
+import hashlib
+import os
+import signal
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+import tokens
+
+try:
+    import fcntl
+except ImportError:  # optional: without flock (Windows) every worker leads, so run one
+    fcntl = None
+
+# ------------------- CONFIG -------------------
+# Pool connections opened before the worker reports ready; capped at DB_POOL_SIZE
+STARTUP_WARM_CONNECTIONS = int(os.getenv("STARTUP_WARM_CONNECTIONS", "4"))
+# Refuse readiness while the database is behind (or ahead of) the migrations this code ships with
+SCHEMA_CHECK = os.getenv("SCHEMA_CHECK", "true").lower() in ("1", "true", "yes")
+# Seconds between SIGTERM and closing the listener, spent serving while /readyz says 503
+SHUTDOWN_DELAY = float(os.getenv("SHUTDOWN_DELAY", "0"))
+# Seconds detached generations get to finish once the listener is closed
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "25"))
+
+# Lock file electing the one worker per host that runs the singleton loops; by default one per database
+LEADER_LOCK_FILE = os.getenv("LEADER_LOCK_FILE", "")
+LEADER_RETRY = float(os.getenv("LEADER_RETRY", "5"))  # seconds between a follower's attempts to take over
+
+ALEMBIC_INI = os.path.join(os.path.dirname(os.path.abspath(__file__)), "alembic.ini")
+
+
+# ------------------- SCHEMA -------------------
+def expected_revision() -> Optional[str]:
+    """Head revision of the migrations next to this file."""
+    from alembic.config import Config
+    from alembic.script import ScriptDirectory
+
+    return ScriptDirectory.from_config(Config(ALEMBIC_INI)).get_current_head()
+
+
+def database_revision(engine) -> Optional[str]:
+    """Revision recorded in alembic_version; None for a database Alembic never touched."""
+    with engine.connect() as conn:
+        try:
+            return conn.execute(text("SELECT version_num FROM alembic_version")).scalar()
+        except SQLAlchemyError:
+            return None
+
+
+# ------------------- WARM-UP -------------------
+def warm_pool(engine, connections: int) -> int:
+    """Open up to `connections` pooled connections at once and hand them back, so the
+    first requests don't pay for connecting. Returns how many were opened."""
+    size = engine.pool.size() if hasattr(engine.pool, "size") else 1
+    held = []
+    try:
+        for _ in range(max(1, min(connections, size))):
+            conn = engine.connect()
+            held.append(conn)
+            conn.execute(text("SELECT 1"))
+    finally:
+        for conn in held:
+            conn.close()
+    return len(held)
+
+
+class Lifecycle:
+    """One worker's state: starting -> ready -> draining -> stopped."""
+
+    def __init__(self):
+        self.state = "starting"
+        self.schema: Dict[str, Optional[str]] = {}
+        self.problems = []
+        self.timings: Dict[str, float] = {}  # seconds per warm-up step
+        self.drained = 0
+        self.cancelled = 0
+
+    async def _step(self, name: str, fn, *args):
+        started = time.perf_counter()
+        try:
+            return await run_in_threadpool(fn, *args)
+        finally:
+            self.timings[name] = round(time.perf_counter() - started, 4)
+
+    async def warm_up(self, engine):
+        """Everything a first request would otherwise wait for. Failures leave the worker unready, not dead."""
+        started = time.perf_counter()
+        try:
+            await self._step("db_pool", warm_pool, engine, STARTUP_WARM_CONNECTIONS)
+        except SQLAlchemyError as e:
+            self.problems.append(f"database unreachable: {e!r}")
+        if SCHEMA_CHECK and not self.problems:
+            expected = await self._step("schema", expected_revision)
+            current = await run_in_threadpool(database_revision, engine)
+            self.schema = {"expected": expected, "current": current}
+            if current != expected:
+                self.problems.append(f"database schema is at {current}, this code expects {expected}; run `alembic upgrade head`")
+        # Loads the BPE ranks (or gives up on them) now instead of inside the first generation
+        await self._step("tokenizer", tokens.count_tokens, "warm up")
+        self.timings["total"] = round(time.perf_counter() - started, 4)
+        for problem in self.problems:
+            print(f"Startup: {problem}")
+        self.state = "ready" if not self.problems else "unready"
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def install_signal_handlers(self, delay: float = SHUTDOWN_DELAY):
+        """Put the unready period in front of the server's own SIGTERM/SIGINT handling."""
+        if delay <= 0 or threading.current_thread() is not threading.main_thread():
+            return
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            previous = signal.getsignal(sig)
+            if not callable(previous):
+                continue
+
+            def handler(signum, frame, previous=previous):
+                if self.state != "ready":  # a second signal: stop now
+                    previous(signum, frame)
+                    return
+                self.state = "draining"
+                loop.call_soon_threadsafe(loop.call_later, delay, previous, signum, frame)
+
+            signal.signal(sig, handler)
+
+    async def drain(self, registry, timeout: float = DRAIN_TIMEOUT):
+        """Go unready, wait for running generations up to timeout, then cancel the rest."""
+        self.state = "draining"
+        tasks = registry.running_tasks()
+        if tasks:
+            done, pending = await asyncio.wait(tasks, timeout=timeout)
+            self.drained, self.cancelled = len(done), len(pending)
+        await registry.cancel_all()
+        if self.cancelled:
+            print(f"Shutdown: cancelled {self.cancelled} generations still running after {timeout:g}s")
+        self.state = "stopped"
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "ready": self.ready,
+            "warm_up_seconds": self.timings,
+            "drained": self.drained,
+            "cancelled": self.cancelled,
+        }
+
+
+# ------------------- LEADER -------------------
+class Leader:
+    """Which of this host's workers runs the loops that must not run twice.
+
+    The batch worker and the social publisher requeue every claim they find
+    in flight when they start, so two of them over one database would redo
+    (and rebill) each other's work. The first worker to take an exclusive
+    flock on the lock file leads; the others retry every LEADER_RETRY
+    seconds. The kernel drops the lock with its process, so a sibling takes
+    over from a leader that died and recovers what it left running. Across
+    hosts, enable those loops on one host only.
+    """
+
+    def __init__(self, path: str, retry: float = LEADER_RETRY):
+        self.path = path
+        self.retry = retry
+        self.is_leader = False
+        self._fd: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def try_acquire(self) -> bool:
+        if self.is_leader:
+            return True
+        if fcntl is None:
+            self.is_leader = True
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._fd = fd
+        self.is_leader = True
+        return True
+
+    def start(self, on_elected: Callable[[], None]):
+        """Call on_elected now if this worker leads, else as soon as it takes over."""
+        if self.try_acquire():
+            on_elected()
+        else:
+            self._task = asyncio.create_task(self._follow(on_elected))
+
+    async def _follow(self, on_elected: Callable[[], None]):
+        while not self.try_acquire():
+            await asyncio.sleep(self.retry)
+        print(f"Worker {os.getpid()} took over the background loops")
+        on_elected()
+
+    async def stop(self):
+        """Stop following; a leader releases the lock. Call after its loops have stopped."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        self.is_leader = False
+
+
+def leader_lock_path(engine) -> str:
+    if LEADER_LOCK_FILE:
+        return LEADER_LOCK_FILE
+    digest = hashlib.sha256(engine.url.render_as_string(hide_password=True).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(tempfile.gettempdir(), f"ai-content-generator-{digest}.lock")
+
+
+lifecycle = Lifecycle()
@@ -0,0 +1,114 @@
+import os
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import httpx
+from openai import AsyncOpenAI
+
+# ------------------- CONFIG -------------------
+OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+DEFAULT_MODEL = os.getenv("OPENROUTER_MODEL", "mistralai/mistral-small-3.2-24b-instruct:free")
+
+# One pooled HTTP client is shared by every stream in the worker
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "200"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "50"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "120"))
+
+_http_client: Optional[httpx.AsyncClient] = None
+_clients: Dict[Tuple[str, str], AsyncOpenAI] = {}
+
+
+# ------------------- CLIENT -------------------
+def get_client(base_url: Optional[str] = None, api_key: Optional[str] = None) -> AsyncOpenAI:
+    """Return the worker-wide async client for an OpenAI-compatible provider
+    (OpenRouter by default), creating it on first use.
+
+    Every provider shares one pooled HTTP client. OPENROUTER_API_KEY is only
+    ever sent to OpenRouter: any other base_url needs its own api_key.
+    """
+    global _http_client
+    base_url = base_url or OPENROUTER_BASE_URL
+    if not api_key:
+        if not is_openrouter(base_url):
+            raise ValueError(f"No API key configured for {base_url}")
+        api_key = os.getenv("OPENROUTER_API_KEY")
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_KEEPALIVE,
+            ),
+            timeout=httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+        )
+    client = _clients.get((base_url, api_key))
+    if client is None:
+        client = _clients[(base_url, api_key)] = AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            http_client=_http_client,
+            max_retries=0,
+        )
+    return client
+
+
+def is_openrouter(base_url: Optional[str]) -> bool:
+    return not base_url or base_url.rstrip("/") == OPENROUTER_BASE_URL.rstrip("/")
+
+
+async def close_client():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+    _http_client = None
+    _clients.clear()
+
+
+# ------------------- STREAMING -------------------
+async def stream_chat(
+    messages: List[dict],
+    model: str = DEFAULT_MODEL,
+    max_tokens: int = 2048,
+    temperature: float = 0.7,
+    base_url: Optional[str] = None,
+    api_key: Optional[str] = None,
+) -> AsyncIterator[str]:
+    """Yield content deltas from a streaming chat completion.
+
+    Closing the generator (or cancelling the task consuming it) closes the
+    upstream response, so an abandoned stream frees its pooled connection
+    immediately instead of draining the rest of the completion.
+    """
+    stream = await get_client(base_url, api_key).chat.completions.create(
+        model=model,
+        messages=messages,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        stream=True,
+    )
+    try:
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            content = chunk.choices[0].delta.content
+            if content:
+                yield content
+    finally:
+        await stream.close()
+
+
+async def complete(
+    messages: List[dict],
+    model: str = DEFAULT_MODEL,
+    max_tokens: int = 512,
+    temperature: float = 0.3,
+    base_url: Optional[str] = None,
+    api_key: Optional[str] = None,
+) -> str:
+    """Run a non-streaming completion and return its text."""
+    response = await get_client(base_url, api_key).chat.completions.create(
+        model=model,
+        messages=messages,
+        max_tokens=max_tokens,
+        temperature=temperature,
+    )
+    return response.choices[0].message.content or ""
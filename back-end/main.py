@@ -1,40 +1,55 @@
 import asyncio
-import json
 import os
+import time
 import uvicorn
-from datetime import datetime, timedelta
-from typing import Optional
+import weakref
+from contextlib import aclosing, asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
 
-from fastapi import FastAPI, HTTPException, Depends, status, Request
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi import FastAPI, HTTPException, Depends, Query, status, Request, Response
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer
+from fastapi.concurrency import run_in_threadpool
+from starlette.background import BackgroundTask
 from pydantic import BaseModel, EmailStr
-from passlib.context import CryptContext
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from jose import JWTError, jwt
-from openai import OpenAI
-
-from models import Base, User, Post
-from database import get_db, engine
+import anyio
+
+from models import BatchItem, BatchJob, ImageJob, SocialDelivery, User, Post
+from database import get_db, engine, pool_stats, session_scope
+from admission import AdmissionRejected, PlanLimits, make_controller
+from auth_cache import Principal, auth_cache
+import archive
+import batch_jobs
+import chat_store
+import context_window
+import credits
+import images
+import llm
+import metrics
+import passwords
+import search
+import social
+import webhooks
+import wire
+from credits import usage_ledger
+from lifecycle import Leader, leader_lock_path, lifecycle
+from response_cache import make_key, replay, response_cache
+from router import model_router
+from stream_buffers import format_event, parse_event_id, stream_registry
+from tokens import count_tokens
 
 # ------------------- CONFIG -------------------
 SECRET_KEY = os.getenv("SECRET_KEY", "SUPER_SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 
-# OpenRouter client
-openrouter_client = OpenAI(
-    api_key=os.getenv("OPENROUTER_API_KEY"),
-    base_url="https://openrouter.ai/api/v1"
-)
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/login")
 
-# Create tables
-Base.metadata.create_all(bind=engine)
-
 # ------------------- PLAN CONFIG -------------------
 PLAN_CREDITS = {
     "free": 10,
@@ -43,6 +58,29 @@ PLAN_CREDITS = {
     "flexible": None,
 }
 FLEXIBLE_COST_PER_30 = 0.99
+# Generation admission per plan: sustained rate, back-to-back burst, concurrent streams
+PLAN_LIMITS = {
+    "free": PlanLimits(rate_per_minute=5, burst=3, max_streams=1),
+    "starter": PlanLimits(rate_per_minute=30, burst=10, max_streams=3),
+    "pro": PlanLimits(rate_per_minute=120, burst=30, max_streams=8),
+    "flexible": PlanLimits(rate_per_minute=60, burst=20, max_streams=4),
+}
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+# Sampling parameters for chat generations; part of the response cache key
+GENERATION_PARAMS = {"max_tokens": 2048, "temperature": 0.7}
+# Keep proxies from buffering or caching event streams
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+# Add a system prompt to guide the AI's response style, based on the user's request
+SYSTEM_PROMPT = {
+    "role": "system",
+    "content": "You are a highly professional, well-organized, and smart assistant. Your responses should be structured like a polished article or blog post, using Markdown for clear headings (like ## and ###), bolding for emphasis (**bold text**), and logical paragraph breaks. The user is expecting a perfect, structured, and visually appealing response. Based on the user's query, use appropriate icons and emojis to enhance the answer, as long as it maintains a professional tone."
+}
+
+
+def generation_cost(plan: str) -> float:
+    """UsageRecord.cost of one generation; only the flexible plan pays per use."""
+    return FLEXIBLE_COST_PER_30 / 30 if plan == "flexible" else 0.0
 
 # Gumroad product mapping
 GUMROAD_PRODUCTS = {
@@ -73,14 +111,59 @@ class PostUpdate(BaseModel):
     title: Optional[str] = None
     messages: Optional[str] = None
 
+class PostPatch(BaseModel):
+    ops: List[dict]
+
+class ImageRequest(BaseModel):
+    prompt: str
+
 # New schema for social media posting
 class SocialPostRequest(BaseModel):
-    platform: str  # e.g., "facebook", "twitter", "linkedin"
+    platform: Optional[str] = None  # e.g., "facebook", "twitter", "linkedin"
+    platforms: Optional[List[str]] = None  # fan out to several at once
     content: str
     post_id: int
+    scheduled_at: Optional[datetime] = None  # publish later; naive times are UTC
 
 # ------------------- APP -------------------
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Warm up and start this worker's background loops; on shutdown drain, then stop them.
+
+    The schema is not touched here: `alembic upgrade head` (or serve.py
+    --migrate) runs once per deploy, before any worker starts.
+    """
+    await lifecycle.warm_up(engine)
+    usage_ledger.start()
+    webhook_inbox.start()
+    if webhooks.WEBHOOK_WORKER_ENABLED:
+        webhook_consumer.start()
+    # These requeue whatever they find in flight on start, so one worker runs them
+    leader.start(start_singleton_loops)
+    lifecycle.install_signal_handlers()
+    yield
+    # Generations first: they still write their answers, refunds and usage through the loops below
+    await lifecycle.drain(stream_registry)
+    await batch_worker.stop()
+    await webhook_inbox.stop()
+    await webhook_consumer.stop()
+    await social_publisher.stop()
+    await leader.stop()
+    await images.image_generator.stop()
+    await llm.close_client()
+    await usage_ledger.stop()
+    passwords.shutdown()
+    engine.dispose()
+
+
+def start_singleton_loops():
+    if batch_jobs.BATCH_WORKER_ENABLED:
+        batch_worker.start()
+    if social.SOCIAL_WORKER_ENABLED:
+        social_publisher.start()
+
+
+app = FastAPI(default_response_class=wire.FastJSONResponse, lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -89,14 +172,45 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(wire.CompressionMiddleware)
+# Outermost, so CORS preflights and error responses are timed too
+app.add_middleware(metrics.MetricsMiddleware)
+
+batch_worker = batch_jobs.BatchWorker(SYSTEM_PROMPT, GENERATION_PARAMS, generation_cost)
+admission_control = make_controller({plan: PLAN_LIMITS[plan] for plan in PLAN_CREDITS})
+webhook_inbox = webhooks.WebhookInbox()
+webhook_consumer = webhooks.WebhookConsumer(GUMROAD_PRODUCTS, PLAN_CREDITS)
+social_publisher = social.SocialPublisher(social.make_adapters())
+leader = Leader(leader_lock_path(engine))
+
+# Component counters and occupancy, exported as gauges next to the request metrics
+metrics.register_stats("db_pool", lambda: pool_stats(engine))
+metrics.register_stats("auth_cache", auth_cache.stats)
+metrics.register_stats("response_cache", response_cache.stats)
+metrics.register_stats("llm", model_router.stats, label="route")
+metrics.register_stats("streams", stream_registry.stats)
+metrics.register_stats("admission", admission_control.stats)
+metrics.register_stats("batch", batch_worker.stats)
+metrics.register_stats("webhook_inbox", webhook_inbox.stats)
+metrics.register_stats("webhook_consumer", webhook_consumer.stats)
+metrics.register_stats("images", images.image_generator.stats)
+metrics.register_stats("social", social_publisher.stats)
+metrics.register_stats("archive", archive.stats)
+metrics.register_stats("lifecycle", lifecycle.stats)
+
+@app.exception_handler(passwords.PasswordHasherBusy)
+async def password_hasher_busy(request: Request, exc: passwords.PasswordHasherBusy):
+    return JSONResponse({"error": "Too many sign-in attempts right now. Try again shortly."}, status_code=503, headers={"Retry-After": "1"})
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected(request: Request, exc: AdmissionRejected):
+    return JSONResponse(
+        {"error": exc.reason, "retry_after": exc.retry_after},
+        status_code=429,
+        headers={"Retry-After": str(exc.retry_after)},
+    )
 
 # ------------------- HELPERS -------------------
-def get_password_hash(password: str):
-    return pwd_context.hash(password)
-
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
@@ -106,7 +220,7 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
 def get_user_by_email(email: str, db: Session) -> Optional[User]:
     return db.query(User).filter(User.email == email).first()
 
-async def get_current_user(request: Request, db: Session = Depends(get_db)) -> User:
+async def get_current_user(request: Request, db: Session = Depends(get_db)) -> Principal:
     auth_header = request.headers.get("Authorization")
     if not auth_header or not auth_header.startswith("Bearer "):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Missing or invalid token")
@@ -120,46 +234,58 @@ async def get_current_user(request: Request, db: Session = Depends(get_db)) -> U
     except JWTError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid authentication")
 
-    user = get_user_by_email(email, db)
+    # Most requests are served from the principal cache without touching the DB
+    principal = await auth_cache.aget(email)
+    if principal is not None:
+        return principal
+
+    user = await run_in_threadpool(get_user_by_email, email, db)
     if user is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
-    return user
-
-def decrement_credit_if_applicable(user: User, db: Session):
-    if user.plan in ("starter", "pro", "free"):
-        if user.credit_remaining <= 0:
-            raise HTTPException(status_code=403, detail="No credits left. Upgrade your plan.")
-        user.credit_remaining -= 1
-        db.commit()
-        db.refresh(user)
-    elif user.plan == "flexible":
-        if not user.credit_remaining:
-            user.credit_remaining = 0
-        user.credit_remaining += 1
-        db.commit()
-        db.refresh(user)
+    principal = Principal.from_user(user)
+    await auth_cache.aset(email, principal)
+    return principal
 
 # ------------------- ROUTES: AUTH -------------------
+# bcrypt runs on the bounded pool in passwords.py, so a login burst can't monopolise the worker
 @app.post("/api/register")
-def register(user: UserRegister, db: Session = Depends(get_db)):
-    if get_user_by_email(user.email, db):
+async def register(user: UserRegister, db: Session = Depends(get_db)):
+    if await run_in_threadpool(get_user_by_email, user.email, db):
         raise HTTPException(status_code=400, detail="Email already registered")
-    hashed_password = get_password_hash(user.password)
+    db.close()  # don't hold a pooled connection while waiting for bcrypt
+    hashed_password = await passwords.hash_password(user.password)
     new_user = User(email=user.email, hashed_password=hashed_password, plan="free", credit_remaining=PLAN_CREDITS["free"])
     db.add(new_user)
-    db.commit()
-    return {"message": "User registered successfully", "email": new_user.email}
+    try:
+        await run_in_threadpool(db.commit)
+    except IntegrityError:
+        # A concurrent signup with the same email committed while this one was hashing
+        await run_in_threadpool(db.rollback)
+        raise HTTPException(status_code=400, detail="Email already registered")
+    return {"message": "User registered successfully", "email": user.email}
 
 @app.post("/api/login", response_model=Token)
-def login(user: UserRegister, db: Session = Depends(get_db)):
-    db_user = get_user_by_email(user.email, db)
-    if not db_user or not verify_password(user.password, db_user.hashed_password):
+async def login(user: UserRegister, db: Session = Depends(get_db)):
+    db_user = await run_in_threadpool(get_user_by_email, user.email, db)
+    if not db_user:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    user_id, hashed_password = db_user.id, db_user.hashed_password
+    db.close()  # don't hold a pooled connection while waiting for bcrypt
+    valid, new_hash = await passwords.verify_password(user.password, hashed_password)
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid credentials")
-    token = create_access_token(data={"sub": db_user.email})
+    if new_hash:
+        # Stored with an old work factor: upgrade transparently now that we know the password
+        def rehash():
+            db.query(User).filter(User.id == user_id).update({User.hashed_password: new_hash})
+            db.commit()
+
+        await run_in_threadpool(rehash)
+    token = create_access_token(data={"sub": user.email})
     return {"access_token": token, "token_type": "bearer"}
 
 @app.get("/api/profile")
-def profile(current_user: User = Depends(get_current_user)):
+def profile(current_user: Principal = Depends(get_current_user)):
     return {
         "email": current_user.email,
         "plan": current_user.plan,
@@ -167,7 +293,7 @@ def profile(current_user: User = Depends(get_current_user)):
     }
 
 @app.get("/api/me")
-async def get_me(user: User = Depends(get_current_user)):
+async def get_me(user: Principal = Depends(get_current_user)):
     return {
         "id": user.id,
         "email": user.email,
@@ -175,82 +301,214 @@ async def get_me(user: User = Depends(get_current_user)):
     }
 
 @app.get("/api/posts")
-def get_posts(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    posts = db.query(Post).filter(Post.user_id == current_user.id).order_by(Post.created_at.desc()).all()
-    return [
-        {
-            "id": p.id,
-            "title": p.title,
-            "messages": p.messages,
-            "created_at": p.created_at,
-        }
-        for p in posts
-    ]
-
+def get_posts(
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    current_user: Principal = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    try:
+        items, next_cursor = chat_store.list_posts(db, current_user.id, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return wire.FastJSONResponse({"items": items, "next_cursor": next_cursor})
+
+
+@app.get("/api/search")
+def search_posts(
+    q: str = Query(..., min_length=1, max_length=500),
+    limit: int = Query(20, ge=1, le=50),
+    offset: int = Query(0, ge=0, le=1000),
+    current_user: Principal = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """Ranked full-text search over the user's post titles and messages."""
+    if not search.supported(db):
+        raise HTTPException(status_code=501, detail="Search is not available on this database")
+    try:
+        items, next_offset = search.search_posts(db, current_user.id, q, limit, offset)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"items": items, "next_offset": next_offset}
 
 @app.post("/api/posts")
-def create_post(post: PostCreate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def create_post(post: PostCreate, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
+    try:
+        messages = chat_store.parse_messages(post.messages)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
     new_post = Post(
         user_id=current_user.id,
         title=post.title or "Untitled Chat",
-        messages=post.messages
     )
     db.add(new_post)
+    db.flush()
+    chat_store.replace_messages(db, new_post.id, messages)
     db.commit()
     db.refresh(new_post)
-    return {
-        "id": new_post.id,
-        "title": new_post.title,
-        "messages": new_post.messages,
-        "created_at": new_post.created_at,
-    }
+    return wire.FastJSONResponse(chat_store.post_to_dict(new_post, messages))
+
+
+def claim_version(db: Session, db_post: Post, if_match: Optional[str]):
+    """Bump the post's version for a write, enforcing If-Match when the client sent one."""
+    expected = None
+    if if_match and if_match.strip() != "*":
+        if not chat_store.etag_matches(if_match, chat_store.etag(db_post)):
+            raise HTTPException(status_code=412, detail="Post was modified", headers={"ETag": chat_store.etag(db_post)})
+        expected = db_post.version
+    if not chat_store.bump_version(db, db_post.id, expected):
+        # Another writer got there between our read and the conditional UPDATE
+        db.rollback()
+        raise HTTPException(status_code=412, detail="Post was modified")
 
 
 @app.put("/api/posts/{post_id}")
-def update_post(post_id: int, post: PostUpdate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def update_post(post_id: int, post: PostUpdate, http_request: Request, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     db_post = db.query(Post).filter(Post.id == post_id, Post.user_id == current_user.id).first()
     if not db_post:
         raise HTTPException(status_code=404, detail="Post not found")
 
+    archive.rehydrate(db, db_post)
+    claim_version(db, db_post, http_request.headers.get("if-match"))
     if post.title:
         db_post.title = post.title
     if post.messages:
-        db_post.messages = post.messages
+        try:
+            messages = chat_store.parse_messages(post.messages)
+        except ValueError as e:
+            db.rollback()
+            raise HTTPException(status_code=400, detail=str(e))
+        chat_store.replace_messages(db, db_post.id, messages)
+        db_post.summary = None
+        db_post.summary_seq = 0
     db.commit()
     db.refresh(db_post)
-    return {
-        "id": db_post.id,
-        "title": db_post.title,
-        "messages": db_post.messages,
-        "created_at": db_post.created_at,
-    }
+    return wire.FastJSONResponse(
+        chat_store.post_to_dict(db_post, chat_store.load_messages_json(db, db_post.id)),
+        headers={"ETag": chat_store.etag(db_post)},
+    )
+
+
+@app.patch("/api/posts/{post_id}")
+def patch_post(post_id: int, patch: PostPatch, http_request: Request, response: Response, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Apply append/edit/delete/rename ops instead of resending the whole history."""
+    db_post = db.query(Post).filter(Post.id == post_id, Post.user_id == current_user.id).first()
+    if not db_post:
+        raise HTTPException(status_code=404, detail="Post not found")
+
+    archive.rehydrate(db, db_post)
+    claim_version(db, db_post, http_request.headers.get("if-match"))
+    try:
+        chat_store.apply_ops(db, db_post, patch.ops)
+    except ValueError as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    db.commit()
+    db.refresh(db_post)
+    response.headers["ETag"] = chat_store.etag(db_post)
+    return {"id": db_post.id, "title": db_post.title, "version": db_post.version}
 
 
 @app.get("/api/posts/{post_id}")
-def get_single_post(post_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def get_single_post(post_id: int, http_request: Request, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     db_post = db.query(Post).filter(Post.id == post_id, Post.user_id == current_user.id).first()
     if not db_post:
         raise HTTPException(status_code=404, detail="Post not found")
-    return {
-        "id": db_post.id,
-        "title": db_post.title,
-        "messages": db_post.messages,
-        "created_at": db_post.created_at,
-    }
+    # Browsers revalidate with If-None-Match on their own; unchanged chats cost one indexed row read
+    tag = chat_store.etag(db_post)
+    headers = {"ETag": tag, "Cache-Control": "private, no-cache"}
+    if chat_store.etag_matches(http_request.headers.get("if-none-match"), tag):
+        return Response(status_code=304, headers=headers)
+    # Archiving leaves the version alone, so the check above never needs the history
+    if archive.rehydrate(db, db_post):
+        db.commit()
+    # History rows are encoded once, straight into the response, instead of as an escaped string
+    return wire.FastJSONResponse(chat_store.post_to_dict(db_post, chat_store.load_messages_json(db, db_post.id)), headers=headers)
 
 
 @app.delete("/api/posts/{post_id}")
-def delete_post(post_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def delete_post(post_id: int, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     db_post = db.query(Post).filter(Post.id == post_id, Post.user_id == current_user.id).first()
     if not db_post:
         raise HTTPException(status_code=404, detail="Post not found")
 
+    chat_store.delete_messages(db, db_post.id)
+    archive.drop(db, db_post)
+    db.query(SocialDelivery).filter(SocialDelivery.post_id == db_post.id).delete(synchronize_session=False)
     db.delete(db_post)
     db.commit()
     return {"message": "Post deleted"}
 
 
+# ------------------- ROUTES: HEALTH -------------------
+@app.get("/healthz", include_in_schema=False)
+def health():
+    """Liveness: the worker answers. Restart it only when this fails."""
+    return {"status": "ok"}
+
+@app.get("/readyz", include_in_schema=False)
+def readiness():
+    """Readiness: warmed up, on the expected schema, not draining. Route traffic here only on 200."""
+    body = {"state": lifecycle.state, "worker": os.getpid(), "leader": leader.is_leader, "problems": lifecycle.problems, "schema": lifecycle.schema}
+    return JSONResponse(body, status_code=200 if lifecycle.ready else 503)
+
+
 # ------------------- ROUTES: BILLING -------------------
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    """Everything below plus request, stream and query timings, for Prometheus to scrape."""
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/metrics/db")
+def db_metrics():
+    """Connection pool occupancy, for sizing DB_POOL_SIZE against real traffic."""
+    return pool_stats(engine)
+
+@app.get("/api/metrics/response-cache")
+def response_cache_metrics():
+    """Hit rate and upstream time saved by the generation response cache."""
+    return response_cache.stats()
+
+@app.get("/api/metrics/llm")
+def llm_metrics():
+    """Per-route in-flight streams, breaker state and failover counters."""
+    return model_router.stats()
+
+@app.get("/api/metrics/streams")
+def stream_metrics():
+    """Resumable SSE generations currently buffered in this worker."""
+    return stream_registry.stats()
+
+@app.get("/api/metrics/admission")
+def admission_metrics():
+    return admission_control.stats()
+
+@app.get("/api/metrics/batch")
+def batch_metrics():
+    """Batch worker occupancy in this process."""
+    return batch_worker.stats()
+
+@app.get("/api/metrics/webhooks")
+def webhook_metrics():
+    """Webhook pings received and deduplicated, and what the consumer made of them."""
+    return {"inbox": webhook_inbox.stats(), "consumer": webhook_consumer.stats()}
+
+@app.get("/api/metrics/images")
+def image_metrics():
+    """Image jobs in this worker and the asset cache hit rate."""
+    return images.image_generator.stats()
+
+@app.get("/api/metrics/social")
+def social_metrics():
+    """Social deliveries in flight, sent, retried and held back by platform rate limits."""
+    return social_publisher.stats()
+
+@app.get("/api/metrics/usage-ledger")
+def usage_ledger_metrics():
+    """Usage rows waiting to be written, and any dropped during a database outage."""
+    return usage_ledger.stats()
+
 @app.get("/api/plans")
 def get_plans():
     return {
@@ -261,7 +519,9 @@ def get_plans():
     }
 
 @app.post("/api/gumroad-webhook")
-async def gumroad_webhook(request: Request, db: Session = Depends(get_db)):
+async def gumroad_webhook(request: Request):
+    """Store the ping in the webhook inbox and acknowledge it; webhook_consumer
+    applies the upgrade. Retries of a stored sale are acknowledged as duplicates."""
     data = await request.form()
     email = data.get("email")
     product_id = data.get("product_id")
@@ -270,149 +530,432 @@ async def gumroad_webhook(request: Request, db: Session = Depends(get_db)):
     if not success or not email or product_id not in GUMROAD_PRODUCTS:
         return JSONResponse({"error": "Invalid webhook"}, status_code=400)
 
-    plan_name = GUMROAD_PRODUCTS[product_id]
-    user = get_user_by_email(email, db)
-    if not user:
-        return JSONResponse({"error": "User not found"}, status_code=404)
-
-    if plan_name in ("starter", "pro"):
-        user.plan = plan_name
-        user.credit_remaining = PLAN_CREDITS[plan_name]
-    elif plan_name == "flexible":
-        user.plan = "flexible"
-        if not user.credit_remaining:
-            user.credit_remaining = 0
-
-    db.commit()
-    return {"message": f"{email} upgraded to {plan_name}"}
+    new = await webhook_inbox.put(webhooks.gumroad_event(dict(data)))
+    return {"message": "received" if new else "duplicate"}
 
 # ------------------- ROUTES: GENERATION -------------------
-@app.post("/api/generate_stream")
-async def generate_stream(request: PromptRequest, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    # Check for credits BEFORE starting the generation
-    if current_user.plan in ("starter", "pro", "free") and current_user.credit_remaining <= 0:
-        return JSONResponse({"error": "No credits left. Upgrade your plan.", "redirect": "/pricing"}, status_code=403)
+def save_generation(user_id: int, email: str, post_id: int, prompt: str, full_response: str, upstream_failed: bool) -> Optional[float]:
+    """Append the finished turn to the post, in a fresh session, and return the
+    user's credit_remaining afterwards.
+
+    The credit was already reserved before streaming; it is handed back when
+    the upstream call failed.
+    """
+    credit_remaining = None
+    try:
+        with session_scope() as db:
+            # Append the full user and assistant messages to the chat history
+            chat_store.append_messages(db, post_id, [
+                {"role": "user", "content": prompt},
+                {"role": "assistant", "content": full_response},
+            ])
+            chat_store.bump_version(db, post_id)
+            if upstream_failed:
+                credits.refund_credit(db, user_id)
+            db.commit()
+            credit_remaining = db.query(User.credit_remaining).filter(User.id == user_id).scalar()
+    except Exception as e:
+        print(f"Database update error in finally block: {e}")
+    if upstream_failed:
+        auth_cache.invalidate(email)
+    return credit_remaining
 
-    # If it's a new post, create it first
+@app.post("/api/generate_stream")
+async def generate_stream(request: PromptRequest, http_request: Request, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
+    if lifecycle.state == "draining":
+        # Don't start a generation this worker may have to cut short; the retry lands on another one
+        return JSONResponse({"error": "Server is restarting. Try again."}, status_code=503, headers={"Retry-After": "1"})
+    timer = metrics.GenerationTimer()
+    # Hand back the auth lookup's connection: open_generation waits for a threadpool
+    # thread (and, when admitted, an upstream slot) and must not hold one meanwhile
+    db.close()
+    if not ADMISSION_ENABLED:
+        return await start_generation(request, http_request, current_user, db, None, timer)
+    ticket = await admission_control.admit(current_user.id, current_user.plan)
+    timer.admitted()
+    try:
+        return await start_generation(request, http_request, current_user, db, ticket, timer)
+    except BaseException:
+        ticket.release()
+        raise
+
+def open_generation(db: Session, request: PromptRequest, user_id: int, email: str):
+    """Reserve the credit, create or load the post and assemble the context.
+
+    Blocking DB work, so it runs in the threadpool. Returns None when the
+    user has no credits left, else (plan, post_id, title, previous_summary,
+    messages_to_send, context).
+    """
+    if request.post_id is not None:
+        db_post = db.query(Post).filter(Post.id == request.post_id, Post.user_id == user_id).first()
+        if not db_post:
+            raise HTTPException(status_code=404, detail="Post not found")
+        archive.rehydrate(db, db_post)
+
+    # Reserve the credit BEFORE starting the generation; concurrent streams can't overspend
+    reservation = credits.reserve_credit(db, user_id)
+    if reservation is None:
+        db.rollback()
+        return None
+    plan, _ = reservation
+
+    # If it's a new post, create it in the same transaction; the prompt itself is stored with the answer
     if request.post_id is None:
-        new_post = Post(
-            user_id=current_user.id,
+        db_post = Post(
+            user_id=user_id,
             title=request.prompt[:30],
-            messages=json.dumps([{"role": "user", "content": request.prompt}])
         )
-        db.add(new_post)
-        db.commit()
-        db.refresh(new_post)
-        post_id = new_post.id
-    else:
-        post_id = request.post_id
-
-    # Get the existing post from the session
-    db_post = db.query(Post).filter(Post.id == post_id, Post.user_id == current_user.id).first()
-    if not db_post:
-        raise HTTPException(status_code=404, detail="Post not found")
-
-    messages_to_send = json.loads(db_post.messages)
-    messages_to_send.append({"role": "user", "content": request.prompt})
+        db.add(db_post)
+    db.commit()
+    auth_cache.invalidate(email)
+    post_id = db_post.id
+
+    # Keep the system prompt and the newest turns within the token budget
+    messages_to_send, context = context_window.assemble_context(db, db_post, SYSTEM_PROMPT, request.prompt)
+    previous_summary = db_post.summary
+    title = db_post.title
+    db.commit()  # persists token counts cached for rows that had none
+    # Hand the request's connection back to the pool before streaming starts;
+    # save_generation opens its own session once the answer is complete
+    db.close()
+    return plan, post_id, title, previous_summary, messages_to_send, context
+
+async def start_generation(request: PromptRequest, http_request: Request, current_user: Principal, db: Session, ticket, timer: metrics.GenerationTimer):
+    """Open the generation and start streaming it; the admission ticket (if
+    any) is released when the generation ends."""
+    release = ticket.release if ticket is not None else (lambda: None)
+    user_id = current_user.id
+    email = current_user.email
+    opened = await run_in_threadpool(open_generation, db, request, user_id, email)
+    if opened is None:
+        release()
+        return JSONResponse({"error": "No credits left. Upgrade your plan.", "redirect": "/pricing"}, status_code=403)
+    plan, post_id, title, previous_summary, messages_to_send, context = opened
+    cost = generation_cost(plan)
 
-    # Add a system prompt to guide the AI's response style, based on the user's request
-    system_prompt = {
-        "role": "system",
-        "content": "You are a highly professional, well-organized, and smart assistant. Your responses should be structured like a polished article or blog post, using Markdown for clear headings (like ## and ###), bolding for emphasis (**bold text**), and logical paragraph breaks. The user is expecting a perfect, structured, and visually appealing response. Based on the user's query, use appropriate icons and emojis to enhance the answer, as long as it maintains a professional tone."
-    }
-    messages_to_send.insert(0, system_prompt)
+    cache_key = make_key(messages_to_send, model_router.default_model, **GENERATION_PARAMS) if response_cache.enabled else None
+    cached = await response_cache.get(cache_key) if cache_key else None
+    outcome = {"upstream_failed": False, "completion_tokens": 0, "credit_remaining": None}
+    timer.source = "cache" if cached else "upstream"
 
-    async def stream_output():
+    async def generation():
+        """Yield the answer's chunks; however it ends, bill usage and persist the turn."""
         full_response = ""
+        finished = False
+        started = time.perf_counter()
         try:
-            response = openrouter_client.chat.completions.create(
-                model="mistralai/mistral-small-3.2-24b-instruct:free",
-                messages=messages_to_send,
-                max_tokens=2048,
-                temperature=0.7,
-                stream=True
-            )
-            for chunk in response:
-                content = chunk.choices[0].delta.content
-                if content:
+            # aclosing() closes the upstream response as soon as we stop reading,
+            # whether the client went away or this task was cancelled
+            source = replay(cached["content"]) if cached else model_router.stream(messages_to_send, **GENERATION_PARAMS)
+            async with aclosing(source) as chunks:
+                async for content in chunks:
                     full_response += content
-                    yield content.encode("utf-8")
+                    timer.chunk(content)
+                    yield content
+            finished = True
+            if cache_key and not cached:
+                await response_cache.set(cache_key, full_response, time.perf_counter() - started)
         except Exception as e:
+            outcome["upstream_failed"] = True
             print(f"Streaming error: {e}")
-            yield "❌ Error: Something went wrong with the AI generation.".encode("utf-8")
         finally:
-            # We need a new database session for the final update to avoid issues
-            # with the session used by FastAPI's dependency injection
-            new_db = next(get_db())
+            release()  # upstream is done with; free the slot before persisting
+            outcome["completion_tokens"] = count_tokens(full_response)
+            timer.finish("error" if outcome["upstream_failed"] else "ok" if finished else "disconnected", outcome["completion_tokens"])
+            if not outcome["upstream_failed"]:
+                usage_ledger.record(user_id, request.prompt, context["tokens_after"] + outcome["completion_tokens"], cost)
+            # Persist off the event loop; shielded so a disconnect-triggered
+            # cancellation can't drop the partial answer or a refund
+            with anyio.CancelScope(shield=True):
+                outcome["credit_remaining"] = await run_in_threadpool(
+                    save_generation, user_id, email, post_id, request.prompt, full_response, outcome["upstream_failed"]
+                )
+
+    headers = {
+        **context_window.metric_headers(context),
+        **({"X-Response-Cache": "hit" if cached else "miss"} if cache_key else {}),
+    }
+
+    if "text/event-stream" in http_request.headers.get("accept", ""):
+        # SSE mode: the generation runs as its own task and publishes into a
+        # buffer; this response (and any resume) only follows that buffer
+        timer.mode = "sse"
+        buffer = stream_registry.create(user_id)
+        buffer.publish("start", {"stream_id": buffer.stream_id, "post_id": post_id, "title": title})
+
+        async def produce():
             try:
-                user_to_update = new_db.query(User).filter(User.id == current_user.id).first()
-                post_to_update = new_db.query(Post).filter(Post.id == post_id, Post.user_id == current_user.id).first()
-
-                if not user_to_update or not post_to_update:
-                    print("Error: User or Post not found in new session during update.")
-                    return
-
-                # Append the full user and assistant messages to the chat history
-                messages = json.loads(post_to_update.messages)
-                messages.append({"role": "user", "content": request.prompt})
-                messages.append({"role": "assistant", "content": full_response})
-                post_to_update.messages = json.dumps(messages)
-                
-                if user_to_update.plan in ("starter", "pro", "free"):
-                    user_to_update.credit_remaining -= 1
-                elif user_to_update.plan == "flexible":
-                    user_to_update.credit_remaining = (user_to_update.credit_remaining or 0) + 1
-
-                new_db.commit()
-                new_db.refresh(user_to_update)
-                new_db.refresh(post_to_update)
-            except Exception as e:
-                new_db.rollback()
-                print(f"Database update error in finally block: {e}")
+                async with aclosing(wire.coalesce(generation())) as chunks:
+                    async for content in chunks:
+                        buffer.publish("token", {"content": content})
+                        if buffer.abandoned():
+                            break
             finally:
-                new_db.close()
+                final = {"post_id": post_id, "title": title, "plan": plan, "credit_remaining": outcome["credit_remaining"]}
+                if outcome["upstream_failed"]:
+                    buffer.publish("error", {**final, "message": "Something went wrong with the AI generation.", "refunded": True})
+                else:
+                    buffer.publish("done", {
+                        **final,
+                        "usage": {"prompt_tokens": context["tokens_after"], "completion_tokens": outcome["completion_tokens"]},
+                    })
+                buffer.finish()
+            if context["fold"]:
+                await context_window.update_summary(post_id, previous_summary, context["fold"])
+
+        buffer.task = asyncio.create_task(produce())
+        return StreamingResponse(buffer.sse(), media_type="text/event-stream", headers={**headers, **SSE_HEADERS})
+
+    async def stream_output():
+        # Tokens are regrouped into fewer, larger writes; the first one still goes out at once
+        async with aclosing(wire.coalesce(generation())) as chunks:
+            async for content in chunks:
+                if await http_request.is_disconnected():
+                    break
+                yield content.encode("utf-8")
+        if outcome["upstream_failed"]:
+            yield "❌ Error: Something went wrong with the AI generation.".encode("utf-8")
+
+    # Turns that fell out of the window are folded into the summary after the reply
+    background = BackgroundTask(context_window.update_summary, post_id, previous_summary, context["fold"]) if context["fold"] else None
+    body = stream_output()
+    # A client gone before the body starts never runs generation(); release when the body is dropped
+    weakref.finalize(body, release).atexit = False
+    return StreamingResponse(body, media_type="text/plain", headers=headers, background=background)
+
+@app.get("/api/generate_stream/{stream_id}")
+async def resume_stream(stream_id: str, http_request: Request, current_user: Principal = Depends(get_current_user)):
+    """Reattach to an SSE generation, replaying everything after Last-Event-ID."""
+    buffer = stream_registry.get(stream_id, current_user.id)
+    if buffer is None:
+        # Unknown, someone else's, or finished longer than STREAM_BUFFER_TTL ago: reload the post instead
+        raise HTTPException(status_code=404, detail="Stream not found")
+    last_stream_id, after_seq = parse_event_id(http_request.headers.get("last-event-id"))
+    if last_stream_id not in (None, stream_id):
+        after_seq = -1
+    return StreamingResponse(buffer.sse(after_seq), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+# ------------------- ROUTES: BATCH GENERATION -------------------
+@app.post("/api/batch", status_code=202)
+async def submit_batch(http_request: Request, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Queue a JSONL body of {"prompt": ..., "title": ...} lines; each becomes a Post."""
+    if current_user.plan in credits.METERED_PLANS and (current_user.credit_remaining or 0) <= 0:
+        return JSONResponse({"error": "No credits left. Upgrade your plan.", "redirect": "/pricing"}, status_code=403)
+    try:
+        items = batch_jobs.parse_jsonl((await http_request.body()).decode("utf-8"))
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid batch: {e}")
+
+    def submit():
+        job = batch_jobs.create_job(db, current_user.id, items)
+        db.commit()
+        return job.id
 
-    return StreamingResponse(stream_output(), media_type="text/plain")
+    job_id = await run_in_threadpool(submit)
+    batch_worker.wake()
+    return {"job_id": job_id, "total": len(items), "status": "queued"}
+
+
+@app.get("/api/batch")
+def list_batches(current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
+    jobs = db.query(BatchJob).filter(BatchJob.user_id == current_user.id).order_by(BatchJob.id.desc()).limit(50).all()
+    return [batch_jobs.job_to_dict(job) for job in jobs]
+
+
+@app.get("/api/batch/{job_id}")
+def get_batch(job_id: int, items: bool = False, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Progress of a batch job; items=true adds each prompt's status and post_id."""
+    job = db.query(BatchJob).filter(BatchJob.id == job_id, BatchJob.user_id == current_user.id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Batch job not found")
+    rows = db.query(BatchItem).filter(BatchItem.job_id == job.id).order_by(BatchItem.idx).all() if items else None
+    return batch_jobs.job_to_dict(job, rows)
+
+
+@app.post("/api/batch/{job_id}/cancel")
+def cancel_batch(job_id: int, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
+    job = db.query(BatchJob).filter(BatchJob.id == job_id, BatchJob.user_id == current_user.id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Batch job not found")
+    if job.status in ("completed", "cancelled"):
+        raise HTTPException(status_code=409, detail=f"Batch job is already {job.status}")
+    batch_jobs.cancel_job(db, job)
+    db.commit()
+    return batch_jobs.job_to_dict(job)
+
+
+@app.post("/api/batch/{job_id}/resume")
+def resume_batch(job_id: int, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
+    job = db.query(BatchJob).filter(BatchJob.id == job_id, BatchJob.user_id == current_user.id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Batch job not found")
+    if job.status != "stopped":
+        raise HTTPException(status_code=409, detail=f"Only stopped jobs can be resumed (this one is {job.status})")
+    batch_jobs.resume_job(db, job)
+    db.commit()
+    batch_worker.wake()
+    return batch_jobs.job_to_dict(job)
+
+
+# ------------------- ROUTES: IMAGES -------------------
+def asset_url(http_request: Request, digest: str) -> str:
+    if images.IMAGE_PUBLIC_URL:
+        return f"{images.IMAGE_PUBLIC_URL}/{digest}.png"
+    return str(http_request.url_for("get_asset", digest=digest))
+
+
+def image_job_body(http_request: Request, job: ImageJob) -> dict:
+    data = images.job_to_dict(job)
+    if job.digest:
+        data["imageUrl"] = asset_url(http_request, job.digest)
+    return data
+
+
+@app.post("/api/generate_image")
+async def generate_image(request: ImageRequest, http_request: Request, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Answer a prompt seen before straight from the asset cache; otherwise queue
+    a job and reply 202 with the status_url to poll (or stream) until it is done."""
+    if not request.prompt.strip():
+        raise HTTPException(status_code=400, detail="Prompt is empty")
+    generator = images.image_generator
+    key = generator.request_key(request.prompt)
+    digest = await run_in_threadpool(generator.store.lookup, key)
+    if digest:
+        return {"status": "done", "cached": True, "imageUrl": asset_url(http_request, digest)}
+    if not generator.backend.configured:
+        raise HTTPException(status_code=503, detail="Image generation is not configured")
+    # Joining a generation of the same prompt that is already running costs nothing
+    charged = not generator.in_flight(key)
+
+    def submit():
+        if charged and credits.reserve_credit(db, current_user.id) is None:
+            return None
+        job = generator.create_job(db, current_user.id, key, charged)
+        db.commit()
+        return job.id
+
+    job_id = await run_in_threadpool(submit)
+    if job_id is None:
+        return JSONResponse({"error": "No credits left. Upgrade your plan.", "redirect": "/pricing"}, status_code=403)
+    if charged:
+        await auth_cache.ainvalidate(current_user.email)
+    generator.start(job_id, key, request.prompt)
+    status_url = str(http_request.url_for("image_job_status", job_id=job_id))
+    return JSONResponse(
+        {"job_id": job_id, "status": "queued", "cached": False, "status_url": status_url},
+        status_code=202,
+        headers={"Location": status_url},
+    )
+
+
+@app.get("/api/generate_image/{job_id}")
+async def image_job_status(job_id: str, http_request: Request, current_user: Principal = Depends(get_current_user)):
+    """The job as JSON, or with Accept: text/event-stream a "status" event on every
+    change until it is done or failed."""
+
+    def load():
+        with session_scope() as db:
+            job = db.query(ImageJob).filter(ImageJob.id == job_id, ImageJob.user_id == current_user.id).first()
+            if job is not None:
+                images.expire_stale(db, job)
+                return image_job_body(http_request, job)
+
+    data = await run_in_threadpool(load)
+    if data is None:
+        raise HTTPException(status_code=404, detail="Image job not found")
+    if "text/event-stream" not in http_request.headers.get("accept", ""):
+        return data
+
+    async def events():
+        nonlocal data
+        last = None
+        while True:
+            if data["status"] != last:
+                last = data["status"]
+                yield format_event(job_id, None, "status", data)
+            if last not in images.ACTIVE_STATUSES or await http_request.is_disconnected():
+                return
+            await asyncio.sleep(0.5)
+            data = await run_in_threadpool(load)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+@app.api_route("/api/assets/{digest}.png", methods=["GET", "HEAD"])
+def get_asset(digest: str, http_request: Request):
+    """A generated image by content digest; public, immutable, and range-capable."""
+    if not images.is_digest(digest):
+        raise HTTPException(status_code=404, detail="Asset not found")
+    path = images.image_generator.store.path(digest)
+    etag = f'"{digest}"'
+    headers = {"Cache-Control": images.ASSET_CACHE_CONTROL, "ETag": etag}
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Asset not found")
+    if chat_store.etag_matches(http_request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type="image/png", headers=headers)
 
 
 # ------------------- ROUTES: SOCIAL MEDIA -------------------
-# This is a placeholder for social media posting logic.
-# it would need to implement OAuth 2.0 flows for each platform
-# to securely authenticate and get user-specific access tokens.
-@app.post("/api/social/post")
-def post_to_social(request: SocialPostRequest, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    # Here it would add the logic to interact with each social media platform's API
-    # based on the 'platform' field in the request.
-    try:
-        # For demonstration purposes, we'll just check the platform and return a success message.
-        if request.platform == "facebook":
-            # facebook_api.post(request.content)
-            # it would need to add error handling and proper API calls here.
-            message = f"✅ Content successfully posted to Facebook for user {current_user.email}."
-        elif request.platform == "twitter":
-            # twitter_api.post_tweet(request.content)
-            message = f"✅ Content successfully posted to Twitter for user {current_user.email}."
-        elif request.platform == "linkedin":
-            # linkedin_api.share(request.content)
-            message = f"✅ Content successfully posted to LinkedIn for user {current_user.email}."
-        elif request.platform == "instagram":
-            # instagram_api.post(request.content)
-            message = f"✅ Content successfully posted to Instagram for user {current_user.email}."
-        else:
-            raise HTTPException(status_code=400, detail="Invalid social media platform specified.")
-
-        # Update the post in the database to reflect the social media share
-        db_post = db.query(Post).filter(Post.id == request.post_id, Post.user_id == current_user.id).first()
-        if db_post:
-            messages = json.loads(db_post.messages)
-            messages.append({"role": "system", "content": message})
-            db_post.messages = json.dumps(messages)
-            db.commit()
-            db.refresh(db_post)
+# Deliveries are published by social_publisher through per-platform adapters; without
+# relay URLs configured those are mocks, until the OAuth flows for each platform exist.
+@app.post("/api/social/post", status_code=202)
+def post_to_social(request: SocialPostRequest, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Queue the content for every requested platform, now or at scheduled_at.
+    Progress is in GET /api/social/deliveries and, once settled, the post's history."""
+    platforms = list(dict.fromkeys((request.platforms or []) + ([request.platform] if request.platform else [])))
+    if not platforms or any(p not in social_publisher.adapters for p in platforms):
+        raise HTTPException(status_code=400, detail="Invalid social media platform specified.")
+    if not request.content.strip():
+        raise HTTPException(status_code=400, detail="Content is empty")
+    too_long = [p for p in platforms if len(request.content) > social.PLATFORM_MAX_CHARS[p]]
+    if too_long:
+        raise HTTPException(status_code=400, detail=f"Content is too long for {', '.join(social.PLATFORM_NAMES[p] for p in too_long)}")
+    run_at = datetime.utcnow()
+    if request.scheduled_at is not None:
+        scheduled = request.scheduled_at
+        if scheduled.tzinfo is not None:
+            scheduled = scheduled.astimezone(timezone.utc).replace(tzinfo=None)
+        run_at = max(run_at, scheduled)
+
+    db_post = db.query(Post).filter(Post.id == request.post_id, Post.user_id == current_user.id).first()
+    if not db_post:
+        raise HTTPException(status_code=404, detail="Post not found")
+    deliveries = social.create_deliveries(db, current_user.id, db_post.id, platforms, request.content, run_at)
+    db.commit()
+    social_publisher.wake()
+    names = ", ".join(social.PLATFORM_NAMES[p] for p in platforms)
+    when = "scheduled" if request.scheduled_at is not None and run_at > datetime.utcnow() else "queued"
+    return {
+        "message": f"Post {when} for {names}.",
+        "deliveries": [social.delivery_to_dict(d) for d in deliveries],
+    }
 
-        return {"message": message}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to post to social media: {e}")
+
+@app.get("/api/social/deliveries")
+def list_deliveries(post_id: Optional[int] = None, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
+    query = db.query(SocialDelivery).filter(SocialDelivery.user_id == current_user.id)
+    if post_id is not None:
+        query = query.filter(SocialDelivery.post_id == post_id)
+    return [social.delivery_to_dict(d) for d in query.order_by(SocialDelivery.id.desc()).limit(100).all()]
+
+
+@app.post("/api/social/deliveries/{delivery_id}/cancel")
+def cancel_delivery(delivery_id: int, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Cancel a delivery that hasn't gone out yet (scheduled, or waiting to retry)."""
+    cancelled = db.query(SocialDelivery).filter(
+        SocialDelivery.id == delivery_id,
+        SocialDelivery.user_id == current_user.id,
+        SocialDelivery.status == "pending",
+    ).update({"status": "cancelled"}, synchronize_session=False)
+    db.commit()
+    delivery = db.query(SocialDelivery).filter(SocialDelivery.id == delivery_id, SocialDelivery.user_id == current_user.id).first()
+    if not delivery:
+        raise HTTPException(status_code=404, detail="Delivery not found")
+    if not cancelled:
+        raise HTTPException(status_code=409, detail=f"Delivery is already {delivery.status}")
+    return social.delivery_to_dict(delivery)
 
 
 # ------------------- MAIN -------------------
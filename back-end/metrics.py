@@ -0,0 +1,353 @@
+"""Request-level metrics in the Prometheus text format, served at /metrics.
+
+prometheus_client isn't a dependency; the two metric types we record
+(counters and fixed-bucket histograms) are small enough to keep here, and
+each component's existing stats() dict is exposed alongside as gauges.
+
+Counters are exact. Histogram observations can be sampled with
+METRICS_SAMPLE_RATE: a kept observation counts for 1/rate, so _count and
+_sum stay unbiased estimates while most requests skip the bookkeeping.
+"""
+import bisect
+import os
+import random
+import threading
+import time
+from contextvars import ContextVar
+from typing import Callable, Dict, Optional, Tuple
+
+from sqlalchemy import event
+
+# ------------------- CONFIG -------------------
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+# Share of requests, generations and queries whose timings are recorded
+METRICS_SAMPLE_RATE = float(os.getenv("METRICS_SAMPLE_RATE", "1.0"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+# Query counts and time of the request being served; a mutable dict so
+# threadpool work (which runs in a copy of the context) adds to the same one
+_request_db: ContextVar[Optional[dict]] = ContextVar("request_db", default=None)
+
+
+def sample() -> float:
+    """Weight to record this event with, or 0.0 to skip it."""
+    if not METRICS_ENABLED:
+        return 0.0
+    rate = METRICS_SAMPLE_RATE
+    if rate >= 1.0:
+        return 1.0
+    return 1.0 / rate if rate > 0 and random.random() < rate else 0.0
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+# ------------------- METRIC TYPES -------------------
+class Counter:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels: tuple = (), amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            yield f"{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}"
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # label values -> per-bucket counts (last one is +Inf), then sum and count
+        self._series: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, labels: tuple = (), weight: float = 1.0):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0.0] * (len(self.buckets) + 3)
+            series[index] += weight
+            series[-2] += value * weight
+            series[-1] += weight
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            series = sorted((labels, list(values)) for labels, values in self._series.items())
+        for labels, values in series:
+            cumulative = 0.0
+            for bound, count in zip(self.buckets + (float("inf"),), values):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                yield f"{self.name}_bucket{_format_labels(self.labels, labels, le)} {_format_value(cumulative)}"
+            yield f"{self.name}_sum{_format_labels(self.labels, labels)} {_format_value(values[-2])}"
+            yield f"{self.name}_count{_format_labels(self.labels, labels)} {_format_value(values[-1])}"
+
+
+# ------------------- REGISTRY -------------------
+_metrics = []
+_collectors: Dict[str, Tuple[Callable[[], dict], Optional[str]]] = {}
+STARTED_AT = time.time()
+_in_flight = 0
+
+
+def counter(name: str, help: str, labels: Tuple[str, ...] = ()) -> Counter:
+    metric = Counter(name, help, labels)
+    _metrics.append(metric)
+    return metric
+
+
+def histogram(name: str, help: str, labels: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS) -> Histogram:
+    metric = Histogram(name, help, labels, buckets)
+    _metrics.append(metric)
+    return metric
+
+
+def register_stats(prefix: str, stats: Callable[[], dict], label: Optional[str] = None):
+    """Expose a component's stats() dict as gauges named <prefix>_<key>.
+
+    Numbers and booleans become samples, strings are skipped. A nested dict
+    of dicts (per-route stats, say) becomes one series per entry, labelled
+    `label`; other nested dicts extend the name.
+    """
+    _collectors[prefix] = (stats, label)
+
+
+def _flatten(prefix: str, stats: dict, label: Optional[str], out: Dict[str, list], labels: tuple = ()):
+    for key, value in stats.items():
+        name = f"{prefix}_{key}"
+        if isinstance(value, bool):
+            out.setdefault(name, []).append((labels, int(value)))
+        elif isinstance(value, (int, float)):
+            out.setdefault(name, []).append((labels, value))
+        elif isinstance(value, dict):
+            if label and value and all(isinstance(v, dict) for v in value.values()):
+                for entry, nested in value.items():
+                    _flatten(name, nested, None, out, labels + ((label, entry),))
+            else:
+                _flatten(name, value, label, out, labels)
+
+
+def render() -> str:
+    lines = [
+        "# HELP process_start_time_seconds Start time of the process since the epoch.",
+        "# TYPE process_start_time_seconds gauge",
+        f"process_start_time_seconds {STARTED_AT:.3f}",
+        "# HELP http_requests_in_flight Requests being served by this worker, streams included.",
+        "# TYPE http_requests_in_flight gauge",
+        f"http_requests_in_flight {_in_flight}",
+    ]
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for prefix, (stats, label) in _collectors.items():
+        gauges: Dict[str, list] = {}
+        try:
+            _flatten(f"app_{prefix}", stats(), label, gauges)
+        except Exception as e:
+            print(f"Metrics collector {prefix} error: {e}")
+            continue
+        for name, samples in gauges.items():
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in samples:
+                names, values = zip(*labels) if labels else ((), ())
+                lines.append(f"{name}{_format_labels(names, values)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# ------------------- HTTP -------------------
+HTTP_REQUESTS = counter("http_requests_total", "Requests served, by route template and status.", ("method", "route", "status"))
+HTTP_DURATION = histogram(
+    "http_request_duration_seconds",
+    "Time from the request arriving to the last byte of its response.",
+    ("method", "route", "status"),
+)
+HTTP_FIRST_BYTE = histogram(
+    "http_response_first_byte_seconds",
+    "Time from the request arriving to the first byte of its response body.",
+    ("method", "route"),
+)
+HTTP_DB_SECONDS = histogram(
+    "http_request_db_seconds", "Time spent in database queries per request.", ("method", "route"), QUERY_BUCKETS
+)
+HTTP_DB_QUERIES = histogram(
+    "http_request_db_queries", "Database queries issued per request.", ("method", "route"), COUNT_BUCKETS
+)
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request by method, route template and status.
+
+    Streaming responses are timed to their last chunk, so a generation's
+    duration is the whole stream, and its first-byte time is separate.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        weight = sample()
+        db = {"seconds": 0.0, "queries": 0} if weight else None
+        token = _request_db.set(db)
+        response = {"status": 500, "first_byte": None}
+
+        async def send_timed(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+            elif message["type"] == "http.response.body" and response["first_byte"] is None:
+                response["first_byte"] = time.perf_counter() - started
+            await send(message)
+
+        global _in_flight
+        _in_flight += 1
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            _in_flight -= 1
+            _request_db.reset(token)
+            # Label by the matched template, never the raw path, to bound cardinality
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            method = scope["method"]
+            status = str(response["status"])
+            HTTP_REQUESTS.inc((method, route, status))
+            if weight:
+                HTTP_DURATION.observe(time.perf_counter() - started, (method, route, status), weight)
+                if response["first_byte"] is not None:
+                    HTTP_FIRST_BYTE.observe(response["first_byte"], (method, route), weight)
+                HTTP_DB_SECONDS.observe(db["seconds"], (method, route), weight)
+                HTTP_DB_QUERIES.observe(db["queries"], (method, route), weight)
+
+
+# ------------------- DATABASE -------------------
+DB_QUERY_SECONDS = histogram("db_query_duration_seconds", "Time per database statement, by statement type.", ("operation",), QUERY_BUCKETS)
+DB_QUERIES = counter("db_queries_total", "Database statements executed, by statement type.", ("operation",))
+
+
+def _operation(statement: str) -> str:
+    head = statement.lstrip()[:8].split(None, 1)
+    return head[0].upper() if head else "OTHER"
+
+
+def instrument_engine(engine):
+    """Time every statement through the engine's cursor events (the
+    conn.info stack is SQLAlchemy's own profiling recipe)."""
+    @event.listens_for(engine, "before_cursor_execute")
+    def _start(conn, cursor, statement, parameters, context, executemany):
+        if METRICS_ENABLED:
+            conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _finish(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get("query_started")
+        if not started:
+            return
+        elapsed = time.perf_counter() - started.pop()
+        operation = _operation(statement)
+        DB_QUERIES.inc((operation,))
+        request = _request_db.get()
+        if request is not None:
+            request["seconds"] += elapsed
+            request["queries"] += 1
+        weight = sample()
+        if weight:
+            DB_QUERY_SECONDS.observe(elapsed, (operation,), weight)
+
+    @event.listens_for(engine, "handle_error")
+    def _error(exception_context):
+        # A failed statement never reaches after_cursor_execute
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("query_started"):
+            conn.info["query_started"].pop()
+
+
+# ------------------- GENERATION -------------------
+GENERATIONS = counter("generations_total", "Generations finished, by source and outcome.", ("mode", "source", "outcome"))
+GENERATION_BYTES = counter("generation_output_bytes_total", "UTF-8 bytes of generated text sent.", ("mode", "source"))
+GENERATION_TOKENS = counter("generation_output_tokens_total", "Completion tokens generated.", ("mode", "source"))
+GENERATION_QUEUE_WAIT = histogram(
+    "generation_queue_wait_seconds", "Time a generation waited in admission control for an upstream slot."
+)
+GENERATION_TTFT = histogram(
+    "generation_time_to_first_token_seconds",
+    "Time from the generation request arriving to its first token.",
+    ("mode", "source"),
+)
+GENERATION_DURATION = histogram(
+    "generation_duration_seconds",
+    "Time from the generation request arriving to its last token.",
+    ("mode", "source", "outcome"),
+)
+GENERATION_TOKEN_COUNT = histogram(
+    "generation_output_tokens", "Completion tokens per generation.", ("mode", "source"), COUNT_BUCKETS
+)
+UPSTREAM_FIRST_BYTE = histogram(
+    "llm_upstream_first_byte_seconds", "Time from opening an upstream stream to its first chunk, by route.", ("route",)
+)
+
+
+class GenerationTimer:
+    """Timings of one generation: admission wait, first token, duration and output size."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.weight = sample()
+        self.mode = "text"
+        self.source = "upstream"
+        self.first_token: Optional[float] = None
+        self.bytes = 0
+
+    def admitted(self):
+        if self.weight:
+            GENERATION_QUEUE_WAIT.observe(time.perf_counter() - self.started, (), self.weight)
+
+    def chunk(self, content: str):
+        if self.first_token is None:
+            self.first_token = time.perf_counter() - self.started
+        self.bytes += len(content.encode("utf-8"))
+
+    def finish(self, outcome: str, tokens: int):
+        labels = (self.mode, self.source)
+        GENERATIONS.inc(labels + (outcome,))
+        GENERATION_BYTES.inc(labels, self.bytes)
+        GENERATION_TOKENS.inc(labels, tokens)
+        if not self.weight:
+            return
+        GENERATION_DURATION.observe(time.perf_counter() - self.started, labels + (outcome,), self.weight)
+        GENERATION_TOKEN_COUNT.observe(tokens, labels, self.weight)
+        if self.first_token is not None:
+            GENERATION_TTFT.observe(self.first_token, labels, self.weight)
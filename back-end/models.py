@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, Float, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, DateTime, Float, Boolean, ForeignKey, UniqueConstraint, Index, LargeBinary
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from database import Base
@@ -37,6 +38,8 @@ class UsageRecord(Base):
 class Transaction(Base):
     """Track all payments and charges"""
     __tablename__ = "transactions"
+    # At most one transaction per webhook event, whoever applies it
+    __table_args__ = (Index("ix_transactions_event_id", "event_id", unique=True),)
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -46,23 +49,163 @@ class Transaction(Base):
     status = Column(String, nullable=False)  # succeeded, pending, failed
     plan_name = Column(String, nullable=True)  # which plan was purchased
     description = Column(String, nullable=True)
+    event_id = Column(Integer, ForeignKey("webhook_events.id"), nullable=True)  # the webhook it came from
     created_at = Column(DateTime, default=datetime.utcnow)
     
     user = relationship("User", back_populates="transactions")
 
+class WebhookEvent(Base):
+    """Inbox of payment webhooks, stored as received and applied later by webhooks.WebhookConsumer"""
+    __tablename__ = "webhook_events"
+    __table_args__ = (
+        # Provider retries of the same event land on the same row
+        UniqueConstraint("source", "event_key", name="uq_webhook_events_source_event_key"),
+        # Serves the consumer: pending events, oldest first
+        Index("ix_webhook_events_status_id", "status", "id"),
+        # Serves the newest-sale-wins check
+        Index("ix_webhook_events_email_sale_at", "email", "sale_at"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    source = Column(String(20), nullable=False)  # "gumroad"
+    event_key = Column(String(100), nullable=False)  # sale_id, or a digest of the payload without one
+    email = Column(String, nullable=True)
+    sale_at = Column(DateTime, nullable=True)  # when the provider says it happened, not when it arrived
+    payload = Column(Text, nullable=False)  # JSON of the form fields
+    # pending -> applied | superseded (a newer sale already set the plan) | failed
+    status = Column(String(20), nullable=False, default="pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    error = Column(Text, nullable=True)
+    received_at = Column(DateTime, default=datetime.utcnow)
+    applied_at = Column(DateTime, nullable=True)
+
 class Post(Base):
     __tablename__ = "posts"
+    # Serves the sidebar listing: WHERE user_id = ? ORDER BY created_at DESC, id DESC
+    __table_args__ = (Index("ix_posts_user_id_created_at", "user_id", "created_at"),)
+
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
 
     # Chat/Content fields
     title = Column(String(200), default="Untitled Chat")   # user can rename
-    messages = Column(Text, nullable=False)  # store chat history as JSON string
+
+    # Rolling summary of the turns before summary_seq, used when they no longer fit the context budget
+    summary = Column(Text, nullable=True)
+    summary_seq = Column(Integer, default=0)
 
     # Social
     shared_linkedin = Column(Boolean, default=False)
     shared_twitter = Column(Boolean, default=False)
     shared_facebook = Column(Boolean, default=False)
 
+    # Bumped on every change to the title or history; the post's ETag
+    version = Column(Integer, nullable=False, default=1)
+
+    # Set while the history past the first message lives in post_archives (see archive.py)
+    archived_at = Column(DateTime, nullable=True)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class Message(Base):
+    """One entry of a post's chat history, appended in seq order"""
+    __tablename__ = "messages"
+    __table_args__ = (UniqueConstraint("post_id", "seq", name="uq_messages_post_id_seq"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    post_id = Column(Integer, ForeignKey("posts.id", ondelete="CASCADE"), nullable=False)
+    seq = Column(Integer, nullable=False)  # position within the post, starting at 0
+    role = Column(String(20), nullable=False)
+    content = Column(Text, nullable=False)
+    token_count = Column(Integer, nullable=True)  # cached for context assembly; filled lazily for old rows
+    extra = Column(Text, nullable=True)  # JSON of any other client keys (e.g. imageUrl)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class PostArchive(Base):
+    """A cold post's messages as one compressed blob, written by archive.compact and read back by archive.rehydrate"""
+    __tablename__ = "post_archives"
+
+    post_id = Column(Integer, ForeignKey("posts.id", ondelete="CASCADE"), primary_key=True)
+    codec = Column(String(10), nullable=False)  # zstd | zlib
+    data = Column(LargeBinary, nullable=False)  # JSON array of archive.FIELDS rows, compressed
+    message_count = Column(Integer, nullable=False)
+    raw_bytes = Column(Integer, nullable=False)
+    stored_bytes = Column(Integer, nullable=False)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+    # PostgreSQL's search index over the archived messages (search.index_archive); SQLite uses archives_fts
+    search_vector = Column(Text().with_variant(TSVECTOR(), "postgresql"), nullable=True)
+
+class BatchJob(Base):
+    """A JSONL batch of prompts generated in the background into Post rows"""
+    __tablename__ = "batch_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    # queued -> running -> completed; stopped (out of credits, resumable) or cancelled
+    status = Column(String(20), nullable=False, default="queued")
+    total = Column(Integer, nullable=False, default=0)
+    completed = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class BatchItem(Base):
+    """One prompt of a batch; its status is the job's checkpoint"""
+    __tablename__ = "batch_items"
+    __table_args__ = (
+        UniqueConstraint("job_id", "idx", name="uq_batch_items_job_id_idx"),
+        # Serves the dispatcher: pending items, oldest job first
+        Index("ix_batch_items_status_job_id", "status", "job_id"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(Integer, ForeignKey("batch_jobs.id", ondelete="CASCADE"), nullable=False)
+    idx = Column(Integer, nullable=False)  # line number within the submitted JSONL
+    prompt = Column(Text, nullable=False)
+    title = Column(String(200), nullable=True)
+    # pending -> running (credit reserved) -> done | failed; skipped when the job is cancelled
+    status = Column(String(20), nullable=False, default="pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    post_id = Column(Integer, ForeignKey("posts.id", ondelete="SET NULL"), nullable=True)
+    error = Column(Text, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+class ImageJob(Base):
+    """An image generation, run in the background by images.ImageGenerator and polled by the client"""
+    __tablename__ = "image_jobs"
+
+    id = Column(String(32), primary_key=True)  # random, so job URLs can't be enumerated
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    # queued -> running -> done | failed
+    status = Column(String(20), nullable=False, default="queued")
+    request_key = Column(String(64), nullable=False)  # images.make_key of prompt and parameters
+    digest = Column(String(64), nullable=True)  # the asset, once done
+    charged = Column(Boolean, nullable=False, default=False)  # a credit was reserved, refunded on failure
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+class SocialDelivery(Base):
+    """One post shared to one platform, published by social.SocialPublisher"""
+    __tablename__ = "social_deliveries"
+    __table_args__ = (
+        # Serves the publisher: pending deliveries that are due
+        Index("ix_social_deliveries_status_run_at", "status", "run_at"),
+        Index("ix_social_deliveries_post_id", "post_id"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    post_id = Column(Integer, ForeignKey("posts.id", ondelete="CASCADE"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    platform = Column(String(20), nullable=False)
+    content = Column(Text, nullable=False)
+    # pending -> sending -> sent | failed (out of attempts or refused); cancelled while still pending
+    status = Column(String(20), nullable=False, default="pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    run_at = Column(DateTime, nullable=False, default=datetime.utcnow)  # scheduled time, or when to retry
+    external_id = Column(String, nullable=True)  # the platform's id for the published post
+    error = Column(Text, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
\ No newline at end of file
+    sent_at = Column(DateTime, nullable=True)
@@ -0,0 +1,209 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import AsyncIterator, List, Optional
+
+from fastapi.concurrency import run_in_threadpool
+
+try:
+    import redis
+except ImportError:  # optional: only needed for the redis backend
+    redis = None
+
+from auth_cache import MemoryBackend
+
+# ------------------- CONFIG -------------------
+# Opt-in: the same prompt then gets the same answer until the entry expires
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND", "memory")  # memory | sqlite | redis
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "86400"))  # seconds
+RESPONSE_CACHE_MAX_SIZE = int(os.getenv("RESPONSE_CACHE_MAX_SIZE", "5000"))
+RESPONSE_CACHE_SQLITE_PATH = os.getenv("RESPONSE_CACHE_SQLITE_PATH", "response_cache.db")
+RESPONSE_CACHE_REDIS_URL = os.getenv("RESPONSE_CACHE_REDIS_URL", "redis://localhost:6379/0")
+# Hits are replayed in chunks of this many characters so clients render them like a live stream
+RESPONSE_CACHE_CHUNK_CHARS = int(os.getenv("RESPONSE_CACHE_CHUNK_CHARS", "48"))
+REDIS_KEY_PREFIX = "response:"
+
+
+# ------------------- KEYS -------------------
+def _normalize(text: str) -> str:
+    """Fold the differences that don't change a prompt's meaning: Unicode form and whitespace."""
+    return " ".join(unicodedata.normalize("NFC", text or "").split())
+
+
+def make_key(messages: List[dict], model: str, **params) -> str:
+    """Hash of everything that determines the answer: model, sampling parameters
+    and the full message list, system prompt included."""
+    payload = {
+        "model": model,
+        "params": params,
+        "messages": [[m["role"], _normalize(m["content"])] for m in messages],
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+# ------------------- BACKENDS -------------------
+class SQLiteBackend:
+    """On-disk LRU shared by the workers of one host; survives restarts."""
+
+    def __init__(self, path: str, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS response_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, used_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_response_cache_used_at ON response_cache (used_at)")
+
+    def get(self, key: str) -> Optional[dict]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires_at FROM response_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self._conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE response_cache SET used_at = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def set(self, key: str, entry: dict):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, value, expires_at, used_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(entry), now + self.ttl, now),
+            )
+            overflow = self._conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0] - self.max_size
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM response_cache WHERE key IN "
+                    "(SELECT key FROM response_cache ORDER BY used_at LIMIT ?)",
+                    (overflow,),
+                )
+                self.evictions += overflow
+
+    def delete(self, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM response_cache")
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+
+
+class RedisBackend:
+    """Shared across hosts; size is bounded by Redis' own maxmemory/LRU policy."""
+
+    def __init__(self, url: str, ttl: float):
+        if redis is None:
+            raise RuntimeError("RESPONSE_CACHE_BACKEND=redis but the redis package is not installed")
+        self.client = redis.Redis.from_url(url, socket_timeout=0.2)
+        self.ttl = ttl
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[dict]:
+        raw = self.client.get(REDIS_KEY_PREFIX + key)
+        return json.loads(raw) if raw else None
+
+    def set(self, key: str, entry: dict):
+        self.client.set(REDIS_KEY_PREFIX + key, json.dumps(entry), px=int(self.ttl * 1000))
+
+    def delete(self, key: str):
+        self.client.delete(REDIS_KEY_PREFIX + key)
+
+    def clear(self):
+        for key in self.client.scan_iter(REDIS_KEY_PREFIX + "*"):
+            self.client.delete(key)
+
+    # No __len__: counting the shared keyspace means a SCAN on every /metrics scrape
+
+
+# ------------------- CACHE -------------------
+class ResponseCache:
+    def __init__(self, backend, enabled: bool = True):
+        self.backend = backend
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.latency_saved = 0.0  # seconds of upstream time not spent thanks to hits
+
+    async def _call(self, fn, *args):
+        # Only the in-process LRU is cheap enough to touch on the event loop
+        if isinstance(self.backend, MemoryBackend):
+            return fn(*args)
+        return await run_in_threadpool(fn, *args)
+
+    async def get(self, key: str) -> Optional[dict]:
+        """Return the cached entry ({"content", "upstream_seconds"}) or None."""
+        if not self.enabled:
+            return None
+        try:
+            entry = await self._call(self.backend.get, key)
+        except Exception as e:
+            print(f"Response cache read error: {e}")
+            entry = None
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.latency_saved += entry.get("upstream_seconds", 0.0)
+        return entry
+
+    async def set(self, key: str, content: str, upstream_seconds: float):
+        """Store a complete answer; partial or failed streams must not be cached."""
+        if not self.enabled or not content:
+            return
+        try:
+            await self._call(self.backend.set, key, {"content": content, "upstream_seconds": upstream_seconds})
+            self.stores += 1
+        except Exception as e:
+            print(f"Response cache write error: {e}")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "backend": type(self.backend).__name__,
+            "size": len(self.backend) if hasattr(self.backend, "__len__") else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "stores": self.stores,
+            "evictions": self.backend.evictions,
+            "latency_saved_seconds": round(self.latency_saved, 3),
+        }
+
+
+async def replay(content: str, chunk_chars: int = RESPONSE_CACHE_CHUNK_CHARS) -> AsyncIterator[str]:
+    """Yield a cached answer chunk by chunk, yielding to the event loop in between."""
+    for start in range(0, len(content), chunk_chars):
+        yield content[start:start + chunk_chars]
+        await asyncio.sleep(0)
+
+
+def _make_cache() -> ResponseCache:
+    if RESPONSE_CACHE_BACKEND == "sqlite":
+        backend = SQLiteBackend(RESPONSE_CACHE_SQLITE_PATH, RESPONSE_CACHE_MAX_SIZE, RESPONSE_CACHE_TTL)
+    elif RESPONSE_CACHE_BACKEND == "redis":
+        backend = RedisBackend(RESPONSE_CACHE_REDIS_URL, RESPONSE_CACHE_TTL)
+    else:
+        backend = MemoryBackend(RESPONSE_CACHE_MAX_SIZE, RESPONSE_CACHE_TTL)
+    return ResponseCache(backend, enabled=RESPONSE_CACHE_ENABLED)
+
+
+response_cache = _make_cache()
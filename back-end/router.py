@@ -0,0 +1,313 @@
+import asyncio
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from typing import AsyncIterator, List, Optional
+
+import llm
+import metrics
+
+# ------------------- CONFIG -------------------
+# Routes are tried in order. LLM_ROUTES (or LLM_ROUTES_FILE) holds a JSON list like
+#   [{"name": "mistral", "model": "mistralai/mistral-small-3.2-24b-instruct:free"},
+#    {"name": "backup", "model": "gpt-4o-mini", "base_url": "https://api.openai.com/v1",
+#     "api_key_env": "OPENAI_API_KEY", "max_concurrency": 50}]
+# Without it: OPENROUTER_MODEL first, then the comma separated LLM_FALLBACK_MODELS on OpenRouter.
+LLM_ROUTES = os.getenv("LLM_ROUTES")
+LLM_ROUTES_FILE = os.getenv("LLM_ROUTES_FILE")
+LLM_FALLBACK_MODELS = os.getenv("LLM_FALLBACK_MODELS", "")
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "100"))  # per route unless the route sets its own
+# Give up on a route (and fail over) when it hasn't produced a token within this many seconds
+LLM_FIRST_BYTE_TIMEOUT = float(os.getenv("LLM_FIRST_BYTE_TIMEOUT", "15"))
+# Hedging: start the next route too if the first token hasn't arrived after this many seconds; 0 disables
+LLM_HEDGE_AFTER = float(os.getenv("LLM_HEDGE_AFTER", "0"))
+# Circuit breaker: open after this many consecutive failures, probe again after the cooldown
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+
+
+class NoRouteAvailable(Exception):
+    """Every route failed, timed out or has its breaker open."""
+
+
+# ------------------- CIRCUIT BREAKER -------------------
+class CircuitBreaker:
+    """closed -> open after `failures` consecutive errors -> half-open (one trial) after `cooldown`."""
+
+    def __init__(self, failures: int = LLM_BREAKER_FAILURES, cooldown: float = LLM_BREAKER_COOLDOWN):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_running = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        return state == "closed" or (state == "half_open" and not self._trial_running)
+
+    def start(self):
+        """A request is going out; in half-open state it is the single trial."""
+        if self.state == "half_open":
+            self._trial_running = True
+
+    def cancel(self):
+        """The request ended without a verdict (a hedging loser); let another trial through."""
+        self._trial_running = False
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._trial_running = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        self._trial_running = False
+        if self.opened_at is not None or self.consecutive_failures >= self.failures:
+            self.opened_at = time.monotonic()
+
+
+# ------------------- ROUTES -------------------
+@dataclass
+class Route:
+    name: str
+    model: str
+    base_url: Optional[str] = None
+    api_key: Optional[str] = None
+    max_concurrency: int = LLM_MAX_CONCURRENCY
+    breaker: CircuitBreaker = field(default_factory=CircuitBreaker)
+    slots: asyncio.Semaphore = None
+    successes: int = 0
+    failures: int = 0
+    timeouts: int = 0
+    hedges_won: int = 0
+
+    def __post_init__(self):
+        self.slots = asyncio.Semaphore(self.max_concurrency)
+
+    @property
+    def inflight(self) -> int:
+        return self.max_concurrency - self.slots._value
+
+    def stats(self) -> dict:
+        return {
+            "model": self.model,
+            "breaker": self.breaker.state,
+            "inflight": self.inflight,
+            "max_concurrency": self.max_concurrency,
+            "successes": self.successes,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "hedges_won": self.hedges_won,
+        }
+
+
+def load_routes() -> List[Route]:
+    raw = LLM_ROUTES
+    if not raw and LLM_ROUTES_FILE:
+        with open(LLM_ROUTES_FILE) as f:
+            raw = f.read()
+    if raw:
+        routes = []
+        for spec in json.loads(raw):
+            route = Route(
+                name=spec.get("name") or spec["model"],
+                model=spec["model"],
+                base_url=spec.get("base_url"),
+                api_key=os.getenv(spec["api_key_env"]) if spec.get("api_key_env") else None,
+                max_concurrency=int(spec.get("max_concurrency", LLM_MAX_CONCURRENCY)),
+            )
+            # The OpenRouter key is never sent to another provider; refuse to start instead
+            if not route.api_key and not llm.is_openrouter(route.base_url):
+                raise ValueError(f"Route {route.name!r} points at {route.base_url} without a key; set api_key_env and that variable")
+            routes.append(route)
+        return routes
+    models = [llm.DEFAULT_MODEL] + [m.strip() for m in LLM_FALLBACK_MODELS.split(",") if m.strip()]
+    return [Route(name=model, model=model) for model in models]
+
+
+# ------------------- ROUTER -------------------
+class _Attempt:
+    """One upstream stream started on a route, waiting for its first chunk."""
+
+    def __init__(self, route: Route, messages: List[dict], params: dict, first_byte_timeout: float, hedge: bool = False):
+        self.route = route
+        self.hedge = hedge
+        self.chunks = llm.stream_chat(messages, route.model, base_url=route.base_url, api_key=route.api_key, **params)
+        self.first = asyncio.ensure_future(self.chunks.__anext__())
+        self.started = time.monotonic()
+        self.deadline = time.monotonic() + first_byte_timeout
+
+    async def close(self):
+        if not self.first.done():
+            self.first.cancel()
+        try:
+            await self.first
+        except BaseException:
+            pass
+        await self.chunks.aclose()
+        self.route.slots.release()
+
+
+class ModelRouter:
+    def __init__(
+        self,
+        routes: List[Route],
+        first_byte_timeout: float = LLM_FIRST_BYTE_TIMEOUT,
+        hedge_after: float = LLM_HEDGE_AFTER,
+    ):
+        self.routes = routes
+        self.first_byte_timeout = first_byte_timeout
+        self.hedge_after = hedge_after
+
+    @property
+    def default_model(self) -> str:
+        return self.routes[0].model
+
+    async def _acquire(self, candidates: List[Route], wait: bool) -> Optional[Route]:
+        """Take a slot on the first candidate that has one and whose breaker lets it through.
+
+        With wait=True and every allowed route saturated, queue on the first of them.
+        """
+        allowed = []
+        while candidates:
+            route = candidates.pop(0)
+            if not route.breaker.allow():
+                continue
+            if not route.slots.locked():
+                await route.slots.acquire()
+                route.breaker.start()
+                return route
+            allowed.append(route)
+        if wait and allowed:
+            await allowed[0].slots.acquire()
+            allowed[0].breaker.start()
+            return allowed[0]
+        return None
+
+    def _fail(self, attempt: _Attempt, timed_out: bool = False):
+        attempt.route.breaker.record_failure()
+        attempt.route.failures += 1
+        if timed_out:
+            attempt.route.timeouts += 1
+
+    async def stream(self, messages: List[dict], **params) -> AsyncIterator[str]:
+        """Yield content deltas from the first route that starts streaming.
+
+        A route that errors or exceeds the first-byte timeout before its first
+        token is abandoned for the next one. With hedging, the next route is
+        started alongside once hedge_after passes, and the loser is closed.
+        Errors after the first token are raised: the answer can't be restarted
+        elsewhere once part of it has been sent.
+        """
+        candidates = list(self.routes)
+        attempts: List[_Attempt] = []
+        errors = []
+        winner = None
+        first_chunk = None
+        try:
+            while winner is None:
+                if not attempts:
+                    route = await self._acquire(candidates, wait=True)
+                    if route is None:
+                        raise NoRouteAvailable("; ".join(errors) or "all circuit breakers are open")
+                    attempts.append(_Attempt(route, messages, params, self.first_byte_timeout))
+
+                now = time.monotonic()
+                timeout = min(a.deadline for a in attempts) - now
+                hedge_at = None
+                if self.hedge_after and len(attempts) == 1 and candidates:
+                    hedge_at = attempts[0].deadline - self.first_byte_timeout + self.hedge_after
+                    timeout = min(timeout, hedge_at - now)
+                done, _ = await asyncio.wait([a.first for a in attempts], timeout=max(timeout, 0), return_when=asyncio.FIRST_COMPLETED)
+
+                for attempt in list(attempts):
+                    if attempt.first not in done:
+                        continue
+                    attempts.remove(attempt)
+                    exc = attempt.first.exception()
+                    if exc is None or isinstance(exc, StopAsyncIteration):
+                        winner, first_chunk = attempt, (None if exc else attempt.first.result())
+                        break
+                    errors.append(f"{attempt.route.name}: {exc}")
+                    self._fail(attempt)
+                    await attempt.close()
+                if winner is not None:
+                    break
+
+                now = time.monotonic()
+                for attempt in [a for a in attempts if a.deadline <= now]:
+                    attempts.remove(attempt)
+                    errors.append(f"{attempt.route.name}: no first token after {self.first_byte_timeout}s")
+                    self._fail(attempt, timed_out=True)
+                    await attempt.close()
+                if hedge_at is not None and attempts and now >= hedge_at:
+                    route = await self._acquire(candidates, wait=False)
+                    if route is not None:
+                        attempts.append(_Attempt(route, messages, params, self.first_byte_timeout, hedge=True))
+
+            weight = metrics.sample()
+            if weight:
+                metrics.UPSTREAM_FIRST_BYTE.observe(time.monotonic() - winner.started, (winner.route.name,), weight)
+            if winner.hedge:
+                winner.route.hedges_won += 1
+            for attempt in attempts:
+                # Hedging losers: neither a success nor a failure for their breaker
+                attempt.route.breaker.cancel()
+                await attempt.close()
+            attempts = []
+
+            if first_chunk is not None:
+                yield first_chunk
+                try:
+                    async for content in winner.chunks:
+                        yield content
+                except Exception:
+                    self._fail(winner)
+                    raise
+            winner.route.breaker.record_success()
+            winner.route.successes += 1
+        finally:
+            # Reached early when the caller stops reading or is cancelled: no verdict for anyone
+            for attempt in attempts + ([winner] if winner is not None else []):
+                attempt.route.breaker.cancel()
+                await attempt.close()
+
+    async def complete(self, messages: List[dict], **params) -> str:
+        """Non-streaming completion with the same failover order (no hedging)."""
+        candidates = list(self.routes)
+        errors = []
+        while True:
+            route = await self._acquire(candidates, wait=True)
+            if route is None:
+                raise NoRouteAvailable("; ".join(errors) or "all circuit breakers are open")
+            try:
+                text = await llm.complete(messages, route.model, base_url=route.base_url, api_key=route.api_key, **params)
+            except Exception as e:
+                errors.append(f"{route.name}: {e}")
+                route.breaker.record_failure()
+                route.failures += 1
+                continue
+            finally:
+                route.slots.release()
+            route.breaker.record_success()
+            route.successes += 1
+            return text
+
+    def stats(self) -> dict:
+        return {
+            "first_byte_timeout": self.first_byte_timeout,
+            "hedge_after": self.hedge_after,
+            "routes": {route.name: route.stats() for route in self.routes},
+        }
+
+
+model_router = ModelRouter(load_routes())
@@ -0,0 +1,285 @@
+import html
+import os
+import re
+from typing import List, Optional, Tuple
+
+from sqlalchemy import bindparam, event, text
+from sqlalchemy.orm import Session
+
+from database import Base
+from models import Message, Post
+
+# ------------------- CONFIG -------------------
+# Title matches count this many times a message match when ranking posts
+SEARCH_TITLE_BOOST = float(os.getenv("SEARCH_TITLE_BOOST", "2.0"))
+# Words of context around a match in snippets
+SEARCH_SNIPPET_WORDS = int(os.getenv("SEARCH_SNIPPET_WORDS", "16"))
+# PostgreSQL text search configuration; inlined in SQL so the GIN indexes match
+SEARCH_TS_CONFIG = os.getenv("SEARCH_TS_CONFIG", "english")
+SEARCH_MAX_TERMS = 16
+# Shortest word* prefix; shorter ones expand to most of the vocabulary
+SEARCH_MIN_PREFIX = 3
+
+if not re.fullmatch(r"\w+", SEARCH_TS_CONFIG):
+    raise RuntimeError(f"Invalid SEARCH_TS_CONFIG: {SEARCH_TS_CONFIG!r}")
+
+# Markers the database puts around matches; replaced with <mark> after escaping
+MARK_START, MARK_END = "\x02", "\x03"
+
+# ------------------- INDEX DDL -------------------
+# SQLite: FTS5 tables filled by triggers, so every writer (generation,
+# create/update/patch, batch jobs) keeps them current. The owner column holds
+# "u<user_id>" and is matched in every query, so a search only walks the
+# user's own postings instead of filtering everyone's hits afterwards.
+SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(content, owner, post_id UNINDEXED, tokenize='porter unicode61')",
+    "INSERT INTO messages_fts(messages_fts, rank) VALUES ('rank', 'bm25(1.0, 0.0)')",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5(title, owner, tokenize='porter unicode61')",
+    "INSERT INTO posts_fts(posts_fts, rank) VALUES ('rank', 'bm25(1.0, 0.0)')",
+    """CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+        INSERT INTO messages_fts(rowid, content, owner, post_id)
+        SELECT new.id, new.content, 'u' || user_id, new.post_id FROM posts WHERE id = new.post_id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages BEGIN
+        UPDATE messages_fts SET content = new.content WHERE rowid = new.id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+        DELETE FROM messages_fts WHERE rowid = old.id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS posts_fts_insert AFTER INSERT ON posts BEGIN
+        INSERT INTO posts_fts(rowid, title, owner) VALUES (new.id, coalesce(new.title, ''), 'u' || new.user_id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS posts_fts_update AFTER UPDATE OF title ON posts BEGIN
+        UPDATE posts_fts SET title = coalesce(new.title, '') WHERE rowid = new.id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS posts_fts_delete AFTER DELETE ON posts BEGIN
+        DELETE FROM posts_fts WHERE rowid = old.id;
+    END""",
+    # Archived histories (see archive.py): one document per post, rowid = post id. Contentless, so
+    # it holds only the index, not a second copy of the text the archive compressed away
+    "CREATE VIRTUAL TABLE IF NOT EXISTS archives_fts USING fts5(content, owner, content='', tokenize='porter unicode61')",
+    "INSERT INTO archives_fts(archives_fts, rank) VALUES ('rank', 'bm25(1.0, 0.0)')",
+]
+
+# PostgreSQL: expression GIN indexes, maintained by the database on every write
+POSTGRES_DDL = [
+    f"CREATE INDEX IF NOT EXISTS ix_messages_content_fts ON messages USING GIN (to_tsvector('{SEARCH_TS_CONFIG}', content))",
+    f"CREATE INDEX IF NOT EXISTS ix_posts_title_fts ON posts USING GIN (to_tsvector('{SEARCH_TS_CONFIG}', coalesce(title, '')))",
+    "CREATE INDEX IF NOT EXISTS ix_post_archives_search_fts ON post_archives USING GIN (search_vector)",
+]
+
+
+def create_index(connection):
+    """Create the search index for the connection's dialect; other databases get none."""
+    statements = {"sqlite": SQLITE_DDL, "postgresql": POSTGRES_DDL}.get(connection.dialect.name, [])
+    for statement in statements:
+        connection.execute(text(statement))
+
+
+@event.listens_for(Base.metadata, "after_create")
+def _create_index_with_tables(target, connection, **kw):
+    create_index(connection)
+
+
+def supported(db: Session) -> bool:
+    return db.get_bind().dialect.name in ("sqlite", "postgresql")
+
+
+# ------------------- ARCHIVES -------------------
+# The message rows of an archived post are gone, and their index entries with them;
+# archive.py indexes the history it compresses as one document here instead.
+def index_archive(db: Session, post_id: int, user_id: int, content: str):
+    """Index an archived history. Its post_archives row must be flushed already."""
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite":
+        db.execute(
+            text("INSERT INTO archives_fts(rowid, content, owner) VALUES (:post_id, :content, :owner)"),
+            {"post_id": post_id, "content": content, "owner": f"u{user_id}"},
+        )
+    elif dialect == "postgresql":
+        db.execute(
+            text(f"UPDATE post_archives SET search_vector = to_tsvector('{SEARCH_TS_CONFIG}', :content) WHERE post_id = :post_id"),
+            {"post_id": post_id, "content": content},
+        )
+
+
+def unindex_archive(db: Session, post_id: int, user_id: int, content: str):
+    """Drop an archived history from the index; content must be what index_archive was given."""
+    if db.get_bind().dialect.name == "sqlite":
+        # A contentless table forgets a document only when told its exact text
+        db.execute(
+            text("INSERT INTO archives_fts(archives_fts, rowid, content, owner) VALUES ('delete', :post_id, :content, :owner)"),
+            {"post_id": post_id, "content": content, "owner": f"u{user_id}"},
+        )
+    # PostgreSQL: the vector goes with the post_archives row
+
+
+# ------------------- QUERIES -------------------
+_TERM = re.compile(r'"([^"]*)"|(\S+)')
+
+
+def parse_terms(query: str) -> List[Tuple[str, bool]]:
+    """Split a user query into (phrase, is_prefix) terms; "quoted phrases" and word* are kept."""
+    terms = []
+    for quoted, word in _TERM.findall(query):
+        phrase = quoted or word
+        prefix = not quoted and phrase.endswith("*")
+        phrase = phrase.rstrip("*") if prefix else phrase
+        prefix = prefix and len(phrase) >= SEARCH_MIN_PREFIX
+        if re.search(r"\w", phrase):
+            terms.append((phrase, prefix))
+    if not terms:
+        raise ValueError("Search query has no words")
+    return terms[:SEARCH_MAX_TERMS]
+
+
+def fts5_match(column: str, user_id: int, terms: List[Tuple[str, bool]]) -> str:
+    """FTS5 MATCH expression; every term is quoted, so user input can't inject query syntax."""
+    phrases = " ".join('"' + phrase.replace('"', '""') + '"' + ("*" if prefix else "") for phrase, prefix in terms)
+    return f"owner : u{user_id} AND {column} : ({phrases})"
+
+
+def render_highlight(value: Optional[str]) -> Optional[str]:
+    """HTML-escape text from the index, then turn the match markers into <mark> tags."""
+    if value is None:
+        return None
+    return html.escape(value).replace(MARK_START, "<mark>").replace(MARK_END, "</mark>")
+
+
+def _sqlite_search(db: Session, user_id: int, terms, limit: int, offset: int):
+    message_match = fts5_match("content", user_id, terms)
+    title_match = fts5_match("title", user_id, terms)
+    # One pass over the matches ranks the posts and picks each one's best message
+    page = db.execute(
+        text("""
+            WITH message_hits AS (
+                SELECT post_id, rowid AS message_id, MIN(rank) AS rank FROM (
+                    SELECT post_id, rowid, rank FROM messages_fts WHERE messages_fts MATCH :message_match
+                ) GROUP BY post_id
+            ), title_hits AS (
+                SELECT rowid AS post_id, NULL AS message_id, rank * :title_boost AS rank FROM posts_fts WHERE posts_fts MATCH :title_match
+            ), archive_hits AS (
+                SELECT rowid AS post_id, NULL AS message_id, rank FROM archives_fts WHERE archives_fts MATCH :message_match
+            )
+            SELECT post_id, MIN(rank) AS rank, MAX(message_id) AS message_id FROM (
+                SELECT * FROM message_hits UNION ALL SELECT * FROM title_hits UNION ALL SELECT * FROM archive_hits
+            ) GROUP BY post_id ORDER BY rank, post_id DESC LIMIT :limit OFFSET :offset
+        """),
+        {"message_match": message_match, "title_match": title_match, "title_boost": SEARCH_TITLE_BOOST, "limit": limit + 1, "offset": offset},
+    ).all()
+    post_ids = [row.post_id for row in page[:limit]]
+    if not post_ids:
+        return page, {}, {}
+
+    # Snippets for just the best message of each post on the page
+    best = [row for row in page[:limit] if row.message_id is not None]
+    snippets = {}
+    if best:
+        rows = db.execute(
+            text(f"""
+                SELECT rowid, snippet(messages_fts, 0, :start, :end, '…', {SEARCH_SNIPPET_WORDS}) AS snippet
+                FROM messages_fts WHERE messages_fts MATCH :message_match AND rowid IN :message_ids
+            """).bindparams(bindparam("message_ids", expanding=True)),
+            {"message_match": message_match, "start": MARK_START, "end": MARK_END, "message_ids": [row.message_id for row in best]},
+        ).all()
+        by_id = {row.rowid: row.snippet for row in rows}
+        snippets = {row.post_id: (row.message_id, by_id.get(row.message_id)) for row in best}
+
+    titles = dict(db.execute(
+        text("""
+            SELECT rowid, highlight(posts_fts, 0, :start, :end) FROM posts_fts
+            WHERE posts_fts MATCH :title_match AND rowid IN :post_ids
+        """).bindparams(bindparam("post_ids", expanding=True)),
+        {"title_match": title_match, "start": MARK_START, "end": MARK_END, "post_ids": post_ids},
+    ).all())
+    return page, snippets, titles
+
+
+def _postgres_search(db: Session, user_id: int, query: str, limit: int, offset: int):
+    # Expressions must read exactly as in POSTGRES_DDL for the GIN indexes to apply
+    content_vector = f"to_tsvector('{SEARCH_TS_CONFIG}', m.content)"
+    title_vector = f"to_tsvector('{SEARCH_TS_CONFIG}', coalesce(p.title, ''))"
+    tsquery = f"websearch_to_tsquery('{SEARCH_TS_CONFIG}', :query)"
+    page = db.execute(
+        text(f"""
+            SELECT post_id, MIN(rank) AS rank FROM (
+                SELECT m.post_id, -ts_rank({content_vector}, {tsquery}) AS rank
+                FROM messages m JOIN posts p ON p.id = m.post_id
+                WHERE p.user_id = :user_id AND {content_vector} @@ {tsquery}
+                UNION ALL
+                SELECT p.id AS post_id, -ts_rank({title_vector}, {tsquery}) * :title_boost AS rank
+                FROM posts p WHERE p.user_id = :user_id AND {title_vector} @@ {tsquery}
+                UNION ALL
+                SELECT a.post_id, -ts_rank(a.search_vector, {tsquery}) AS rank
+                FROM post_archives a JOIN posts p ON p.id = a.post_id
+                WHERE p.user_id = :user_id AND a.search_vector @@ {tsquery}
+            ) hits GROUP BY post_id ORDER BY rank, post_id DESC LIMIT :limit OFFSET :offset
+        """),
+        {"query": query, "user_id": user_id, "title_boost": SEARCH_TITLE_BOOST, "limit": limit + 1, "offset": offset},
+    ).all()
+    post_ids = [row.post_id for row in page[:limit]]
+    if not post_ids:
+        return page, {}, {}
+
+    options = f"StartSel={MARK_START}, StopSel={MARK_END}, MaxWords={SEARCH_SNIPPET_WORDS}, MinWords={max(1, SEARCH_SNIPPET_WORDS // 3)}"
+    best = db.execute(
+        text(f"""
+            SELECT best.post_id, best.id AS message_id, ts_headline('{SEARCH_TS_CONFIG}', m.content, {tsquery}, :options) AS snippet
+            FROM (
+                SELECT DISTINCT ON (m.post_id) m.post_id, m.id FROM messages m
+                WHERE m.post_id IN :post_ids AND {content_vector} @@ {tsquery}
+                ORDER BY m.post_id, ts_rank({content_vector}, {tsquery}) DESC
+            ) best JOIN messages m ON m.id = best.id
+        """).bindparams(bindparam("post_ids", expanding=True)),
+        {"query": query, "post_ids": post_ids, "options": options},
+    ).all()
+    snippets = {row.post_id: (row.message_id, row.snippet) for row in best}
+    titles = dict(db.execute(
+        text(f"""
+            SELECT p.id, ts_headline('{SEARCH_TS_CONFIG}', p.title, {tsquery}, :options) FROM posts p
+            WHERE p.id IN :post_ids AND {title_vector} @@ {tsquery}
+        """).bindparams(bindparam("post_ids", expanding=True)),
+        {"query": query, "post_ids": post_ids, "options": options + ", HighlightAll=true"},
+    ).all())
+    return page, snippets, titles
+
+
+def search_posts(db: Session, user_id: int, query: str, limit: int, offset: int = 0) -> Tuple[List[dict], Optional[int]]:
+    """One page of the user's posts matching query, best first.
+
+    Each item carries the post's title and best-matching message as HTML
+    with matches wrapped in <mark>; everything else in them is escaped.
+    Archived posts are found too, but a match in their archived messages
+    has no snippet until the post is opened. Returns (items, next_offset).
+    """
+    terms = parse_terms(query)
+    if db.get_bind().dialect.name == "postgresql":
+        page, snippets, titles = _postgres_search(db, user_id, query, limit, offset)
+    else:
+        page, snippets, titles = _sqlite_search(db, user_id, terms, limit, offset)
+
+    post_ids = [row.post_id for row in page[:limit]]
+    posts = {post.id: post for post in db.query(Post).filter(Post.id.in_(post_ids))} if post_ids else {}
+    message_ids = [message_id for message_id, _ in snippets.values()]
+    messages = {m.id: m for m in db.query(Message.id, Message.seq, Message.role).filter(Message.id.in_(message_ids))} if message_ids else {}
+
+    items = []
+    for row in page[:limit]:
+        post = posts.get(row.post_id)
+        if post is None:  # deleted between the index read and now
+            continue
+        message_id, snippet = snippets.get(row.post_id, (None, None))
+        message = messages.get(message_id)
+        items.append({
+            "id": post.id,
+            "title": post.title,
+            "title_html": render_highlight(titles.get(post.id)) or html.escape(post.title or ""),
+            "snippet_html": render_highlight(snippet),
+            "message_seq": message.seq if message else None,
+            "role": message.role if message else None,
+            "score": -row.rank,
+            "archived": post.archived_at is not None,
+            "created_at": post.created_at,
+        })
+    next_offset = offset + limit if len(page) > limit else None
+    return items, next_offset
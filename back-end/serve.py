@@ -0,0 +1,59 @@
+"""Production launcher: migrate once, then run several uvicorn workers.
+
+Migrations run in this process before any worker starts, so workers never
+race on DDL and boot straight into warm-up. SIGTERM is passed on to every
+worker, which stops taking traffic and drains (see lifecycle.py) within
+--graceful-timeout seconds. One worker, the lock holder (lifecycle.Leader),
+runs the batch worker and the social publisher; the rest take over if it dies.
+
+    python serve.py --workers 4 --migrate
+    WEB_CONCURRENCY=4 PORT=8000 python serve.py
+"""
+import argparse
+import os
+import time
+
+import uvicorn
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def migrate():
+    """Bring the database to the newest revision, as `alembic upgrade head` would."""
+    from alembic import command
+    from alembic.config import Config
+
+    started = time.perf_counter()
+    config = Config(os.path.join(BACKEND_DIR, "alembic.ini"))
+    config.set_main_option("script_location", os.path.join(BACKEND_DIR, "alembic"))
+    command.upgrade(config, "head")
+    print(f"migrated in {time.perf_counter() - started:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "1")))
+    parser.add_argument("--migrate", action="store_true", default=os.getenv("MIGRATE_ON_START", "false").lower() in ("1", "true", "yes"),
+                        help="run `alembic upgrade head` before starting the workers")
+    # Open streams get this long after SHUTDOWN_DELAY; DRAIN_TIMEOUT comes on top for detached generations
+    parser.add_argument("--graceful-timeout", type=float, default=float(os.getenv("GRACEFUL_TIMEOUT", "30")))
+    parser.add_argument("--log-level", default=os.getenv("LOG_LEVEL", "info"))
+    args = parser.parse_args()
+
+    os.chdir(BACKEND_DIR)
+    if args.migrate:
+        migrate()
+    uvicorn.run(
+        "main:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        log_level=args.log_level,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,352 @@
+import asyncio
+import os
+import random
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+
+import httpx
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select, tuple_, update
+
+import archive
+import chat_store
+from batch_jobs import UserRateLimiter
+from database import session_scope
+from models import Post, SocialDelivery
+
+# ------------------- CONFIG -------------------
+# start() requeues every delivery it finds sending: on one host the leader worker runs it (lifecycle.Leader),
+# with several hosts enable it on one of them
+SOCIAL_WORKER_ENABLED = os.getenv("SOCIAL_WORKER_ENABLED", "true").lower() in ("1", "true", "yes")
+# "mock" publishes nowhere, for development and benches; a platform with SOCIAL_<PLATFORM>_URL set
+# is posted to that relay (e.g. a Zapier or Buffer hook) instead
+SOCIAL_BACKEND = os.getenv("SOCIAL_BACKEND", "mock")  # mock | http
+SOCIAL_CONCURRENCY = int(os.getenv("SOCIAL_CONCURRENCY", "16"))  # deliveries in flight per process
+SOCIAL_TIMEOUT = float(os.getenv("SOCIAL_TIMEOUT", "30"))  # seconds per publish attempt
+SOCIAL_MAX_ATTEMPTS = int(os.getenv("SOCIAL_MAX_ATTEMPTS", "5"))
+SOCIAL_RETRY_BASE = float(os.getenv("SOCIAL_RETRY_BASE", "5"))  # seconds before the first retry, doubling after
+SOCIAL_RETRY_MAX = float(os.getenv("SOCIAL_RETRY_MAX", "600"))
+SOCIAL_POLL_INTERVAL = float(os.getenv("SOCIAL_POLL_INTERVAL", "1.0"))
+SOCIAL_MOCK_DELAY = float(os.getenv("SOCIAL_MOCK_DELAY", "0.2"))
+SOCIAL_MOCK_FAIL_RATE = float(os.getenv("SOCIAL_MOCK_FAIL_RATE", "0"))
+
+PLATFORM_NAMES = {"facebook": "Facebook", "twitter": "Twitter", "linkedin": "LinkedIn", "instagram": "Instagram"}
+PLATFORM_MAX_CHARS = {"facebook": 63206, "twitter": 280, "linkedin": 3000, "instagram": 2200}
+# Posts per minute per account on each platform, kept under the platforms' own limits
+PLATFORM_RATES = {
+    platform: float(os.getenv(f"SOCIAL_RATE_{platform.upper()}", default))
+    for platform, default in {"facebook": 30, "twitter": 15, "linkedin": 10, "instagram": 10}.items()
+}
+# Post columns that record a successful share; Instagram only has its deliveries
+SHARED_COLUMNS = {"facebook": "shared_facebook", "twitter": "shared_twitter", "linkedin": "shared_linkedin"}
+
+
+# ------------------- ADAPTERS -------------------
+class PublishError(Exception):
+    """A platform refused a post. Retryable errors are tried again with backoff."""
+
+    def __init__(self, message: str, retryable: bool = True, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+class MockAdapter:
+    """Accepts every post after a short delay, failing a share of them (retryably) on request."""
+
+    def __init__(self, platform: str, delay: float = SOCIAL_MOCK_DELAY, fail_rate: float = SOCIAL_MOCK_FAIL_RATE):
+        self.platform = platform
+        self.delay = delay
+        self.fail_rate = fail_rate
+        self.published = 0
+
+    async def publish(self, content: str) -> str:
+        await asyncio.sleep(self.delay)
+        if random.random() < self.fail_rate:
+            raise PublishError(f"{self.platform} is temporarily unavailable")
+        self.published += 1
+        return f"mock-{self.platform}-{uuid.uuid4().hex[:12]}"
+
+
+class HTTPAdapter:
+    """POSTs {"platform", "text"} to a relay that holds the account's credentials and answers {"id"}."""
+
+    _client: Optional[httpx.AsyncClient] = None
+
+    def __init__(self, platform: str, url: str, token: Optional[str] = None):
+        self.platform = platform
+        self.url = url
+        self.token = token
+
+    async def publish(self, content: str) -> str:
+        if HTTPAdapter._client is None:
+            HTTPAdapter._client = httpx.AsyncClient(timeout=SOCIAL_TIMEOUT)
+        headers = {"Authorization": f"Bearer {self.token}"} if self.token else {}
+        try:
+            res = await HTTPAdapter._client.post(self.url, json={"platform": self.platform, "text": content}, headers=headers)
+        except httpx.HTTPError as e:
+            raise PublishError(f"{self.platform} relay unreachable: {e!r}")
+        if res.status_code == 429 or res.status_code >= 500:
+            retry_after = res.headers.get("retry-after")
+            raise PublishError(
+                f"{self.platform} relay answered {res.status_code}",
+                retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None,
+            )
+        if res.status_code >= 400:
+            raise PublishError(f"{self.platform} relay rejected the post: {res.text[:200]}", retryable=False)
+        return str(res.json().get("id", ""))
+
+    @classmethod
+    async def close(cls):
+        if cls._client is not None:
+            await cls._client.aclose()
+        cls._client = None
+
+
+def make_adapters() -> Dict[str, object]:
+    adapters = {}
+    for platform in PLATFORM_NAMES:
+        url = os.getenv(f"SOCIAL_{platform.upper()}_URL")
+        if url:
+            adapters[platform] = HTTPAdapter(platform, url, os.getenv(f"SOCIAL_{platform.upper()}_TOKEN"))
+        elif SOCIAL_BACKEND == "mock":
+            adapters[platform] = MockAdapter(platform)
+    return adapters
+
+
+# ------------------- DELIVERIES -------------------
+def create_deliveries(db, user_id: int, post_id: int, platforms: List[str], content: str, run_at: datetime) -> List[SocialDelivery]:
+    deliveries = [
+        SocialDelivery(user_id=user_id, post_id=post_id, platform=platform, content=content, status="pending", attempts=0, run_at=run_at)
+        for platform in platforms
+    ]
+    db.add_all(deliveries)
+    db.flush()
+    return deliveries
+
+
+def delivery_to_dict(delivery: SocialDelivery) -> dict:
+    return {
+        "id": delivery.id,
+        "post_id": delivery.post_id,
+        "platform": delivery.platform,
+        "status": delivery.status,
+        "attempts": delivery.attempts,
+        "run_at": delivery.run_at,
+        "external_id": delivery.external_id,
+        "error": delivery.error,
+        "created_at": delivery.created_at,
+        "sent_at": delivery.sent_at,
+    }
+
+
+def backoff(attempts: int) -> float:
+    """Seconds before retry number `attempts`: exponential with full jitter."""
+    return random.uniform(0.5, 1.0) * min(SOCIAL_RETRY_MAX, SOCIAL_RETRY_BASE * 2 ** (attempts - 1))
+
+
+# ------------------- WORKER -------------------
+class SocialPublisher:
+    """Publishes due deliveries with bounded concurrency, in this process's event loop.
+
+    A post fanned out to several platforms becomes one delivery per platform,
+    and those run side by side. Scheduled deliveries simply have a future
+    run_at; failed attempts are pushed back the same way. Each platform has
+    its own per-account token bucket, so a burst of shares to one account
+    waits instead of tripping the platform's rate limit.
+
+    Delivery status is the checkpoint. A delivery left "sending" by a crash is
+    requeued by start(), so a post is delivered at least once; platforms that
+    accepted it just before the crash will see it twice.
+    """
+
+    def __init__(self, adapters: Dict[str, object], concurrency: int = SOCIAL_CONCURRENCY):
+        self.adapters = adapters
+        self.concurrency = concurrency
+        self.limiters = {platform: UserRateLimiter(PLATFORM_RATES[platform]) for platform in adapters}
+        self._running: Dict[asyncio.Task, str] = {}  # task -> platform
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.rate_limited = 0
+
+    # ---- lifecycle ----
+    def start(self):
+        recovered = self._recover()
+        if recovered:
+            print(f"Social publisher: requeued {recovered} interrupted deliveries")
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        tasks = list(self._running)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await HTTPAdapter.close()
+        self._task = None
+        self._wake = None
+
+    def wake(self):
+        if self._wake is not None:
+            self._wake.set()
+
+    def _recover(self) -> int:
+        with session_scope() as db:
+            recovered = db.execute(update(SocialDelivery).where(SocialDelivery.status == "sending").values(status="pending")).rowcount
+            db.commit()
+        return recovered
+
+    # ---- dispatch ----
+    async def _run(self):
+        while True:
+            try:
+                dispatched = await self._dispatch()
+            except Exception as e:
+                print(f"Social dispatch error: {e}")
+                dispatched = 0
+            if not dispatched:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=SOCIAL_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+
+    def _due(self, limit: int, limited: Set[Tuple[int, str]]) -> List[tuple]:
+        """The oldest due deliveries, leaving out the (user, platform) pairs in `limited`."""
+        with session_scope() as db:
+            query = (
+                select(SocialDelivery.id, SocialDelivery.platform, SocialDelivery.user_id)
+                .where(SocialDelivery.status == "pending", SocialDelivery.run_at <= datetime.utcnow())
+            )
+            if limited:
+                query = query.where(tuple_(SocialDelivery.user_id, SocialDelivery.platform).not_in(list(limited)))
+            return db.execute(query.order_by(SocialDelivery.run_at).limit(limit)).all()
+
+    async def _dispatch(self) -> int:
+        free = self.concurrency - len(self._running)
+        if free <= 0:
+            return 0
+        dispatched = 0
+        # Accounts found rate-limited are left out of the next page, so one account's
+        # backlog can't fill every page and keep the other accounts' deliveries waiting
+        limited: Set[Tuple[int, str]] = set()
+        while dispatched < free:
+            page = await run_in_threadpool(self._due, free * 4, limited)
+            if not page:
+                break
+            for delivery_id, platform, user_id in page:
+                if dispatched >= free:
+                    break
+                if (user_id, platform) in limited:
+                    continue
+                adapter = self.adapters.get(platform)
+                if adapter is None:
+                    await run_in_threadpool(self._settle, delivery_id, None, f"{platform} is not configured", False)
+                    continue
+                if not self.limiters[platform].try_acquire(user_id):
+                    self.rate_limited += 1
+                    limited.add((user_id, platform))
+                    continue
+                claim = await run_in_threadpool(self._claim, delivery_id)
+                if claim is None:
+                    continue
+                task = asyncio.create_task(self._process(delivery_id, adapter, claim))
+                self._running[task] = platform
+                task.add_done_callback(self._finished)
+                dispatched += 1
+        return dispatched
+
+    def _finished(self, task: asyncio.Task):
+        self._running.pop(task, None)
+        self.wake()
+
+    def _claim(self, delivery_id: int) -> Optional[dict]:
+        with session_scope() as db:
+            claimed = db.execute(
+                update(SocialDelivery)
+                .where(SocialDelivery.id == delivery_id, SocialDelivery.status == "pending")
+                .values(status="sending", attempts=SocialDelivery.attempts + 1)
+            ).rowcount
+            if not claimed:
+                return None
+            delivery = db.get(SocialDelivery, delivery_id)
+            db.commit()
+            return {"content": delivery.content, "attempts": delivery.attempts}
+
+    # ---- deliveries ----
+    async def _process(self, delivery_id: int, adapter, claim: dict):
+        try:
+            external_id = await asyncio.wait_for(adapter.publish(claim["content"]), SOCIAL_TIMEOUT)
+        except asyncio.CancelledError:
+            # Shutting down: leave it for the next start
+            await run_in_threadpool(self._requeue, delivery_id, datetime.utcnow())
+            raise
+        except PublishError as e:
+            await self._failed(delivery_id, claim, str(e), e.retryable, e.retry_after)
+            return
+        except Exception as e:
+            await self._failed(delivery_id, claim, repr(e), True, None)
+            return
+        await run_in_threadpool(self._settle, delivery_id, external_id, None, True)
+        self.sent += 1
+
+    async def _failed(self, delivery_id: int, claim: dict, error: str, retryable: bool, retry_after: Optional[float]):
+        print(f"Social delivery {delivery_id} attempt {claim['attempts']} failed: {error}")
+        if retryable and claim["attempts"] < SOCIAL_MAX_ATTEMPTS:
+            delay = retry_after if retry_after is not None else backoff(claim["attempts"])
+            await run_in_threadpool(self._requeue, delivery_id, datetime.utcnow() + timedelta(seconds=delay), error)
+            self.retried += 1
+        else:
+            await run_in_threadpool(self._settle, delivery_id, None, error, False)
+            self.failed += 1
+
+    def _requeue(self, delivery_id: int, run_at: datetime, error: Optional[str] = None):
+        with session_scope() as db:
+            values = {"status": "pending", "run_at": run_at}
+            if error is not None:
+                values["error"] = error[:500]
+            db.execute(update(SocialDelivery).where(SocialDelivery.id == delivery_id).values(**values))
+            db.commit()
+
+    def _settle(self, delivery_id: int, external_id: Optional[str], error: Optional[str], sent: bool):
+        """Record the outcome on the delivery, the post's shared_* flag and its chat history, together."""
+        with session_scope() as db:
+            delivery = db.get(SocialDelivery, delivery_id)
+            if delivery is None:  # the post was deleted meanwhile
+                return
+            post = db.get(Post, delivery.post_id)
+            if post is not None:
+                archive.rehydrate(db, post)  # the outcome is appended to its history
+            name = PLATFORM_NAMES.get(delivery.platform, delivery.platform)
+            if sent:
+                delivery.status, delivery.external_id, delivery.error, delivery.sent_at = "sent", external_id, None, datetime.utcnow()
+                message = f"✅ Content successfully posted to {name}."
+                column = SHARED_COLUMNS.get(delivery.platform)
+                if column:
+                    db.execute(update(Post).where(Post.id == delivery.post_id).values({column: True}))
+            else:
+                delivery.status, delivery.error = "failed", (error or "")[:500]
+                message = f"❌ Could not post to {name}: {error}"
+            chat_store.append_message(db, delivery.post_id, {"role": "system", "content": message})
+            chat_store.bump_version(db, delivery.post_id)
+            db.commit()
+
+    def stats(self) -> dict:
+        in_flight = {}
+        for platform in self._running.values():
+            in_flight[platform] = in_flight.get(platform, 0) + 1
+        return {
+            "in_flight": len(self._running),
+            "in_flight_by_platform": in_flight,
+            "sent": self.sent,
+            "retried": self.retried,
+            "failed": self.failed,
+            "rate_limited": self.rate_limited,
+        }
@@ -0,0 +1,155 @@
+import asyncio
+import json
+import os
+import secrets
+import time
+from collections import deque
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+# ------------------- CONFIG -------------------
+# Events kept per stream for replay; older ones are covered by a "snapshot" event on resume
+STREAM_BUFFER_EVENTS = int(os.getenv("STREAM_BUFFER_EVENTS", "1000"))
+# How long a finished stream stays resumable (seconds)
+STREAM_BUFFER_TTL = float(os.getenv("STREAM_BUFFER_TTL", "120"))
+# Stop generating when nobody has been reading for this long (seconds)
+STREAM_ABANDON_AFTER = float(os.getenv("STREAM_ABANDON_AFTER", "60"))
+SSE_RETRY_MS = int(os.getenv("SSE_RETRY_MS", "2000"))
+
+
+def format_event(stream_id: str, seq: Optional[int], event: str, data: dict) -> bytes:
+    """One Server-Sent Event; ids are "<stream_id>:<seq>" so Last-Event-ID names both."""
+    lines = []
+    if seq is not None:
+        lines.append(f"id: {stream_id}:{seq}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False)}")
+    return ("\n".join(lines) + "\n\n").encode("utf-8")
+
+
+def parse_event_id(value: Optional[str]) -> Tuple[Optional[str], int]:
+    """Split a Last-Event-ID into (stream_id, seq); seq is -1 when absent or malformed."""
+    if not value or ":" not in value:
+        return None, -1
+    stream_id, _, seq = value.rpartition(":")
+    try:
+        return stream_id, int(seq)
+    except ValueError:
+        return stream_id, -1
+
+
+# ------------------- BUFFERS -------------------
+class StreamBuffer:
+    """Events of one generation, kept so readers can attach, drop and resume.
+
+    The generation runs as its own task and publishes into the buffer; HTTP
+    responses only follow it, so a dropped connection costs nothing but a
+    reconnect.
+    """
+
+    def __init__(self, stream_id: str, user_id: int, max_events: int = STREAM_BUFFER_EVENTS):
+        self.stream_id = stream_id
+        self.user_id = user_id
+        self.events = deque(maxlen=max_events)  # (seq, event, data)
+        self.next_seq = 0
+        self.tokens = []  # every token so far, joined only for snapshots
+        self.done = False
+        self.finished_at: Optional[float] = None
+        self.readers = 0
+        self.idle_since = time.monotonic()
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    def publish(self, event: str, data: dict) -> int:
+        seq = self.next_seq
+        self.next_seq += 1
+        if event == "token":
+            self.tokens.append(data["content"])
+        self.events.append((seq, event, data))
+        self._changed.set()
+        self._changed = asyncio.Event()
+        return seq
+
+    def finish(self):
+        self.done = True
+        self.finished_at = time.monotonic()
+        self._changed.set()
+
+    def abandoned(self) -> bool:
+        return self.readers == 0 and time.monotonic() - self.idle_since > STREAM_ABANDON_AFTER
+
+    async def follow(self, after_seq: int = -1) -> AsyncIterator[bytes]:
+        """Yield formatted events after after_seq, then live ones until the stream ends.
+
+        A reader further behind than the buffer reaches first gets a snapshot
+        event carrying all content up to the oldest buffered event; clients
+        replace what they have with it.
+        """
+        self.readers += 1
+        try:
+            while True:
+                changed = self._changed
+                oldest = self.events[0][0] if self.events else self.next_seq
+                if after_seq + 1 < oldest:
+                    buffered = sum(1 for _, event, _ in self.events if event == "token")
+                    content = "".join(self.tokens[: len(self.tokens) - buffered])
+                    after_seq = oldest - 1
+                    yield format_event(self.stream_id, after_seq, "snapshot", {"content": content})
+                    continue
+                pending = [e for e in self.events if e[0] > after_seq]
+                if pending:
+                    # Everything published since the last wake-up goes out as one write
+                    yield b"".join(format_event(self.stream_id, seq, event, data) for seq, event, data in pending)
+                    after_seq = pending[-1][0]
+                if self.done and after_seq >= self.next_seq - 1:
+                    return
+                if not pending:
+                    await changed.wait()
+        finally:
+            self.readers -= 1
+            self.idle_since = time.monotonic()
+
+    async def sse(self, after_seq: int = -1) -> AsyncIterator[bytes]:
+        """Response body for a reader: the reconnect delay, then follow()."""
+        yield f"retry: {SSE_RETRY_MS}\n\n".encode("utf-8")
+        async for event in self.follow(after_seq):
+            yield event
+
+
+class StreamRegistry:
+    def __init__(self, ttl: float = STREAM_BUFFER_TTL):
+        self.ttl = ttl
+        self._buffers: Dict[str, StreamBuffer] = {}
+
+    def create(self, user_id: int) -> StreamBuffer:
+        self.sweep()
+        buffer = StreamBuffer(secrets.token_urlsafe(12), user_id)
+        self._buffers[buffer.stream_id] = buffer
+        return buffer
+
+    def get(self, stream_id: str, user_id: int) -> Optional[StreamBuffer]:
+        buffer = self._buffers.get(stream_id)
+        return buffer if buffer is not None and buffer.user_id == user_id else None
+
+    def sweep(self):
+        now = time.monotonic()
+        for stream_id in [s for s, b in self._buffers.items() if b.done and now - b.finished_at > self.ttl]:
+            del self._buffers[stream_id]
+
+    def running_tasks(self) -> list:
+        return [b.task for b in self._buffers.values() if b.task is not None and not b.task.done()]
+
+    async def cancel_all(self):
+        tasks = self.running_tasks()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "streams": len(self._buffers),
+            "running": sum(1 for b in self._buffers.values() if not b.done),
+            "readers": sum(b.readers for b in self._buffers.values()),
+        }
+
+
+stream_registry = StreamRegistry()
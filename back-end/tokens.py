@@ -0,0 +1,37 @@
+import os
+
+try:
+    import tiktoken
+except ImportError:  # optional: fall back to a character-based estimate
+    tiktoken = None
+
+TOKEN_ENCODING = os.getenv("TOKEN_ENCODING", "cl100k_base")
+# Role/separator tokens the chat format adds around every message
+MESSAGE_OVERHEAD = 4
+
+_encoder = None
+_encoder_failed = False
+
+
+def _get_encoder():
+    global _encoder, _encoder_failed
+    if _encoder is None and tiktoken is not None and not _encoder_failed:
+        try:
+            _encoder = tiktoken.get_encoding(TOKEN_ENCODING)
+        except Exception:
+            # tiktoken downloads its BPE files on first use; offline workers estimate instead
+            _encoder_failed = True
+    return _encoder
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    encoder = _get_encoder()
+    if encoder is not None:
+        return len(encoder.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+def count_message_tokens(message: dict) -> int:
+    return count_tokens(message.get("content") or "") + MESSAGE_OVERHEAD
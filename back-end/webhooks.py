@@ -0,0 +1,406 @@
+"""Payment webhook inbox and the consumer that applies it.
+
+The endpoint only stores the event (keyed by source and sale, so provider
+retries are no-ops) and returns; WebhookConsumer applies stored events in
+batches. Applying an event, updating the user and writing its Transaction
+commit together, and transactions.event_id is unique, so every event takes
+effect exactly once however often it is delivered or replayed.
+
+Replay tool, for events that failed (e.g. a buyer who registered later) or
+that were recovered from the provider's dashboard as JSONL form payloads:
+
+    python webhooks.py requeue [--since 2026-10-01] [--id 42]
+    python webhooks.py import events.jsonl
+    python webhooks.py apply
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from auth_cache import auth_cache
+from database import session_scope
+from models import Transaction, User, WebhookEvent
+
+# ------------------- CONFIG -------------------
+# With several server processes the consumer may run in all of them; the unique event_id keeps it exactly-once
+WEBHOOK_WORKER_ENABLED = os.getenv("WEBHOOK_WORKER_ENABLED", "true").lower() in ("1", "true", "yes")
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", "200"))  # events applied per transaction
+WEBHOOK_INBOX_BATCH = int(os.getenv("WEBHOOK_INBOX_BATCH", "500"))  # received events stored per INSERT
+# Seconds between looks at an idle inbox; a flood is applied back to back, this many at a time
+WEBHOOK_POLL_INTERVAL = float(os.getenv("WEBHOOK_POLL_INTERVAL", "1.0"))
+
+
+# ------------------- PARSING -------------------
+def _parse_time(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return parsed.astimezone(timezone.utc).replace(tzinfo=None) if parsed.tzinfo else parsed
+
+
+def gumroad_event(form: Dict[str, str]) -> dict:
+    """Inbox row for a Gumroad ping.
+
+    Keyed by sale_id (a refund of the sale is a separate event); pings
+    without one are keyed by a digest of the payload, so identical
+    retries still collapse.
+    """
+    payload = json.dumps(form, sort_keys=True)
+    sale_id = form.get("sale_id")
+    if sale_id:
+        key = f"{sale_id}:refund" if form.get("refunded") == "true" else sale_id
+    else:
+        key = "sha256:" + hashlib.sha256(payload.encode("utf-8")).hexdigest()[:40]
+    return {
+        "source": "gumroad",
+        "event_key": key,
+        "email": form.get("email"),
+        "sale_at": _parse_time(form.get("sale_timestamp")),
+        "payload": payload,
+        "status": "pending",
+        "attempts": 0,
+        "received_at": datetime.utcnow(),
+    }
+
+
+# ------------------- INBOX -------------------
+def store_events(rows: List[dict]) -> List[bool]:
+    """INSERT the rows, skipping ones already stored; returns which were new.
+
+    One statement for the whole list on SQLite and PostgreSQL (ON CONFLICT
+    DO NOTHING ... RETURNING), row by row elsewhere.
+    """
+    with session_scope() as db:
+        dialect = db.get_bind().dialect.name
+        if dialect in ("sqlite", "postgresql"):
+            if dialect == "sqlite":
+                from sqlalchemy.dialects.sqlite import insert as upsert
+            else:
+                from sqlalchemy.dialects.postgresql import insert as upsert
+            first = {}
+            for index, row in enumerate(rows):
+                first.setdefault((row["source"], row["event_key"]), index)
+            stored = db.execute(
+                upsert(WebhookEvent)
+                .on_conflict_do_nothing(index_elements=["source", "event_key"])
+                .returning(WebhookEvent.source, WebhookEvent.event_key),
+                [rows[index] for index in sorted(first.values())],
+            ).all()
+            db.commit()
+            inserted = {tuple(row) for row in stored}
+            return [first[(row["source"], row["event_key"])] == index and (row["source"], row["event_key"]) in inserted
+                    for index, row in enumerate(rows)]
+        new = []
+        for row in rows:
+            try:
+                with db.begin_nested():
+                    db.execute(insert(WebhookEvent), row)
+                new.append(True)
+            except IntegrityError:
+                new.append(False)
+        db.commit()
+        return new
+
+
+class WebhookInbox:
+    """Stores received events with group commit.
+
+    Requests arriving while an INSERT is running queue up and go out
+    together in the next one, so a flood of pings holds one pooled
+    connection instead of one each. put() returns only once the row is
+    committed: a 200 to the provider means the event is durable.
+    """
+
+    def __init__(self, batch_size: int = WEBHOOK_INBOX_BATCH):
+        self.batch_size = batch_size
+        self._queue: List[tuple] = []
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.received = 0
+        self.duplicates = 0
+        self.inserts = 0
+
+    async def put(self, row: dict) -> bool:
+        """Store one event; False when it was already in the inbox."""
+        if self._task is None:
+            new = (await run_in_threadpool(store_events, [row]))[0]
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self._queue.append((row, future))
+            self._wake.set()
+            new = await future
+        self.received += 1
+        if not new:
+            self.duplicates += 1
+        return new
+
+    async def _run(self):
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            while self._queue:
+                batch, self._queue = self._queue[:self.batch_size], self._queue[self.batch_size:]
+                try:
+                    new = await run_in_threadpool(store_events, [row for row, _ in batch])
+                except BaseException as e:
+                    # The requests fail and the provider retries; if the INSERT did land, those are duplicates
+                    if not isinstance(e, asyncio.CancelledError):
+                        print(f"Webhook inbox write error: {e}")
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_exception(e if isinstance(e, Exception) else RuntimeError("webhook inbox stopped"))
+                    if not isinstance(e, Exception):
+                        raise
+                    continue
+                self.inserts += 1
+                for (_, future), is_new in zip(batch, new):
+                    if not future.done():
+                        future.set_result(is_new)
+
+    def start(self):
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        self._wake = None
+        # Whatever was still queued goes out directly
+        queued, self._queue = self._queue, []
+        if queued:
+            new = await run_in_threadpool(store_events, [row for row, _ in queued])
+            for (_, future), is_new in zip(queued, new):
+                if not future.done():
+                    future.set_result(is_new)
+
+    def stats(self) -> dict:
+        return {
+            "received": self.received,
+            "duplicates": self.duplicates,
+            "queued": len(self._queue),
+            "inserts": self.inserts,
+        }
+
+
+# ------------------- CONSUMER -------------------
+class WebhookConsumer:
+    """Applies pending inbox events in batches, oldest first.
+
+    The newest sale per email decides the plan: an event whose sale is older
+    than one already applied (delivered out of order) still gets its
+    Transaction but leaves the plan alone ("superseded"). Events for unknown
+    emails are marked failed and can be requeued once the user exists.
+    """
+
+    def __init__(self, products: Dict[str, str], plan_credits: Dict[str, Optional[int]], batch_size: int = WEBHOOK_BATCH_SIZE):
+        self.products = products
+        self.plan_credits = plan_credits
+        self.batch_size = batch_size
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.counts = {"applied": 0, "superseded": 0, "failed": 0}
+        self.batches = 0
+
+    # ---- lifecycle ----
+    def start(self):
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        self._wake = None
+
+    def wake(self):
+        if self._wake is not None:
+            self._wake.set()
+
+    async def _run(self):
+        while True:
+            try:
+                applied = await run_in_threadpool(self.apply_pending)
+            except Exception as e:
+                print(f"Webhook consumer error: {e}")
+                applied = 0
+            if not applied:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=WEBHOOK_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+
+    # ---- applying ----
+    def apply_pending(self) -> int:
+        """Apply the next batch; returns how many events it settled."""
+        with session_scope() as db:
+            ids = db.execute(
+                select(WebhookEvent.id)
+                .where(WebhookEvent.status == "pending")
+                .order_by(WebhookEvent.id)
+                .limit(self.batch_size)
+            ).scalars().all()
+        if not ids:
+            return 0
+        try:
+            emails = self._apply(ids)
+        except IntegrityError as e:
+            # Another consumer applied some of them first; whatever is still pending comes round again
+            print(f"Webhook batch conflict: {e}")
+            return len(ids)
+        except Exception as e:
+            print(f"Webhook batch error, applying one by one: {e}")
+            emails = set()
+            for event_id in ids:
+                try:
+                    emails |= self._apply([event_id])
+                except IntegrityError:
+                    continue
+                except Exception as e:
+                    self._fail(event_id, str(e))
+        self.batches += 1
+        for email in emails:
+            auth_cache.invalidate(email)
+        return len(ids)
+
+    def _apply(self, ids: List[int]) -> set:
+        """Settle the given events in one transaction; returns the emails whose plan changed."""
+        with session_scope() as db:
+            events = db.execute(
+                select(WebhookEvent).where(WebhookEvent.id.in_(ids), WebhookEvent.status == "pending")
+            ).scalars().all()
+            emails = {event.email for event in events if event.email}
+            users = {user.email: user for user in db.execute(select(User).where(User.email.in_(emails))).scalars()}
+            latest = dict(db.execute(
+                select(WebhookEvent.email, func.max(WebhookEvent.sale_at))
+                .where(WebhookEvent.email.in_(emails), WebhookEvent.status == "applied", ~WebhookEvent.event_key.endswith(":refund"))
+                .group_by(WebhookEvent.email)
+            ).all())
+
+            now = datetime.utcnow()
+            transactions = []
+            changed = set()
+            counts = dict.fromkeys(self.counts, 0)
+            for event in sorted(events, key=lambda e: (e.sale_at or e.received_at, e.id)):
+                event.attempts += 1
+                user = users.get(event.email)
+                if user is None:
+                    event.status, event.error = "failed", "user not found"
+                    counts["failed"] += 1
+                    continue
+                payload = json.loads(event.payload)
+                plan_name = self.products.get(payload.get("product_id"))
+                refunded = payload.get("refunded") == "true"
+                transactions.append({
+                    "user_id": user.id,
+                    "amount": (-1 if refunded else 1) * int(payload.get("price") or 0) / 100,
+                    "currency": (payload.get("currency") or "usd").lower(),
+                    "status": "refunded" if refunded else "succeeded",
+                    "plan_name": plan_name,
+                    "description": f"Gumroad sale {payload.get('sale_id') or event.event_key}",
+                    "event_id": event.id,
+                    "created_at": now,
+                })
+                newest = latest.get(event.email)
+                if not refunded and event.sale_at is not None and newest is not None and event.sale_at < newest:
+                    event.status = "superseded"
+                    counts["superseded"] += 1
+                else:
+                    if not refunded:
+                        self._upgrade(user, plan_name)
+                        changed.add(user.email)
+                        if event.sale_at is not None:
+                            latest[event.email] = event.sale_at
+                    event.status = "applied"
+                    counts["applied"] += 1
+                event.error = None
+                event.applied_at = now
+            if transactions:
+                db.execute(insert(Transaction), transactions)
+            db.commit()
+        for status, count in counts.items():
+            self.counts[status] += count
+        return changed
+
+    def _upgrade(self, user: User, plan_name: Optional[str]):
+        if plan_name in ("starter", "pro"):
+            user.plan = plan_name
+            user.credit_remaining = self.plan_credits[plan_name]
+        elif plan_name == "flexible":
+            user.plan = "flexible"
+            if not user.credit_remaining:
+                user.credit_remaining = 0
+
+    def _fail(self, event_id: int, error: str):
+        with session_scope() as db:
+            db.execute(
+                update(WebhookEvent)
+                .where(WebhookEvent.id == event_id, WebhookEvent.status == "pending")
+                .values(status="failed", error=error[:500], attempts=WebhookEvent.attempts + 1)
+            )
+            db.commit()
+        self.counts["failed"] += 1
+
+    def stats(self) -> dict:
+        return {"enabled": self._task is not None, "batches": self.batches, **self.counts}
+
+
+# ------------------- REPLAY -------------------
+def requeue(since: Optional[datetime] = None, ids: Optional[List[int]] = None) -> int:
+    """Put failed events back to pending. Applied and superseded ones stay put: their Transaction exists."""
+    query = update(WebhookEvent).where(WebhookEvent.status == "failed").values(status="pending", error=None)
+    if since is not None:
+        query = query.where(WebhookEvent.received_at >= since)
+    if ids:
+        query = query.where(WebhookEvent.id.in_(ids))
+    with session_scope() as db:
+        count = db.execute(query).rowcount
+        db.commit()
+    return count
+
+
+def _cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    requeue_parser = commands.add_parser("requeue", help="put failed events back to pending")
+    requeue_parser.add_argument("--since", type=datetime.fromisoformat, help="only events received after this time")
+    requeue_parser.add_argument("--id", type=int, action="append", dest="ids")
+    import_parser = commands.add_parser("import", help="store Gumroad pings from a JSONL file of form payloads")
+    import_parser.add_argument("file")
+    commands.add_parser("apply", help="apply every pending event now, without a server")
+    args = parser.parse_args()
+
+    if args.command == "requeue":
+        print(f"requeued {requeue(args.since, args.ids)} events")
+    elif args.command == "import":
+        with open(args.file) as f:
+            rows = [gumroad_event(json.loads(line)) for line in f if line.strip()]
+        new = []
+        for start in range(0, len(rows), WEBHOOK_INBOX_BATCH):
+            new += store_events(rows[start:start + WEBHOOK_INBOX_BATCH])
+        print(f"stored {sum(new)} new events, {len(new) - sum(new)} already in the inbox")
+    elif args.command == "apply":
+        from main import GUMROAD_PRODUCTS, PLAN_CREDITS
+
+        consumer = WebhookConsumer(GUMROAD_PRODUCTS, PLAN_CREDITS)
+        while consumer.apply_pending():
+            pass
+        print(consumer.stats())
+
+
+if __name__ == "__main__":
+    _cli()
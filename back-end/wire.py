@@ -0,0 +1,224 @@
+import asyncio
+import gzip
+import json
+import os
+from typing import AsyncIterator, List, Optional
+
+from fastapi.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # optional: the stdlib encoder is used without it
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:  # optional: gzip only without it
+    zstandard = None
+
+# ------------------- CONFIG -------------------
+COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "true").lower() in ("1", "true", "yes")
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))  # bytes; smaller bodies aren't worth a header
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "5"))
+ZSTD_LEVEL = int(os.getenv("ZSTD_LEVEL", "3"))
+# Bodies above this are compressed on the threadpool instead of the event loop
+COMPRESS_OFFLOAD_SIZE = int(os.getenv("COMPRESS_OFFLOAD_SIZE", str(256 * 1024)))
+COMPRESSIBLE_TYPES = ("application/json", "text/plain", "text/html", "text/css", "application/javascript")
+# Streamed generation output: chunks are held back until this many characters or seconds have built up
+STREAM_FLUSH_CHARS = int(os.getenv("STREAM_FLUSH_CHARS", "512"))
+STREAM_FLUSH_INTERVAL = float(os.getenv("STREAM_FLUSH_INTERVAL", "0.05"))
+
+
+# ------------------- JSON -------------------
+class RawJSON:
+    """Already-encoded JSON, written into a response as is instead of being escaped as a string."""
+
+    __slots__ = ("data",)
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+
+def _default(value):
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _encode(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+def dumps(obj) -> bytes:
+    """JSON bytes of obj, splicing in any RawJSON values found in its dicts and lists."""
+    if isinstance(obj, RawJSON):
+        return obj.data
+    if isinstance(obj, dict) and any(isinstance(v, (RawJSON, dict, list)) for v in obj.values()):
+        return b"{" + b",".join(_encode(str(k)) + b":" + dumps(v) for k, v in obj.items()) + b"}"
+    if isinstance(obj, list) and any(isinstance(v, (RawJSON, dict, list)) for v in obj):
+        return b"[" + b",".join(dumps(v) for v in obj) + b"]"
+    return _encode(obj)
+
+
+def join_objects(objects: List[bytes]) -> RawJSON:
+    """A JSON array of already-encoded values."""
+    return RawJSON(b"[" + b",".join(objects) + b"]")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with dumps(): orjson when installed, and RawJSON values spliced in.
+
+    Handlers return it directly to skip FastAPI's jsonable_encoder pass too;
+    the content must then already be plain JSON types, datetimes and RawJSON.
+    """
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+# ------------------- COMPRESSION -------------------
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """zstd when the client takes it and zstandard is installed, else gzip, else None."""
+    offered = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        offered[name.strip()] = q
+    if zstandard is not None and offered.get("zstd", 0) > 0:
+        return "zstd"
+    if offered.get("gzip", offered.get("*", 0)) > 0:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+class CompressionMiddleware:
+    """Compresses complete responses above COMPRESS_MIN_SIZE with the best encoding the client accepts.
+
+    Only bodies sent in one piece are compressed, so streamed generations,
+    SSE and file downloads (with their Range support) pass through
+    untouched. A strong ETag becomes weak on the compressed variant, as
+    it no longer names these exact bytes.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not COMPRESSION_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            # First body message: decide
+            passthrough = True
+            headers = MutableHeaders(raw=start["headers"])
+            body = message.get("body", b"")
+            content_type = headers.get("content-type", "").split(";")[0].strip()
+            if (
+                message.get("more_body")
+                or len(body) < COMPRESS_MIN_SIZE
+                or "content-encoding" in headers
+                or content_type not in COMPRESSIBLE_TYPES
+            ):
+                await send(start)
+                await send(message)
+                return
+            if len(body) > COMPRESS_OFFLOAD_SIZE:
+                body = await run_in_threadpool(compress, body, encoding)
+            else:
+                body = compress(body, encoding)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(body))
+            headers.add_vary_header("Accept-Encoding")
+            etag = headers.get("etag")
+            if etag and not etag.startswith("W/"):
+                headers["ETag"] = f"W/{etag}"
+            await send(start)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_wrapper)
+
+
+# ------------------- STREAMING -------------------
+async def coalesce(chunks: AsyncIterator[str], max_chars: int = STREAM_FLUSH_CHARS, max_delay: float = STREAM_FLUSH_INTERVAL) -> AsyncIterator[str]:
+    """Regroup a token stream into fewer, larger writes.
+
+    The first chunk goes out at once, so time to first token is unchanged.
+    After that chunks are buffered until max_chars have built up or
+    max_delay has passed since the oldest of them, whichever comes first;
+    an upstream pause flushes what is held rather than sitting on it.
+    The next chunk is awaited in a task so the delay can fire between
+    chunks; closing this generator cancels that read and closes `chunks`.
+    """
+    loop = asyncio.get_running_loop()
+    iterator = chunks.__aiter__()
+    pending: Optional[asyncio.Future] = None
+    buffer: List[str] = []
+    size = 0
+    deadline = 0.0
+    first = True
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            if buffer:
+                done, _ = await asyncio.wait((pending,), timeout=max(0.0, deadline - loop.time()))
+                if not done:
+                    yield "".join(buffer)
+                    buffer, size = [], 0
+                    continue
+            try:
+                content = await pending
+            except StopAsyncIteration:
+                break
+            finally:
+                if pending.done():
+                    pending = None
+            if first:
+                first = False
+                yield content
+                continue
+            if not buffer:
+                deadline = loop.time() + max_delay
+            buffer.append(content)
+            size += len(content)
+            if size >= max_chars:
+                yield "".join(buffer)
+                buffer, size = [], 0
+        if buffer:
+            yield "".join(buffer)
+    finally:
+        if pending is not None and not pending.done():
+            pending.cancel()
+            await asyncio.gather(pending, return_exceptions=True)
+        if hasattr(chunks, "aclose"):
+            await chunks.aclose()